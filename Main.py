@@ -1,4 +1,4 @@
-from discord import Intents, Interaction, Member, Message, Reaction
+from discord import Intents, Interaction, Member, Message, RawBulkMessageDeleteEvent, RawMessageDeleteEvent, RawMessageUpdateEvent, Reaction, StageChannel, TextChannel, Thread, VoiceChannel
 from discord.app_commands import describe
 from discord.ext.commands import Bot # type: ignore
 from os.path import abspath, dirname
@@ -7,9 +7,14 @@ from sys import argv
 from typing import Literal
 
 from Settings import *
+from src.components.autosaver import Autosaver
+from src.components.diskCache import DiskCache
+from src.components.embedder import Embedder
+from src.components.outbox import Outbox
+from src.components.warmup import Warmup
 from src.messages import *
 from src.reactions import *
-from Translations import MainTexts, RequestsTexts
+from Translations import MainTexts, MessagesTexts, RequestsTexts
 
 if len(argv) < 1: raise RuntimeError(MainTexts.NO_ARGUMENTS_FOUND[LANGUAGE])
 CURRENT_DIRECTORY = abspath(dirname(argv[0]))
@@ -22,22 +27,43 @@ intents.message_content = True
 
 class _Bot(Bot):
 	async def setup_hook(self):
-		await self.tree.sync()
+		await Discord.syncCommands(DISCORD_COMMAND_HASH_FILEPATH, bot=self)
+		if METRICS_HTTP_PORT is not None: await metrics.serve(METRICS_HTTP_HOST, METRICS_HTTP_PORT)
+		warmup.start()
+		if autosaver is not None: autosaver.start()
+
+	async def close(self):
+		await super().close()
+		await metrics.stop()
+		if autosaver is not None: await autosaver.stop()
+		if diskCache is not None: diskCache.close()
+		executor.shutdown()
 
 bot = _Bot(command_prefix="/", intents=intents)
 
 
-ai = AI(AI_API_KEY, AI_SYSTEM_PROMPT, AI_TEMPERATURE, AI_MAX_INPUT_CHARACTERS, AI_MAX_OUTPUT_CHARACTERS) if AI_API_KEY and AI_SYSTEM_PROMPT else None
-cooldown = Cooldown(COOLDOWN_DURATION, COOLDOWN_CHECK_INTERVAL, COOLDOWN_MAX_QUERIES_BEFORE_ACTIVATION)
-cache = Cache(CACHE_MAX_SIZE, CACHE_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, CACHE_FILEPATH)
-vectorstore = Vectorstore(VECTORSTORE_FILEPATH, VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD, VECTORSTORE_SEGMENT_SIZE)
+metrics = Metrics()
+Discord.configureMessageCache(DISCORD_MESSAGE_CACHE_SIZE, DISCORD_MESSAGE_CACHE_EXPIRATION_TIME)
+ai = AI(AI_API_KEY, AI_SYSTEM_PROMPT, AI_TEMPERATURE, AI_MAX_INPUT_CHARACTERS, AI_MAX_OUTPUT_CHARACTERS, metrics) if AI_API_KEY and AI_SYSTEM_PROMPT else None
+embedder = Embedder(EMBEDDING_MODEL_NAME, EMBEDDING_THREADS, EMBEDDING_BATCH_SIZE)
+executor = Executor(EXECUTOR_MAX_WORKERS, EXECUTOR_MAX_CONCURRENT_QUERIES)
+cooldown = Cooldown(COOLDOWN_LIMITS, COOLDOWN_MAX_TRACKED_KEYS)
+diskCache = DiskCache(CACHE_DISK_FILEPATH, CACHE_DISK_MAX_SIZE, CACHE_DISK_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE, deferLoading=True) if CACHE_DISK_FILEPATH else None
+cache = Cache(embedder, CACHE_MAX_SIZE, CACHE_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, CACHE_FILEPATH, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE, diskCache, deferLoading=True)
+reranker = Reranker(RERANKER_MODEL_NAME, EMBEDDING_THREADS, RERANKER_CACHE_SIZE) if RERANKER_MODEL_NAME else None
+inFlightQueries: SingleFlight[str] = SingleFlight(CACHE_SEMANTIC_SIMILARITY_THRESHOLD if CACHE_COALESCE_SIMILAR_QUERIES else None)
+vectorstore = Vectorstore(embedder, VECTORSTORE_FILEPATH, VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD, VECTORSTORE_SEGMENT_SIZE, VECTORSTORE_LOG_COMPACTION_SIZE, VECTORSTORE_INDEX_TYPE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_LEXICAL_SEARCH, deferLoading=True)
 # Groups
 trustedGroup = Group(GROUPS_TRUSTED_IDS_FILEPATH)
 blockedGroup = Group(GROUPS_BLOCKED_IDS_FILEPATH)
 permittingGroup = Group(GROUPS_PERMITTING_IDS_FILEPATH)
 # Requests
 permissionRequests = Requests(permittingGroup, RequestsTexts.PERMISSION_REQUEST[LANGUAGE], REQUESTS_PERMITTING_FILEPATH)
-vectorstoreRequests = Requests(vectorstore, RequestsTexts.VECTORSTORE_REQUEST[LANGUAGE], REQUESTS_VECTORSTORE_FILEPATH)
+vectorstoreRequests = Requests(vectorstore, RequestsTexts.VECTORSTORE_REQUEST[LANGUAGE], REQUESTS_VECTORSTORE_FILEPATH, REQUESTS_MAX_PENDING_PER_REQUESTER)
+# Models, the cache, and the vectorstore are loaded in the background once connected, so that the bot comes online immediately
+warmup = Warmup((("embedder", embedder.load), *((("cache", cache.load),) if CACHE_FILEPATH is not None else ()), *((("diskCache", diskCache.load),) if diskCache is not None else ()), *((("vectorstore", vectorstore.load),) if VECTORSTORE_FILEPATH is not None else ()), *((("reranker", reranker.load),) if reranker is not None else ())), executor, metrics)
+outbox = Outbox(bot, DISCORD_DELETION_BATCHING_DELAY, metrics)
+autosaver = Autosaver((blockedGroup, cache, permittingGroup, permissionRequests, trustedGroup, vectorstore, vectorstoreRequests), AUTOSAVE_INTERVAL, executor, metrics) if AUTOSAVE_INTERVAL is not None else None
 
 @bot.event
 async def on_message(message: Message) -> None:
@@ -67,9 +93,10 @@ async def on_message(message: Message) -> None:
 		case "help":
 			return await message_help(message, commandSubcommandString[1] if len(commandSubcommandString) >= 2 else None)
 		case "permit":
-			return await reaction_newOrUpdateRequest(message, message, requests=permissionRequests)
+			return await reaction_newOrUpdateRequest(message, message, requests=permissionRequests, bot=bot)
 		case _:
-			return await message_ask(message, originalInput, ai=ai, cache=cache, cooldown=cooldown, vectorstore=vectorstore)
+			if not warmup.isReady: return await message_warmingUp(message)
+			return await message_ask(message, originalInput, ai=ai, cache=cache, cooldown=cooldown, executor=executor, inFlightQueries=inFlightQueries, metrics=metrics, reranker=reranker, vectorstore=vectorstore)
 
 
 @bot.event
@@ -78,6 +105,8 @@ async def on_reaction_add(reaction: Reaction, reactor: Member) -> None:
 	# Ignore if the reactor is the bot itself or another bot
 	if bot.user is None or reactor == bot.user or reactor.bot:
 		return
+	# Accepted requests may add to the vectorstore, so must wait until it has loaded
+	await warmup.wait()
 	# If the reaction is not on a request message...
 	if all((reaction.message not in vectorstoreRequests, reaction.message not in permissionRequests)):
 		# ...and it's not the designated emoji, or by a non-trusted user, ignore
@@ -85,11 +114,11 @@ async def on_reaction_add(reaction: Reaction, reactor: Member) -> None:
 		if reaction.emoji != DISCORD_REQUEST_ADDITION_EMOJI or reactor.id not in trustedGroup: return
 		# If the message's author is the reactor him/herself, or has previously waived, there's no need to ask permission
 		if reaction.message.author.id == reactor.id or reaction.message.author.id in permittingGroup:
-			return await reaction_answerRequest(reaction, True, requests=vectorstoreRequests, bot=bot)
+			return await reaction_answerRequest(reaction, True, requests=vectorstoreRequests, bot=bot, executor=executor, outbox=outbox, metrics=metrics)
 		# If the reaction is on a bot's message, it cannot ever approve the request, so ignore
 		if reaction.message.author.bot: return
 		# Otherwise ask for permission
-		await reaction_newOrUpdateRequest(reaction, reactor, requests=vectorstoreRequests)
+		await reaction_newOrUpdateRequest(reaction, reactor, requests=vectorstoreRequests, bot=bot)
 	# If it is on a request message...
 	else:
 		# ...and it's not one of the two accepted emojis, ignore
@@ -98,7 +127,7 @@ async def on_reaction_add(reaction: Reaction, reactor: Member) -> None:
 		for requestsList in (vectorstoreRequests, permissionRequests):
 			# If the message was part of a request, and the reactor was the recipient, resolve the request
 			if (record := requestsList[reaction.message]) is None or reactor.id != record["recipientID"]: continue
-			await reaction_answerRequest(reaction, reaction.emoji == "✅", requests=requestsList, bot=bot)
+			await reaction_answerRequest(reaction, reaction.emoji == "✅", requests=requestsList, bot=bot, executor=executor, outbox=outbox, metrics=metrics)
 
 
 @bot.event
@@ -109,10 +138,34 @@ async def on_message_delete(message: Message) -> None:
 	for requestsList in (vectorstoreRequests, permissionRequests):
 		# If the message was part of a request, delete the requests' other messages and record
 		if (record := requestsList[message]) is None: continue
-		for previousRequestMessage in record["previousRequestMessages"]: await previousRequestMessage.delete()
+		await outbox.delete(previousRequestMessage for previousRequestMessageURL in record["previousRequestMessageURLs"] if (previousRequestMessage := Discord.getPartialMessage(previousRequestMessageURL, bot=bot)) is not None)
 		requestsList.remove(message)
 
 
+@bot.event
+async def on_raw_message_delete(payload: RawMessageDeleteEvent) -> None:
+	"""Removes deleted messages from the vectorstore. Raw events are used so that messages sent before the bot last came online are also handled."""
+	Discord.forgetMessage(payload.channel_id, payload.message_id)
+	await warmup.wait()
+	await executor.run(vectorstore.removeBySource, Discord.getJumpURL(payload.guild_id, payload.channel_id, payload.message_id))
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: RawBulkMessageDeleteEvent) -> None:
+	for messageID in payload.message_ids: Discord.forgetMessage(payload.channel_id, messageID)
+	await warmup.wait()
+	await executor.run(vectorstore.removeBySource, [Discord.getJumpURL(payload.guild_id, payload.channel_id, messageID) for messageID in payload.message_ids])
+
+
+@bot.event
+async def on_raw_message_edit(payload: RawMessageUpdateEvent) -> None:
+	"""Re-embeds edited messages in the vectorstore, in place of their previous texts."""
+	Discord.forgetMessage(payload.channel_id, payload.message_id)
+	await warmup.wait()
+	if payload.message.jump_url not in vectorstore: return
+	with metrics.time("vectorstore_update"): await executor.run(vectorstore.update, payload.message.jump_url, payload.message.content)
+
+
 @bot.tree.command(name="add", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["add"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
 @describe(
 	object = "The object being added to.",
@@ -123,14 +176,14 @@ async def command_add(interaction: Interaction, object: Literal["Blocked Group",
 	if interaction.user.id not in trustedGroup and not await bot.is_owner(interaction.user): return await message_notTrusted(interaction, "/add")
 	# If adding text to the vectorstore:
 	if object == "Vectorstore":
+		if not warmup.isReady: return await message_warmingUp(interaction)
 		# Provided input must be the URL of a message
 		if (messageToAdd := await Discord.getMessage(entry, bot=bot)) is None: return await Discord.indicateFailure(interaction)
 		# If the message's author is the reactor him/herself, or has previously waived, there's no need to ask permission
 		if messageToAdd.author == interaction.user or messageToAdd.author.id in permittingGroup:
-			await reaction_answerRequest(messageToAdd, True, requests=vectorstoreRequests, bot=bot)
+			await reaction_answerRequest(messageToAdd, True, requests=vectorstoreRequests, bot=bot, executor=executor, outbox=outbox, metrics=metrics)
 		# Otherwise ask for permission
-		else:
-			await reaction_newOrUpdateRequest(messageToAdd, interaction, requests=vectorstoreRequests)
+		elif not await reaction_newOrUpdateRequest(messageToAdd, interaction, requests=vectorstoreRequests, bot=bot): return
 		return await Discord.indicateSuccess(interaction)
 	# If adding a user to a group: that is handled separately
 	else: await message_add(interaction, entry, obj=blockedGroup if object == "Blocked Group" else trustedGroup)
@@ -142,7 +195,8 @@ async def command_add(interaction: Interaction, object: Literal["Blocked Group",
 )
 async def command_ask(interaction: Interaction, query: str) -> None:
 	if interaction.user.id in blockedGroup and not await bot.is_owner(interaction.user): return await message_blocked(interaction)
-	await message_ask(interaction, query, ai=ai, cache=cache, cooldown=cooldown, vectorstore=vectorstore)
+	if not warmup.isReady: return await message_warmingUp(interaction)
+	await message_ask(interaction, query, ai=ai, cache=cache, cooldown=cooldown, executor=executor, inFlightQueries=inFlightQueries, metrics=metrics, reranker=reranker, vectorstore=vectorstore)
 
 
 @bot.tree.command(name="clear", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["clear"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
@@ -152,7 +206,8 @@ async def command_ask(interaction: Interaction, query: str) -> None:
 async def command_clear(interaction: Interaction, object: Literal["All", "Blocked Group", "Cache", "Permitting Group", "Permitting Requests", "Trusted Group", "Vectorstore", "Vectorstore Requests"]) -> None:
 	if interaction.user.id in blockedGroup and not await bot.is_owner(interaction.user): return await message_blocked(interaction)
 	if interaction.user.id not in trustedGroup and not await bot.is_owner(interaction.user): return await message_notTrusted(interaction, "/clear")
-	await message_clear(interaction, objects=(
+	if object in ("All", "Cache", "Vectorstore") and not warmup.isReady: return await message_warmingUp(interaction)
+	await message_clear(interaction, executor=executor, objects=(
 		(blockedGroup,) if object == "Blocked Group"
 		else (cache,) if object == "Cache"
 		else (permittingGroup,) if object == "Permitting Group"
@@ -185,6 +240,7 @@ async def command_contains(interaction: Interaction, group: Literal["Blocked Gro
 )
 async def command_getsize(interaction: Interaction, object: Literal["Blocked Group", "Cache", "Permitting Group", "Permitting Requests", "Trusted Group", "Vectorstore", "Vectorstore Requests"]) -> None:
 	if interaction.user.id in blockedGroup and not await bot.is_owner(interaction.user): return await message_blocked(interaction)
+	if object in ("Cache", "Vectorstore") and not warmup.isReady: return await message_warmingUp(interaction)
 	await message_getsize(interaction, obj=(
 		blockedGroup if object == "Blocked Group"
 		else cache if object == "Cache"
@@ -205,6 +261,18 @@ async def command_help(interaction: Interaction, command: str | None = None) ->
 	await message_help(interaction, command)
 
 
+@bot.tree.command(name="ingest", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["ingest"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
+@describe(
+	channel = "(Optional) The channel whose messages to add. If omitted, this channel is used.",
+	checkpoint = "(Optional) The ID or URL of the last message added by an interrupted ingestion, to resume after it."
+)
+async def command_ingest(interaction: Interaction, channel: StageChannel | TextChannel | Thread | VoiceChannel | None = None, checkpoint: str | None = None) -> None:
+	if not await bot.is_owner(interaction.user): return await message_notOwner(interaction, "/ingest")
+	if not warmup.isReady: return await message_warmingUp(interaction)
+	if channel is None and not isinstance(channel := interaction.channel, (StageChannel, TextChannel, Thread, VoiceChannel)): return await Discord.indicateFailure(interaction, MessagesTexts.INGEST__INVALID_CHANNEL[LANGUAGE])
+	await message_ingest(interaction, channel, checkpoint, executor=executor, metrics=metrics, permittingGroup=permittingGroup, vectorstore=vectorstore)
+
+
 @bot.tree.command(name="load", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["load"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
 @describe(
 	object = "The object to load.",
@@ -212,7 +280,8 @@ async def command_help(interaction: Interaction, command: str | None = None) ->
 )
 async def command_load(interaction: Interaction, object: Literal["All", "Blocked Group", "Cache", "Permitting Group", "Permitting Requests", "Trusted Group", "Vectorstore", "Vectorstore Requests"], filepath: str | None = None) -> None:
 	if not await bot.is_owner(interaction.user): return await message_notOwner(interaction, "/load")
-	await message_load(interaction, filepath if object != "All" else None, objects=(
+	if object in ("All", "Cache", "Vectorstore") and not warmup.isReady: return await message_warmingUp(interaction)
+	await message_load(interaction, filepath if object != "All" else None, metrics=metrics, objects=(
 		(blockedGroup,) if object == "Blocked Group"
 		else (cache,) if object == "Cache"
 		else (permittingGroup,) if object == "Permitting Group"
@@ -227,7 +296,7 @@ async def command_load(interaction: Interaction, object: Literal["All", "Blocked
 # @bot.tree.command(name="permit", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["permit"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
 # async def command_permit(interaction: Interaction) -> None:
 # 	# Intentionally allow blocked users to use this command
-# 	await reaction_newOrUpdateRequest(interaction, interaction, requests=permissionRequests)
+# 	await reaction_newOrUpdateRequest(interaction, interaction, requests=permissionRequests, bot=bot)
 
 
 @bot.tree.command(name="ping", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["ping"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
@@ -242,12 +311,11 @@ async def command_ping(interaction: Interaction) -> None:
 	object = "The object being removed from.",
 	entry = "The entry being removed from the object."
 )
-# async def command_remove(interaction: Interaction, object: Literal["Blocked Group", "Trusted Group", "Vectorstore"], entry: str) -> None:
-async def command_remove(interaction: Interaction, object: Literal["Blocked Group", "Trusted Group"], entry: str) -> None:
+async def command_remove(interaction: Interaction, object: Literal["Blocked Group", "Trusted Group", "Vectorstore"], entry: str) -> None:
 	if interaction.user.id in blockedGroup and not await bot.is_owner(interaction.user): return await message_blocked(interaction)
 	if interaction.user.id not in trustedGroup and not await bot.is_owner(interaction.user): return await message_notTrusted(interaction, "/remove")
-	await message_remove(interaction, entry, obj=blockedGroup if object == "Blocked Group" else trustedGroup)
-	# await message_remove(interaction, entry, obj=blockedGroup if object == "Blocked Group" else trustedGroup if object == "Trusted Group" else vectorstore)
+	if object == "Vectorstore" and not warmup.isReady: return await message_warmingUp(interaction)
+	await message_remove(interaction, entry, executor=executor, obj=blockedGroup if object == "Blocked Group" else trustedGroup if object == "Trusted Group" else vectorstore)
 
 
 @bot.tree.command(name="revoke", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["revoke"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
@@ -263,7 +331,8 @@ async def command_revoke(interaction: Interaction) -> None:
 )
 async def command_save(interaction: Interaction, object: Literal["All", "Blocked Group", "Cache", "Permitting Group", "Permitting Requests", "Trusted Group", "Vectorstore", "Vectorstore Requests"], filepath: str | None = None) -> None:
 	if not await bot.is_owner(interaction.user): return await message_notOwner(interaction, "/save")
-	await message_save(interaction, filepath if object != "All" else None, objects=(
+	if object in ("All", "Cache", "Vectorstore") and not warmup.isReady: return await message_warmingUp(interaction)
+	await message_save(interaction, filepath if object != "All" else None, metrics=metrics, objects=(
 		(blockedGroup,) if object == "Blocked Group"
 		else (cache,) if object == "Cache"
 		else (permittingGroup,) if object == "Permitting Group"
@@ -275,5 +344,10 @@ async def command_save(interaction: Interaction, object: Literal["All", "Blocked
 	))
 
 
+@bot.tree.command(name="stats", description=Discord.truncate(DISCORD_COMMAND_DOCUMENTATION["stats"][2], Discord.DESCRIPTION_CHARACTER_LIMIT))
+async def command_stats(interaction: Interaction) -> None:
+	if not await bot.is_owner(interaction.user): return await message_notOwner(interaction, "/stats")
+	await message_stats(interaction, metrics=metrics)
+
 
 bot.run(DISCORD_BOT_TOKEN.get_secret_value())
\ No newline at end of file
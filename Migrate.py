@@ -0,0 +1,61 @@
+# Imports a vectorstore and cache saved by versions of the bot before they got their own file formats, into the files configured in Settings.py. Run it once after upgrading, before launching the bot.
+# Legacy vectorstores were saved by LangChain as a FAISS index (e.g. ./data/index.faiss) beside a pickled docstore (./data/index.pkl); legacy caches were pickled (./data/cache.pkl).
+# Their texts are re-embedded with the configured embedding model and added to any existing entries, skipping duplicates, so running it again is harmless.
+# Reading them unpickles LangChain objects, so only run it on files this bot saved, with langchain_community installed (pip install langchain_community); it is no longer needed afterwards.
+# Legacy request lists could never be pickled, so there are none to import.
+# Usage: python Migrate.py [--vectorstore path.faiss] [--cache path.pkl] [--batch-size 1000]
+from argparse import ArgumentParser
+import os
+import pickle
+from numpy import asarray, float32
+
+from Settings import *
+from src.components.cache import Cache
+from src.components.diskCache import DiskCache
+from src.components.embedder import Embedder
+from src.components.vectorstore import Vectorstore
+
+def migrateVectorstore(legacyFilepath: str, embedder: Embedder, batchSize: int) -> None:
+	"""Adds the legacy vectorstore's texts (and source URLs) to the configured vectorstore."""
+	if VECTORSTORE_FILEPATH is None: return print("Skipping the vectorstore, since VECTORSTORE_FILEPATH is None.")
+	# LangChain saves the docstore beside the index, under the same name
+	with open(os.path.splitext(legacyFilepath)[0] + ".pkl", "rb") as f: docstore, rowIDs = pickle.load(f)
+	documents = [docstore.search(rowIDs[row]) for row in sorted(rowIDs)]
+	# New LangChain vectorstores held one empty placeholder text
+	segments = [(document.page_content, url if isinstance(url := document.metadata.get("url"), str) else None) for document in documents if not isinstance(document, str) and document.page_content]
+	vectorstore = Vectorstore(embedder, VECTORSTORE_FILEPATH, VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD, VECTORSTORE_SEGMENT_SIZE, VECTORSTORE_LOG_COMPACTION_SIZE, VECTORSTORE_INDEX_TYPE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_LEXICAL_SEARCH)
+	totalAddedCount = totalSkippedCount = 0
+	for start in range(0, len(segments), batchSize):
+		texts, urls = zip(*segments[start:start + batchSize])
+		addedCount, skippedCount = vectorstore.add(texts, urls)
+		totalAddedCount, totalSkippedCount = totalAddedCount + addedCount, totalSkippedCount + skippedCount
+		print(f"Vectorstore: {min(start + batchSize, len(segments))}/{len(segments)} texts imported.")
+	vectorstore.save()
+	print(f"Vectorstore: {totalAddedCount} segments added and {totalSkippedCount} duplicates skipped, saved to {VECTORSTORE_FILEPATH}.")
+
+def migrateCache(legacyFilepath: str, embedder: Embedder) -> None:
+	"""Adds the legacy cache's unexpired entries to the configured cache (and its disk tier, if any), each with a full lifetime."""
+	if CACHE_FILEPATH is None and CACHE_DISK_FILEPATH is None: return print("Skipping the cache, since CACHE_FILEPATH and CACHE_DISK_FILEPATH are None.")
+	with open(legacyFilepath, "rb") as f: legacyCache = pickle.load(f)
+	diskCache = DiskCache(CACHE_DISK_FILEPATH, CACHE_DISK_MAX_SIZE, CACHE_DISK_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE) if CACHE_DISK_FILEPATH else None
+	cache = Cache(embedder, CACHE_MAX_SIZE, CACHE_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, CACHE_FILEPATH, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE, diskCache)
+	# Legacy entries were (response, query embedding), keyed by query
+	entries = list(legacyCache.items()) if legacyCache is not None else []
+	for query, (response, embedding) in entries:
+		cache[query] = (response, asarray(embedding, dtype=float32))
+		cache.storeOnDisk(query, (response, asarray(embedding, dtype=float32)))
+	if CACHE_FILEPATH is not None: cache.save()
+	if diskCache is not None: diskCache.close()
+	print(f"Cache: {len(entries)} entries imported.")
+
+if __name__ == "__main__":
+	parser = ArgumentParser(description="Imports a legacy vectorstore and cache into the files configured in Settings.py.")
+	parser.add_argument("--vectorstore", default=os.path.join(".", "data", "index.faiss"), help="The legacy vectorstore's FAISS index, beside its .pkl docstore.")
+	parser.add_argument("--cache", default=os.path.join(".", "data", "cache.pkl"), help="The legacy pickled cache.")
+	parser.add_argument("--batch-size", type=int, default=1000, help="The number of texts to embed at a time.")
+	arguments = parser.parse_args()
+	embedder = Embedder(EMBEDDING_MODEL_NAME, EMBEDDING_THREADS, EMBEDDING_BATCH_SIZE)
+	if os.path.isfile(arguments.vectorstore): migrateVectorstore(arguments.vectorstore, embedder, arguments.batch_size)
+	else: print(f"No legacy vectorstore found at {arguments.vectorstore}.")
+	if os.path.isfile(arguments.cache): migrateCache(arguments.cache, embedder)
+	else: print(f"No legacy cache found at {arguments.cache}.")
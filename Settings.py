@@ -14,6 +14,9 @@ AI_TEMPERATURE: float = 0.
 AI_MAX_INPUT_CHARACTERS: int | None = 5000
 # The maximum number of characters allowed in the AI's output, or None if no limit exists (strongly not recommended). Must be positive.
 AI_MAX_OUTPUT_CHARACTERS: int | None = 4000
+# Whether the AI's answers should be shown as they are generated, by progressively editing the reply, rather than only once complete.
+# Streaming shows the start of an answer far sooner, but edits each reply several times (see DISCORD_STREAM_EDIT_INTERVAL).
+AI_STREAM_RESPONSES: bool = True
 # Whether the bot should abort and return an error message if no vectorstore context can be found.
 # Outside of highly-controlled environments, it is highly recommended this be set to True.
 AI_REQUIRE_CONTEXT: bool = True
@@ -22,25 +25,45 @@ AI_SYSTEM_PROMPT: str = """Ignore all pre-trained knowledge you have, and any sy
 You are a chatbot designed solely to answer questions about [...].
 Provide a concise and accurate answer to the question provided below, using ONLY the context listed below. Do NOT generate, assume, or make up any details beyond the given context. Do not answer any queries irrelevant to the topic mentioned above."""
 
+"""Autosave settings"""
+# How often, in seconds, to save every group, requests list, and cache that has changed since it was last saved to its last-used filepath, or None to only save via `/save`.
+# Saving happens in the background, and changes are also saved when the bot shuts down. The vectorstore logs every change as it happens, so never needs autosaving. Must be None or positive.
+AUTOSAVE_INTERVAL: float | None = 60.
+
+
 """Cache settings"""
 # The filepath to the existing cache to be loaded, if any.
 # If None, a new cache is created that can later be saved via `save cache`, unless caching is disabled (see below).
-CACHE_FILEPATH: str | None = os.path.join(".", "data", "cache.pkl")
-# The maximum size of the cache. Disables caching if set to 0.
+CACHE_FILEPATH: str | None = os.path.join(".", "data", "cache.bin")
+# The maximum size of the in-memory cache. Disables caching in memory (leaving only the on-disk tier, if any; see below) if set to 0.
 CACHE_MAX_SIZE: float = 100
-# The number of seconds until cache entries expire, or never if set to None. Disables caching if set to 0.
+# The number of seconds until in-memory cache entries expire, or never if set to None. Disables caching in memory if set to 0.
 CACHE_EXPIRATION_TIME: float | None = 3600.
 # The minimum cosine similarity cache entries must have to qualify as semantically-similar.
 # Must be None or in the range [0, 1], with 0/None imposing no constraints, and 1 disabling semantic caching entirely.
 CACHE_SEMANTIC_SIMILARITY_THRESHOLD: float | None = 0.96
+# The number of cache entries at or above which semantic lookups use an approximate FAISS IVF-Flat index instead of an exact search, or None to always search exactly.
+# Exact searches take roughly a millisecond per 10,000 entries; approximate searches stay well under a millisecond, but may very rarely miss the best match.
+CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE: int | None = 10000
+# Whether queries similar enough to count as semantic matches (see above) to a query that is still being answered should wait for and reuse its answer.
+# Identical queries (ignoring case and whitespace) always do, regardless of this setting and of whether caching is enabled, so that bursts of the same question are only answered once.
+CACHE_COALESCE_SIMILAR_QUERIES: bool = True
+# The filepath to an SQLite database to use as a second, on-disk tier of the cache, or None to only cache in memory.
+# Every cached answer is also written to it as it is cached, lookups that miss the in-memory cache fall through to it, and its matches are moved back into memory.
+CACHE_DISK_FILEPATH: str | None = os.path.join(".", "data", "cache.sqlite3")
+# The maximum number of entries in the on-disk tier, past which the least recently used are dropped. Must be positive.
+# Each entry's embedding is also kept in memory for semantic lookups, taking about 1.5 KB for 384-dimensional embeddings.
+CACHE_DISK_MAX_SIZE: float = 200000
+# The number of seconds until on-disk entries expire, or never if set to None. Must be None or positive.
+CACHE_DISK_EXPIRATION_TIME: float | None = 7*24*3600.
 
 """Cooldown settings"""
-# The number of seconds the cooldown lasts for when triggered. Disables cooldowns if set to 0.
-COOLDOWN_DURATION: float = 0.
-# The number of seconds backwards in time the cooldown checker counts messages for. Disables cooldowns if set to 0.
-COOLDOWN_CHECK_INTERVAL: float = 20.
-# The maximum number of queries that can be made in the above time window before the cooldown triggers. Disables cooldowns if set to 0.
-COOLDOWN_MAX_QUERIES_BEFORE_ACTIVATION: int = 2
+# The maximum number of queries that can be made in a burst, and the number of seconds a full burst takes to recover, separately per user, per channel, and per server.
+# Queries recover gradually, so e.g. (2, 20.) allows 2 queries at once, then another every 10 seconds. Queries exceeding any applicable limit are refused.
+# Omitting a scope, or setting either of its numbers to 0, disables its limit. Cooldowns are disabled by default; e.g. {"user": (2, 20.), "channel": (6, 30.), "guild": (12, 60.)} enables all three.
+COOLDOWN_LIMITS: dict[Literal["user", "channel", "guild"], tuple[int, float]] = {} # Scope: (maximum queries, seconds)
+# The maximum number of users/channels/servers whose recent queries are remembered per scope, bounding memory use. Those queried least recently are forgotten first.
+COOLDOWN_MAX_TRACKED_KEYS: int = 10000
 
 """Discord settings"""
 # Other bot prefixes to avoid, to avoid accidental responses.
@@ -48,6 +71,20 @@ DISCORD_OTHER_BOT_PREFIXES: set[str] = {
 	"!", "!!", # Zeppelin#3008
 }
 DISCORD_REQUEST_ADDITION_EMOJI: str = "↪️"
+# The minimum number of seconds between edits of a reply while a streamed answer is generated (see AI_STREAM_RESPONSES).
+# Discord rate-limits message edits to roughly 5 every 5 seconds per channel, so lower values risk edits being delayed.
+DISCORD_STREAM_EDIT_INTERVAL: float = 1.
+# The maximum number of messages fetched by URL (e.g. by `/add` or accepted requests) to remember, so that fetching them again costs no API calls, or 0 to always fetch them.
+# Remembered messages are forgotten once edited or deleted. Must be nonnegative.
+DISCORD_MESSAGE_CACHE_SIZE: int = 1000
+# The number of seconds to remember each fetched message for, in case an edit or deletion is missed (e.g. while the bot is offline). Must be positive.
+DISCORD_MESSAGE_CACHE_EXPIRATION_TIME: float = 600.
+# The number of seconds to collect the bot's message deletions for before sending them, so that several in one channel (e.g. a resolved request's messages) are deleted with a single API call. Must be nonnegative.
+# Bulk deletion needs the Manage Messages permission and only works on messages under 14 days old in servers; other messages are still deleted one by one.
+DISCORD_DELETION_BATCHING_DELAY: float = .1
+# The filepath to record a hash of the slash commands at, so that they are only synced with Discord (which heavily rate-limits syncing) on startups after they change.
+# If None, the commands are synced on every startup.
+DISCORD_COMMAND_HASH_FILEPATH: str | None = os.path.join(".", "data", "commandHash.txt")
 DISCORD_COMMAND_DOCUMENTATION: dict[str, tuple[Literal["general", "trusted", "owner"], str, str]] = { # Command: (permission level, syntax, description)
 	# General
 	"ask": ("general", "[/ask or ping me] [query]", "Looks up and generates an answer for the provided query."),
@@ -60,12 +97,42 @@ DISCORD_COMMAND_DOCUMENTATION: dict[str, tuple[Literal["general", "trusted", "ow
 	# Trusted only
 	"add": ("trusted", "/add [Blocked Group|Trusted Group|Vectorstore] [user ID/message URL]", "(Trusted only) Adds the provided user ID/requests to add the linked message to the provided group/vectorstore."),
 	"clear": ("trusted", "/clear [All|Blocked Group|Cache|Permitting Group|Permitting Requests|Trusted Group|Vectorstore Requests]", "(Trusted only) Clears the provided object(s)."),
-	"remove": ("trusted", "/remove [Blocked Group|Trusted Group] [user ID]", "(Trusted only) Removes the provided user ID from the provided group."),
+	"remove": ("trusted", "/remove [Blocked Group|Trusted Group|Vectorstore] [user ID/message URL/text]", "(Trusted only) Removes the provided user ID from the provided group, or the provided message/user's texts/text from the vectorstore."),
 	# Owner only
-	"save": ("owner", "/save [All|Blocked Group|Cache|Permitting Group|Permitting Requests|Trusted Group|Vectorstore|Vectorstore Requests] [filepath (optional)]", "(Owner only) Saves the provided object to the provided filepath, or their last-used filepath if none is provided."),
+	"save": ("owner", "/save [All|Blocked Group|Cache|Permitting Group|Permitting Requests|Trusted Group|Vectorstore|Vectorstore Requests] [filepath (optional)]", "(Owner only) Saves the provided object to the provided filepath, or their last-used filepath if none is provided. The vectorstore saved elsewhere is only a copy: its changes keep being recorded to its own file."),
+	"ingest": ("owner", "/ingest [channel (optional)] [checkpoint message ID/URL (optional)]", "(Owner only) Adds all messages in the provided channel (defaulting to this one) by permitting users to the vectorstore, optionally resuming after the checkpoint message."),
 	"load": ("owner", "/load [All|Blocked Group|Cache|Permitting Group|Permitting Requests|Trusted Group|Vectorstore|Vectorstore Requests] [filepath (optional)]", "(Owner only) Loads the provided object from the provided filepath, or their last-used filepath if none is provided."),
+	"stats": ("owner", "/stats", "(Owner only) Shows my cache and retrieval hit rates, AI errors, and how long each stage of my work takes."),
 }
 
+"""Embedding settings"""
+# The FastEmbed model used to embed both cached queries and vectorstore texts.
+# Changing this invalidates any previously-saved cache or vectorstore, since their embeddings were made by the old model.
+EMBEDDING_MODEL_NAME: str = "BAAI/bge-small-en-v1.5"
+# The number of threads the embedding model may use, or None to let ONNX Runtime decide.
+EMBEDDING_THREADS: int | None = None
+# The number of texts embedded at once. Higher values are faster for large additions but use more memory. Must be positive.
+EMBEDDING_BATCH_SIZE: int = 256
+
+"""Reranker settings"""
+# The FastEmbed cross-encoder model used to rescore the vectorstore's results before they are given to the AI, or None to disable reranking.
+# Reranking runs on the CPU, and judges relevance more precisely than embeddings, so that fewer but more relevant texts can be sent (shortening prompts).
+# Supported models include "Xenova/ms-marco-MiniLM-L-6-v2" (fastest), "Xenova/ms-marco-MiniLM-L-12-v2", and "jinaai/jina-reranker-v1-tiny-en".
+RERANKER_MODEL_NAME: str | None = None
+# The number of texts retrieved from the vectorstore for the reranker to rescore. Must be positive.
+RERANKER_CANDIDATES: int = 16
+# The number of most relevant texts kept after reranking. Must be positive.
+RERANKER_MAX_RESULTS: int = 2
+# The number of (query, text) scores remembered, so that repeated questions need not be rescored. Must be positive.
+RERANKER_CACHE_SIZE: int = 4096
+
+"""Executor settings"""
+# The number of worker threads that run blocking work (embedding, vectorstore searches) away from Discord's event loop, or None to use Python's default.
+EXECUTOR_MAX_WORKERS: int | None = 4
+# The maximum number of queries that can be answered at once, or None if no limit exists. Must be None or positive.
+# Further queries wait until an earlier one finishes.
+EXECUTOR_MAX_CONCURRENT_QUERIES: int | None = 8
+
 """Groups settings"""
 # The filepath to the existing list of blocked Discord IDs to be loaded, if desired.
 # If None, a new list is created that can later be saved via `save blocked`.
@@ -77,22 +144,45 @@ GROUPS_PERMITTING_IDS_FILEPATH: str | None = os.path.join(".", "data", "permitti
 # If None, a new list is created that can later be saved via `save trusted`.
 GROUPS_TRUSTED_IDS_FILEPATH: str | None = os.path.join(".", "data", "trustedIDs.txt")
 
+"""Metrics settings"""
+# The port to serve the bot's timings and counters on in Prometheus' text format (at /metrics), or None to not serve them. They can always be viewed via `/stats`.
+METRICS_HTTP_PORT: int | None = None
+# The address to serve metrics on. The default only accepts connections from this machine; "0.0.0.0" accepts connections from anywhere, so should only be used behind a firewall.
+METRICS_HTTP_HOST: str = "127.0.0.1"
+
 """Requests settings"""
 # The filepath to the existing list of vectorstore addition requests to be loaded, if desired.
 # If None, a new list is created that can later be saved via `save trusted`.
-REQUESTS_VECTORSTORE_FILEPATH: str | None = os.path.join(".", "data", "vectorstoreRequests.pkl")
+REQUESTS_VECTORSTORE_FILEPATH: str | None = os.path.join(".", "data", "vectorstoreRequests.json")
 # The filepath to the existing list of permitting addition requests to be loaded, if desired.
 # If None, a new list is created that can later be saved via `save trusted`.
-REQUESTS_PERMITTING_FILEPATH: str | None = os.path.join(".", "data", "permittingRequests.pkl")
+REQUESTS_PERMITTING_FILEPATH: str | None = os.path.join(".", "data", "permittingRequests.json")
+# The maximum number of pending vectorstore addition requests each trusted user can have made at once, so that one user cannot flood others with requests, or None for no limit.
+# Adding messages to a request they already made does not count as another. Must be positive.
+REQUESTS_MAX_PENDING_PER_REQUESTER: int | None = None
 
 """Vectorstore settings"""
 # The filepath to the existing vectorstore to be loaded.
 # If None, a new vectorstore is created that can later be saved via `save vectorstore`.
-VECTORSTORE_FILEPATH: str | None = os.path.join(".", "data", "index.faiss")
+VECTORSTORE_FILEPATH: str | None = os.path.join(".", "data", "vectorstore.bin")
 # VECTORSTORE_FILEPATH: str | None = None
 # The minimum embedding distance that stored texts must have to be considered.
 # Must be None or in the range [0, 1], with 0/None imposing no constraints, and 1 disabling anything but character-for-character matches.
 VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD: float | None = 0.6
 VECTORSTORE_SEGMENT_SIZE: int | None = 512
+# Additions are logged next to the vectorstore's file as they happen, and the vectorstore is re-saved (emptying the log) once the log grows to this many bytes.
+# If None, the log is only emptied by saving the vectorstore via `save vectorstore`.
+VECTORSTORE_LOG_COMPACTION_SIZE: int | None = 64*1024*1024
+# The number of messages embedded and added to the vectorstore at a time by `ingest`, which also reports its progress after each batch.
+VECTORSTORE_INGESTION_BATCH_SIZE: int = 256
+# Whether the vectorstore is also searched by keywords (BM25), with its results fused with those of the embedding search below.
+# Keyword search finds exact identifiers (e.g. command names, item IDs, and error messages) that embeddings often miss, at the cost of keeping an index of every stored word in memory.
+VECTORSTORE_LEXICAL_SEARCH: bool = True
+# How the vectorstore is searched. "Flat" compares every query against every stored text exactly, which is slow for large vectorstores.
+# "IVF-Flat" and "HNSW" search approximately, which is much faster for large vectorstores at the cost of occasionally missing a relevant text, with "HNSW" being faster but using more memory.
+# "IVF-PQ" also searches approximately, but additionally compresses the stored embeddings in memory (by 32 times for the default model), at a further cost in accuracy.
+VECTORSTORE_INDEX_TYPE: Literal["Flat", "IVF-Flat", "IVF-PQ", "HNSW"] = "Flat"
+# Approximate index types are only used once the vectorstore holds at least this many texts (and at least 1024), below which it is searched exactly.
+VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE: int | None = 10000
 
 del os
\ No newline at end of file
@@ -96,7 +96,7 @@ class MessagesTexts:
 	}
 	# Supported substitutions: [seconds]
 	ASK__COOLDOWN: dict[SupportedLanguages, str] = {
-		"English": "I am currently on cooldown: too many queries are being made right now. ([seconds] seconds remaining)",
+		"English": "Too many queries are being made here right now. Please try again in [seconds] seconds.",
 	}
 	ASK__DEFAULT_CONTEXT: dict[SupportedLanguages, str] = {
 		"English": "None",
@@ -116,6 +116,9 @@ class MessagesTexts:
 		"English": """Here are the messages in my corpus most likely to be relevant to your question:
 [messages]""",
 	}
+	ASK__STREAMING_PLACEHOLDER: dict[SupportedLanguages, str] = {
+		"English": "-# Generating an answer…",
+	}
 	BLOCKED: dict[SupportedLanguages, str] = {
 		"English": "`You are blocked from interacting with this bot.",
 	}
@@ -137,6 +140,28 @@ I'm primarily interacted with via pinging me or slash commands. The commands I s
 
 For messages sent after I'm added, trusted users can also request to add existing messages to the vectorstore by reacting with [emote], assuming the original author then gives his/her permission. However, I currently can't detect reactions on messages sent prior to when I last came online; for those messages, use `/add Vectorstore [URL]` instead.""",
 	}
+	# Supported substitutions: [channel], [scanned], [messages], [texts], [checkpoint]
+	INGEST__COMPLETE: dict[SupportedLanguages, str] = {
+		"English": "Finished adding [channel]'s history: scanned [scanned] messages, and added [messages] of them as [texts] texts.",
+	}
+	# Supported substitutions: [channel], [scanned], [messages], [texts], [checkpoint]
+	INGEST__ERROR: dict[SupportedLanguages, str] = {
+		"English": "I lack permission to read [channel]'s history. To resume once fixed, use the checkpoint `[checkpoint]`.",
+	}
+	INGEST__INVALID_CHANNEL: dict[SupportedLanguages, str] = {
+		"English": "I can only add the history of text, voice, and stage channels and threads.",
+	}
+	INGEST__INVALID_CHECKPOINT: dict[SupportedLanguages, str] = {
+		"English": "The checkpoint must be a message's ID or URL.",
+	}
+	# Supported substitutions: [channel], [scanned], [messages], [texts], [checkpoint]
+	INGEST__PROGRESS: dict[SupportedLanguages, str] = {
+		"English": "Adding [channel]'s history: scanned [scanned] messages so far, and added [messages] of them as [texts] texts. If interrupted, resume with the checkpoint `[checkpoint]`.",
+	}
+	# Supported substitutions: [channel]
+	INGEST__STARTED: dict[SupportedLanguages, str] = {
+		"English": "Adding [channel]'s history...",
+	}
 	LOAD__ERROR: dict[SupportedLanguages, str] = {
 		"English": "An error occurred while loading the object.",
 	}
@@ -162,12 +187,39 @@ For messages sent after I'm added, trusted users can also request to add existin
 	SAVE__ERROR: dict[SupportedLanguages, str] = {
 		"English": "An error occurred while saving the object.",
 	}
+	# Supported substitutions: [queries], [cooldowns], [exactHitRate], [semanticHitRate], [coalescedRate], [retrievalHitRate], [aiErrors], [rateLimits], [bulkDeletions], [timings]
+	STATS: dict[SupportedLanguages, str] = {
+		"English": """**Queries:** [queries] received, and [cooldowns] refused by cooldowns.
+**Cache hits:** [exactHitRate] exact, [semanticHitRate] semantic, and [coalescedRate] shared with identical or similar queries in flight.
+**Context found:** [retrievalHitRate] of vectorstore searches.
+**AI errors:** [aiErrors].
+**Discord:** [rateLimits] requests rate limited, and [bulkDeletions] bulk deletions.
+**Timings** (percentiles are estimates):
+[timings]""",
+	}
+	STATS__NO_TIMINGS: dict[SupportedLanguages, str] = {
+		"English": "Nothing has been timed yet.",
+	}
+	# Supported substitutions: [stage], [count], [mean], [median], [p95]
+	STATS__TIMING: dict[SupportedLanguages, str] = {
+		"English": "- `[stage]`: [count] times, averaging [mean] ms (median [median] ms, 95th percentile [p95] ms).",
+	}
+	WARMING_UP: dict[SupportedLanguages, str] = {
+		"English": "I just came online and am still loading my knowledge. Please try again in a moment.",
+	}
 
 class RequestsTexts:
+	# Supported substitutions: [count], [plural]
+	DUPLICATES_SKIPPED: dict[SupportedLanguages, str] = {
+		"English": "Skipped [count] text[plural] already in the vectorstore.",
+	}
 	# Supported substitutions: [associatedObject]
 	NAME: dict[SupportedLanguages, str] = {
 		"English": "[associatedObject] Requests",
 	}
+	NOTHING_ADDED: dict[SupportedLanguages, str] = {
+		"English": "Nothing was added, since the requested messages have all been deleted.",
+	}
 	PERMISSION_REQUEST: dict[SupportedLanguages, str] = {
 		"English": """[recipientID], if you react to this message with ✅, this bot's trusted users will no longer need to request your permission to add your messages to the bot's corpus. This does not mean your messages WILL be added, but that they COULD be added if a trusted user thinks one of your messages would improve the bot.
 This is entirely voluntary and can be revoked at any time by running `revoke`. However (for the moment at least), any messages of yours added prior to revocation will still remain in the bot's corpus, and will influence answers in all servers the bot is present in, not just this server.
@@ -180,6 +232,10 @@ To agree to this, react to this message with ✅. To reject this, react with ❌
 	RECIPIENT_ID_MUST_EXIST: dict[SupportedLanguages, str] = {
 		"English": "Recipient ID cannot be recorded as None.",
 	}
+	# Supported substitutions: [requesterID], [count], [plural], [requestMessageLinks]
+	TOO_MANY_PENDING: dict[SupportedLanguages, str] = {
+		"English": "[requesterID], you already have [count] pending request[plural], so cannot make another until some are answered:\n[requestMessageLinks]",
+	}
 	# Supported substitutions: [recipientID], [requesterIDs], [desiredMessageLinks]
 	VECTORSTORE_REQUEST: dict[SupportedLanguages, str] = {
 		"English": """Hi [recipientID]. [requesterIDs] would like to add the following messages of yours to this bot's corpus.
@@ -195,4 +251,8 @@ To agree to this, react to this message with ✅. To reject this, react with ❌
 class VectorstoreTexts:
 	NAME: dict[SupportedLanguages, str] = {
 		"English": "Vectorstore"
+	}
+	# Supported substitutions: [filepath]
+	NOT_LOADED: dict[SupportedLanguages, str] = {
+		"English": "The vectorstore's file ([filepath]) has not been loaded, so changes cannot be saved and are refused. Fix or replace the file, then load it.",
 	}
\ No newline at end of file
@@ -0,0 +1,357 @@
+# Benchmarks the whole /ask path offline: message_ask is driven with fake Discord messages and interactions, and a stub model with configurable latency, over synthetic corpora of various sizes.
+# Each query passes through three phases: new queries (answered in full), the same queries again (exact cache hits), then reworded queries (semantic cache hits).
+# Reports p50/p95/p99 latency, throughput, and peak RSS for each stage, and saves them as JSON. Pass --baseline to compare against an earlier run's JSON, exiting with status 1 on any regression.
+# Usage: python benchmarks/ask.py [--sizes 1000 10000] [--queries 100] [--concurrency 8] [--llm-latency 0.3] [--send-latency 0.] [--no-stream] [--hashing-embeddings] [--output path.json] [--baseline path.json]
+from argparse import ArgumentParser
+from asyncio import Semaphore, gather, run, sleep
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+from hashlib import blake2b
+import json
+from numpy import float32, mean, ndarray, percentile, zeros
+from numpy.linalg import norm
+from numpy.random import default_rng
+import os
+import platform
+import re
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, Iterable, TypeVar
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from discord import Interaction
+from pydantic import SecretStr
+
+from Settings import *
+import src.messages
+from src.components.ai import AI
+from src.components.cache import Cache
+from src.components.contextPacker import ContextPacker
+from src.components.discord import Discord
+from src.components.embedder import Embedder
+from src.components.executor import Executor
+from src.components.singleFlight import SingleFlight
+from src.components.vectorstore import Vectorstore
+from src.messages import message_ask
+
+try:
+	from resource import RUSAGE_SELF, getrusage
+except ImportError: # Windows
+	getrusage = None
+
+_Function = TypeVar("_Function", bound=Callable[..., Any])
+
+PHASES: tuple[str, ...] = ("new", "exact", "semantic")
+STAGES: tuple[str, ...] = ("cacheExact", "cacheSemantic", "embed", "retrieval", "vectorSearch", "lexicalSearch", "contextPacking", "promptBuild", "llm", "split", "send", "total")
+_REGRESSION_FLOOR: float = 0.1 # Milliseconds a p95 must worsen by to count as a regression, so that noise in near-instant stages is ignored
+
+def getPeakRSS() -> float | None:
+	"""Returns the process's peak resident set size so far in MiB, or None where it cannot be measured."""
+	if getrusage is None: return None
+	# Reported in bytes on macOS, but kibibytes elsewhere
+	return getrusage(RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+class StageTimer:
+	"""Records each call's duration, and how much it raised the peak RSS, per stage."""
+	durations: defaultdict[str, list[float]]
+	rssGrowth: defaultdict[str, float]
+
+	def __init__(self) -> None:
+		self.reset()
+
+	def reset(self) -> None:
+		self.durations = defaultdict(list)
+		self.rssGrowth = defaultdict(float)
+
+	def record(self, stage: str, duration: float, rssBefore: float | None) -> None:
+		self.durations[stage].append(duration)
+		if rssBefore is not None: self.rssGrowth[stage] += (getPeakRSS() or rssBefore) - rssBefore
+
+	def wrap(self, stage: str, function: _Function) -> _Function:
+		"""Returns the provided blocking function, timed as the provided stage."""
+		@wraps(function)
+		def timed(*args, **kwargs):
+			rssBefore = getPeakRSS()
+			start = perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally: self.record(stage, perf_counter() - start, rssBefore)
+		return timed # type: ignore
+
+	def summarize(self) -> dict[str, dict[str, float | int | None]]:
+		"""Returns each stage's call count, latency percentiles in milliseconds, and peak RSS growth in MiB."""
+		return {stage: {
+			"calls": len(durations),
+			"meanMilliseconds": float(mean(milliseconds := [1000*duration for duration in durations])),
+			"p50Milliseconds": float(percentile(milliseconds, 50)),
+			"p95Milliseconds": float(percentile(milliseconds, 95)),
+			"p99Milliseconds": float(percentile(milliseconds, 99)),
+			"peakRSSGrowthMiB": self.rssGrowth[stage] if getrusage is not None else None
+		} for stage in STAGES if (durations := self.durations.get(stage))}
+
+
+class HashingEmbedder(Embedder):
+	"""Embeds texts as sums of pseudorandom word vectors, so that everything but the model can be benchmarked without downloading or running one."""
+	_dimension: int
+	_WORD_PATTERN: re.Pattern[str] = re.compile(r"\w+")
+
+	def __init__(self, dimension: int = 384, batchSize: int = 256) -> None:
+		self._modelName = "hashing"
+		self._batchSize = batchSize
+		self._dimension = dimension
+
+	def load(self) -> None:
+		return None
+
+	def embedMany(self, texts: Iterable[str]) -> list[ndarray]:
+		return [self.embedOne(text) for text in texts]
+
+	def embedOne(self, text: str) -> ndarray:
+		vector = zeros(self._dimension, dtype=float32)
+		for word in self._WORD_PATTERN.findall(text.casefold()):
+			vector += default_rng(int.from_bytes(blake2b(word.encode(), digest_size=8).digest(), "little")).standard_normal(self._dimension).astype(float32)
+		return vector / (norm(vector) or 1.)
+
+
+class StubChatModel:
+	"""Stands in for the AI's chat model: waits for the configured time to first token, then produces a fixed answer at the configured rate."""
+	def __init__(self, timer: StageTimer, latency: float, tokensPerSecond: float, responseCharacters: int) -> None:
+		self._timer = timer
+		self._latency = latency
+		self._tokenInterval = 1./tokensPerSecond if tokensPerSecond > 0. else 0.
+		sentence = "This is a synthetic answer sentence produced by the benchmark's stub model. "
+		self._response = (sentence*(responseCharacters//len(sentence) + 1))[:responseCharacters].rstrip()
+
+	async def ainvoke(self, messages: list[tuple[str, str]]) -> SimpleNamespace:
+		start = perf_counter()
+		await sleep(self._latency + self._tokenInterval*len(self._response)/4)
+		self._timer.record("llm", perf_counter() - start, None)
+		return SimpleNamespace(content=self._response)
+
+	async def astream(self, messages: list[tuple[str, str]]) -> AsyncIterator[SimpleNamespace]:
+		start = perf_counter()
+		await sleep(self._latency)
+		# Roughly four characters per token
+		for i in range(0, len(self._response), 4):
+			await sleep(self._tokenInterval)
+			yield SimpleNamespace(content=self._response[i:i + 4])
+		self._timer.record("llm", perf_counter() - start, None)
+
+
+class FakeMessage:
+	"""Stands in for a Discord message, recording each reply and edit as a send."""
+	_nextID: int = 1
+
+	def __init__(self, timer: StageTimer, sendLatency: float, authorID: int, channelID: int, guildID: int, content: str = "") -> None:
+		self._timer = timer
+		self._sendLatency = sendLatency
+		self.id = FakeMessage._nextID
+		FakeMessage._nextID += 1
+		self.author = SimpleNamespace(id=authorID)
+		self.channel = SimpleNamespace(id=channelID)
+		self.guild = SimpleNamespace(id=guildID)
+		self.content = content
+
+	async def _send(self, content: str) -> "FakeMessage":
+		start = perf_counter()
+		await sleep(self._sendLatency)
+		self._timer.record("send", perf_counter() - start, None)
+		return FakeMessage(self._timer, self._sendLatency, 0, self.channel.id, self.guild.id, content)
+
+	async def reply(self, content: str, **kwargs) -> "FakeMessage":
+		return await self._send(content)
+
+	async def edit(self, *, content: str, **kwargs) -> "FakeMessage":
+		await self._send(content)
+		self.content = content
+		return self
+
+	async def add_reaction(self, emoji: str) -> None:
+		await self._send(emoji)
+
+
+class FakeInteraction(Interaction):
+	"""Stands in for a slash command's interaction, recording its deferral, edits, and follow-ups as sends."""
+	def __init__(self, timer: StageTimer, sendLatency: float, userID: int, channelID: int, guildID: int) -> None:
+		# Interaction's own initialization needs a live connection, so only what the bot reads is set
+		self._message = FakeMessage(timer, sendLatency, userID, channelID, guildID)
+		self.user = self._message.author # type: ignore
+		self.channel = self._message.channel # type: ignore
+		self.guild_id = guildID
+		deferred = False
+		async def defer(**kwargs) -> None:
+			nonlocal deferred
+			await self._message._send("")
+			deferred = True
+		self._cs_response = SimpleNamespace(is_done=lambda: deferred, defer=defer)
+		self._cs_followup = SimpleNamespace(send=lambda content, **kwargs: self._message._send(content))
+
+	@property
+	def channel_id(self) -> int:
+		return self._message.channel.id
+
+	async def edit_original_response(self, *, content: str, **kwargs) -> FakeMessage: # type: ignore
+		return await self._message.edit(content=content)
+
+
+def makeCorpus(size: int, seed: int) -> tuple[list[str], list[str]]:
+	"""Returns the provided number of synthetic texts about distinct made-up topics, and one question answered by each."""
+	rng = default_rng(seed)
+	syllables = ["ka", "lo", "mi", "ren", "sa", "tor", "vi", "zu", "bel", "dra", "en", "fi", "gor", "hal", "ix", "jun"]
+	def makeWord() -> str:
+		return "".join(rng.choice(syllables, int(rng.integers(2, 4))))
+	verbs = ["stores", "controls", "replaces", "repairs", "generates", "requires", "protects", "measures"]
+	texts, questions = [], []
+	for _ in range(size):
+		subject, object, place, reason = makeWord(), makeWord(), makeWord(), makeWord()
+		verb = str(rng.choice(verbs))
+		texts.append(f"The {subject} {verb} the {object} near {place}. It does so because of the {reason}, which the {subject} depends on at {place}.")
+		questions.append(f"Which {object} near {place} does the {subject} need?")
+	return texts, questions
+
+def reword(question: str) -> str:
+	"""Returns the provided question reworded trivially, so that it misses the exact cache but should hit the semantic cache."""
+	return question.lower().rstrip("?")
+
+
+async def runPhase(queries: list[str], concurrency: int, sources: str, timer: StageTimer, sendLatency: float, **components) -> dict:
+	"""Asks each of the provided queries through message_ask, at most the provided number at once, and returns the phase's statistics."""
+	timer.reset()
+	slots = Semaphore(concurrency)
+	async def ask(i: int, query: str) -> None:
+		# Spread queries over users, channels, and servers, as a live bot would see them
+		useInteraction = sources == "interaction" or (sources == "both" and i % 2)
+		source = FakeInteraction(timer, sendLatency, 1000 + i, 100 + i % 10, 10 + i % 3) if useInteraction else FakeMessage(timer, sendLatency, 1000 + i, 100 + i % 10, 10 + i % 3, query)
+		async with slots:
+			start = perf_counter()
+			await message_ask(source, query, **components) # type: ignore
+			timer.record("total", perf_counter() - start, None)
+	rssBefore = getPeakRSS()
+	start = perf_counter()
+	await gather(*(ask(i, query) for i, query in enumerate(queries)))
+	seconds = perf_counter() - start
+	return {
+		"queries": len(queries),
+		"seconds": seconds,
+		"queriesPerSecond": len(queries)/seconds if seconds else None,
+		"peakRSSMiB": getPeakRSS(),
+		"peakRSSGrowthMiB": (getPeakRSS() or 0.) - rssBefore if rssBefore is not None else None,
+		"stages": timer.summarize()
+	}
+
+async def benchmarkCorpus(size: int, arguments, timer: StageTimer) -> dict:
+	"""Loads a synthetic corpus of the provided size, then runs each phase's queries against it."""
+	embedder = HashingEmbedder(batchSize=EMBEDDING_BATCH_SIZE) if arguments.hashing_embeddings else Embedder(arguments.model, EMBEDDING_THREADS, EMBEDDING_BATCH_SIZE)
+	texts, questions = makeCorpus(size, arguments.seed)
+	vectorstore = Vectorstore(embedder, None, arguments.relevance_threshold, VECTORSTORE_SEGMENT_SIZE, None, VECTORSTORE_INDEX_TYPE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_LEXICAL_SEARCH)
+	rssBefore = getPeakRSS()
+	start = perf_counter()
+	for i in range(0, size, VECTORSTORE_INGESTION_BATCH_SIZE):
+		vectorstore.add(texts[i:i + VECTORSTORE_INGESTION_BATCH_SIZE], [f"https://discord.com/channels/1/2/{id}" for id in range(i, min(i + VECTORSTORE_INGESTION_BATCH_SIZE, size))], [id % 100 for id in range(i, min(i + VECTORSTORE_INGESTION_BATCH_SIZE, size))])
+	loadSeconds = perf_counter() - start
+	print(f"Corpus of {size} texts ({len(vectorstore)} segments) loaded in {loadSeconds:.2f}s")
+
+	# The cache must hold every query for the repeated phases to hit it
+	cache = Cache(embedder, max(CACHE_MAX_SIZE, arguments.queries), CACHE_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, None, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE)
+	ai = AI(SecretStr("benchmark"), AI_SYSTEM_PROMPT, AI_TEMPERATURE, AI_MAX_INPUT_CHARACTERS, AI_MAX_OUTPUT_CHARACTERS) if not arguments.no_ai else None
+	executor = Executor(EXECUTOR_MAX_WORKERS, EXECUTOR_MAX_CONCURRENT_QUERIES)
+	# Instrument each stage on these instances only, so that nothing outside the benchmark is affected
+	cache.getExactMatch = timer.wrap("cacheExact", cache.getExactMatch) # type: ignore
+	cache.getSemanticMatch = timer.wrap("cacheSemantic", cache.getSemanticMatch) # type: ignore
+	embedder.embedOne = timer.wrap("embed", embedder.embedOne) # type: ignore
+	vectorstore.query = timer.wrap("retrieval", vectorstore.query) # type: ignore
+	if vectorstore._index is not None: vectorstore._index.search = timer.wrap("vectorSearch", vectorstore._index.search) # type: ignore
+	if vectorstore._lexicalIndex is not None: vectorstore._lexicalIndex.search = timer.wrap("lexicalSearch", vectorstore._lexicalIndex.search) # type: ignore
+	if ai is not None:
+		ai._ai = StubChatModel(timer, arguments.llm_latency, arguments.llm_tokens_per_second, arguments.response_characters) # type: ignore
+		ai._buildMessages = timer.wrap("promptBuild", ai._buildMessages) # type: ignore
+
+	rng = default_rng(arguments.seed + 1)
+	queries = [questions[int(i)] for i in rng.choice(size, min(arguments.queries, size), replace=False)]
+	phases = {}
+	try:
+		for phase, phaseQueries in zip(PHASES, (queries, queries, [reword(query) for query in queries])):
+			phases[phase] = await runPhase(phaseQueries, arguments.concurrency, arguments.sources, timer, arguments.send_latency, ai=ai, cache=cache, executor=executor, inFlightQueries=SingleFlight(CACHE_SEMANTIC_SIMILARITY_THRESHOLD if CACHE_COALESCE_SIMILAR_QUERIES else None), vectorstore=vectorstore)
+	finally: executor.shutdown()
+	return {"corpusSize": size, "segments": len(vectorstore), "loadSeconds": loadSeconds, "loadPeakRSSGrowthMiB": (getPeakRSS() or 0.) - rssBefore if rssBefore is not None else None, "phases": phases}
+
+def printRun(result: dict) -> None:
+	print(f"{'Phase':<10}{'Stage':<16}{'Calls':>7}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}{'RSS+ (MiB)':>12}")
+	for phase, phaseResult in result["phases"].items():
+		for stage, stats in phaseResult["stages"].items():
+			rssGrowth = f"{stats['peakRSSGrowthMiB']:.1f}" if stats["peakRSSGrowthMiB"] is not None else "-"
+			print(f"{phase:<10}{stage:<16}{stats['calls']:>7}{stats['p50Milliseconds']:>11.3f}{stats['p95Milliseconds']:>11.3f}{stats['p99Milliseconds']:>11.3f}{rssGrowth:>12}")
+		peakRSS = f", peak RSS {phaseResult['peakRSSMiB']:.1f} MiB" if phaseResult["peakRSSMiB"] is not None else ""
+		print(f"{phase:<10}{phaseResult['queries']} queries in {phaseResult['seconds']:.2f}s: {phaseResult['queriesPerSecond']:.1f} queries/s{peakRSS}")
+
+def findRegressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+	"""Returns a description of each stage whose p95 latency worsened by more than the provided fraction since the baseline, for corpus sizes and phases present in both."""
+	baselineRuns = {corpusResult["corpusSize"]: corpusResult for corpusResult in baseline.get("runs", [])}
+	regressions: list[str] = []
+	for corpusResult in results["runs"]:
+		if (baselineRun := baselineRuns.get(corpusResult["corpusSize"])) is None: continue
+		for phase, phaseResult in corpusResult["phases"].items():
+			baselineStages = baselineRun["phases"].get(phase, {}).get("stages", {})
+			for stage, stats in phaseResult["stages"].items():
+				if (baselineStats := baselineStages.get(stage)) is None: continue
+				old, new = baselineStats["p95Milliseconds"], stats["p95Milliseconds"]
+				if new > old*(1. + tolerance) and new - old > _REGRESSION_FLOOR:
+					regressions.append(f"{corpusResult['corpusSize']} texts, {phase} phase, {stage}: p95 {old:.3f} ms -> {new:.3f} ms ({new/old - 1. if old else float('inf'):+.0%})")
+	return regressions
+
+def main() -> None:
+	parser = ArgumentParser(description="Benchmarks the /ask path end to end, without Discord or an AI provider.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="The numbers of synthetic texts in each benchmarked corpus.")
+	parser.add_argument("--queries", type=int, default=100, help="The number of queries per phase, each answered by a different text.")
+	parser.add_argument("--concurrency", type=int, default=8, help="The maximum number of queries asked at once.")
+	parser.add_argument("--sources", choices=["message", "interaction", "both"], default="both", help="Whether queries arrive as pings, slash commands, or alternately both.")
+	parser.add_argument("--llm-latency", type=float, default=0.3, help="The stub model's time to first token, in seconds.")
+	parser.add_argument("--llm-tokens-per-second", type=float, default=500., help="The stub model's generation rate, or 0 for instant generation.")
+	parser.add_argument("--response-characters", type=int, default=800, help="The length of the stub model's answers.")
+	parser.add_argument("--send-latency", type=float, default=0., help="The simulated Discord API latency of each reply, edit, or follow-up, in seconds.")
+	parser.add_argument("--no-stream", action="store_true", help="Send each answer once complete, rather than streaming it. Mirrors AI_STREAM_RESPONSES = False.")
+	parser.add_argument("--stream-edit-interval", type=float, default=DISCORD_STREAM_EDIT_INTERVAL, help="Mirrors DISCORD_STREAM_EDIT_INTERVAL.")
+	parser.add_argument("--no-ai", action="store_true", help="Benchmark without an AI, so that queries return the vectorstore's raw texts.")
+	parser.add_argument("--model", default=EMBEDDING_MODEL_NAME, help="The embedding model. Ignored if --hashing-embeddings is passed.")
+	parser.add_argument("--hashing-embeddings", action="store_true", help="Embed with word hashes instead of a model, to benchmark everything else quickly (or where the model cannot be downloaded).")
+	parser.add_argument("--relevance-threshold", type=float, default=VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD, help="Mirrors VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD. Hashed embeddings may need a lower one for queries to find context.")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--output", default=os.path.join("benchmarks", "results", f"ask-{datetime.now():%Y%m%d-%H%M%S}.json"), help="Where to save the results as JSON.")
+	parser.add_argument("--baseline", help="An earlier run's JSON results to compare p95 latencies against.")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="The fraction by which a stage's p95 latency may worsen before it counts as a regression.")
+	arguments = parser.parse_args()
+
+	src.messages.AI_STREAM_RESPONSES = not arguments.no_stream
+	src.messages.DISCORD_STREAM_EDIT_INTERVAL = arguments.stream_edit_interval
+	timer = StageTimer()
+	ContextPacker.pack = staticmethod(timer.wrap("contextPacking", ContextPacker.pack)) # type: ignore
+	Discord.splitIntoSentences = staticmethod(timer.wrap("split", Discord.splitIntoSentences)) # type: ignore
+
+	results = {
+		"timestamp": datetime.now().isoformat(timespec="seconds"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"arguments": vars(arguments),
+		"runs": []
+	}
+	for size in arguments.sizes:
+		results["runs"].append(corpusResult := run(benchmarkCorpus(size, arguments, timer)))
+		printRun(corpusResult)
+
+	os.makedirs(os.path.dirname(os.path.abspath(arguments.output)), exist_ok=True)
+	with open(arguments.output, "w", encoding="utf-8") as f: json.dump(results, f, indent="\t")
+	print(f"Results saved to {arguments.output}")
+
+	if arguments.baseline:
+		with open(arguments.baseline, encoding="utf-8") as f: baseline = json.load(f)
+		if regressions := findRegressions(results, baseline, arguments.tolerance):
+			print(f"{len(regressions)} regression{'s' if len(regressions) != 1 else ''} since {arguments.baseline}:")
+			for regression in regressions: print(f"- {regression}")
+			sys.exit(1)
+		print(f"No regressions since {arguments.baseline}.")
+
+if __name__ == "__main__":
+	main()
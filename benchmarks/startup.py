@@ -0,0 +1,159 @@
+# Benchmarks how long the bot takes to start, broken down into imports, constructing its components, loading the embedding (and reranking) model, and loading the cache and vectorstore from disk.
+# Each repeat runs in a fresh interpreter, so that imports are never already cached; synthetic cache and vectorstore files of each size are built once beforehand.
+# Reports the median of each step, and the time until the bot connects to Discord now that models and files are loaded afterwards, versus loading them all first. Pass --baseline to compare against an earlier run's JSON, exiting with status 1 on any regression.
+# Usage: python benchmarks/startup.py [--sizes 1000 10000] [--repeats 3] [--hashing-embeddings] [--reranker-model name] [--output path.json] [--baseline path.json]
+from argparse import SUPPRESS, ArgumentParser
+from datetime import datetime
+from importlib import import_module
+import json
+import os
+import platform
+from statistics import median
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# (step name, modules), imported in this order, so that each step only counts what earlier steps did not already import
+IMPORT_STEPS: tuple[tuple[str, tuple[str, ...]], ...] = (
+	("importNumpy", ("numpy",)),
+	("importDiscord", ("discord", "discord.ext.commands")),
+	("importFAISS", ("faiss",)),
+	("importFastEmbed", ("fastembed",)),
+	("importLangChain", ("langchain_core", "langchain_groq")),
+	("importBot", ("Settings", "src.messages", "src.reactions")),
+)
+WARMUP_STEPS: tuple[str, ...] = ("loadEmbeddingModel", "loadRerankingModel", "loadCache", "loadVectorstore")
+STEPS: tuple[str, ...] = (*(step for step, _ in IMPORT_STEPS), "construct", *WARMUP_STEPS)
+_REGRESSION_FLOOR: float = 5. # Milliseconds a step must worsen by to count as a regression, so that noise in near-instant steps is ignored
+
+def runChild(arguments) -> None:
+	"""Times one startup in this (fresh) interpreter, printing each step's seconds as JSON."""
+	seconds: dict[str, float | None] = {}
+	for step, modules in IMPORT_STEPS:
+		start = perf_counter()
+		for module in modules: import_module(module)
+		seconds[step] = perf_counter() - start
+
+	from Settings import CACHE_EXPIRATION_TIME, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, EMBEDDING_BATCH_SIZE, EMBEDDING_THREADS, RERANKER_CACHE_SIZE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD, VECTORSTORE_INDEX_TYPE, VECTORSTORE_LEXICAL_SEARCH, VECTORSTORE_LOG_COMPACTION_SIZE, VECTORSTORE_SEGMENT_SIZE
+	from src.components.cache import Cache
+	from src.components.embedder import Embedder
+	from src.components.reranker import Reranker
+	from src.components.vectorstore import Vectorstore
+	start = perf_counter()
+	embedder = Embedder(arguments.model, EMBEDDING_THREADS, EMBEDDING_BATCH_SIZE)
+	reranker = Reranker(arguments.reranker_model, EMBEDDING_THREADS, RERANKER_CACHE_SIZE) if arguments.reranker_model else None
+	cache = Cache(embedder, arguments.cache_size, CACHE_EXPIRATION_TIME, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, arguments.cache_filepath, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE, deferLoading=True)
+	vectorstore = Vectorstore(embedder, arguments.vectorstore_filepath, VECTORSTORE_CONTEXT_RELEVANCE_THRESHOLD, VECTORSTORE_SEGMENT_SIZE, VECTORSTORE_LOG_COMPACTION_SIZE, VECTORSTORE_INDEX_TYPE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_LEXICAL_SEARCH, deferLoading=True)
+	seconds["construct"] = perf_counter() - start
+
+	for step, load in (("loadEmbeddingModel", embedder.load if not arguments.hashing_embeddings else None), ("loadRerankingModel", reranker.load if reranker is not None else None), ("loadCache", cache.load), ("loadVectorstore", vectorstore.load)):
+		if load is None:
+			seconds[step] = None
+			continue
+		start = perf_counter()
+		load()
+		seconds[step] = perf_counter() - start
+	print(json.dumps(seconds))
+
+def buildFiles(directory: str, size: int, arguments) -> tuple[str, str]:
+	"""Saves a synthetic vectorstore of the provided number of texts, and a cache holding a query for each, in the provided directory. Returns their filepaths."""
+	from ask import HashingEmbedder, makeCorpus
+	from Settings import CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE, EMBEDDING_BATCH_SIZE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_INDEX_TYPE, VECTORSTORE_INGESTION_BATCH_SIZE, VECTORSTORE_LEXICAL_SEARCH, VECTORSTORE_SEGMENT_SIZE
+	from src.components.cache import Cache
+	from src.components.vectorstore import Vectorstore
+	# Hashed embeddings load exactly as fast as a model's of the same dimension, and need no model to build
+	embedder = HashingEmbedder(arguments.dimension, EMBEDDING_BATCH_SIZE)
+	texts, questions = makeCorpus(size, arguments.seed)
+	vectorstore = Vectorstore(embedder, None, None, VECTORSTORE_SEGMENT_SIZE, None, VECTORSTORE_INDEX_TYPE, VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE, VECTORSTORE_LEXICAL_SEARCH)
+	for i in range(0, size, VECTORSTORE_INGESTION_BATCH_SIZE):
+		vectorstore.add(texts[i:i + VECTORSTORE_INGESTION_BATCH_SIZE], [f"https://discord.com/channels/1/2/{id}" for id in range(i, min(i + VECTORSTORE_INGESTION_BATCH_SIZE, size))], [id % 100 for id in range(i, min(i + VECTORSTORE_INGESTION_BATCH_SIZE, size))])
+	vectorstore.save(vectorstoreFilepath := os.path.join(directory, f"vectorstore-{size}.bin"))
+	cache = Cache(embedder, size, None, None, None, CACHE_SEMANTIC_APPROXIMATE_SEARCH_MINIMUM_SIZE)
+	for question in questions: cache[question] = (question, embedder.embedOne(question))
+	cache.save(cacheFilepath := os.path.join(directory, f"cache-{size}.bin"))
+	return cacheFilepath, vectorstoreFilepath
+
+def benchmarkSize(size: int, arguments, directory: str) -> dict:
+	"""Times the provided number of startups with files of the provided size, and returns each step's median seconds."""
+	cacheFilepath, vectorstoreFilepath = buildFiles(directory, size, arguments)
+	childArguments = [sys.executable, os.path.abspath(__file__), "--child", "--model", arguments.model, "--cache-filepath", cacheFilepath, "--cache-size", f"{size}", "--vectorstore-filepath", vectorstoreFilepath]
+	if arguments.hashing_embeddings: childArguments.append("--hashing-embeddings")
+	if arguments.reranker_model: childArguments += ["--reranker-model", arguments.reranker_model]
+	repeats = [json.loads(subprocess.run(childArguments, capture_output=True, check=True, text=True).stdout.splitlines()[-1]) for _ in range(arguments.repeats)]
+	steps = {step: median(values) if None not in (values := [repeat[step] for repeat in repeats]) else None for step in STEPS}
+	untilConnecting = sum(steps[step] or 0. for step in STEPS if step not in WARMUP_STEPS)
+	warmup = sum(steps[step] or 0. for step in WARMUP_STEPS)
+	return {"corpusSize": size, "steps": steps, "untilConnectingSeconds": untilConnecting, "warmupSeconds": warmup, "eagerUntilConnectingSeconds": untilConnecting + warmup}
+
+def printRun(result: dict) -> None:
+	print(f"{result['corpusSize']} texts:")
+	for step, seconds in result["steps"].items(): print(f"  {step:<22}{f'{1000*seconds:.1f} ms' if seconds is not None else '-':>12}")
+	print(f"  Connects to Discord after {result['untilConnectingSeconds']:.2f}s, then warms up for {result['warmupSeconds']:.2f}s (loading everything first would connect after {result['eagerUntilConnectingSeconds']:.2f}s)")
+
+def findRegressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+	"""Returns a description of each step that slowed by more than the provided fraction since the baseline, for corpus sizes present in both."""
+	baselineRuns = {corpusResult["corpusSize"]: corpusResult for corpusResult in baseline.get("runs", [])}
+	regressions: list[str] = []
+	for corpusResult in results["runs"]:
+		if (baselineRun := baselineRuns.get(corpusResult["corpusSize"])) is None: continue
+		for step, seconds in corpusResult["steps"].items():
+			if seconds is None or (baselineSeconds := baselineRun["steps"].get(step)) is None: continue
+			old, new = 1000*baselineSeconds, 1000*seconds
+			if new > old*(1. + tolerance) and new - old > _REGRESSION_FLOOR:
+				regressions.append(f"{corpusResult['corpusSize']} texts, {step}: {old:.1f} ms -> {new:.1f} ms ({new/old - 1. if old else float('inf'):+.0%})")
+	return regressions
+
+def main() -> None:
+	parser = ArgumentParser(description="Benchmarks the bot's startup, without connecting to Discord.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="The numbers of synthetic texts in each benchmarked vectorstore (and queries in its cache).")
+	parser.add_argument("--repeats", type=int, default=3, help="The number of startups timed per size, whose median is reported.")
+	parser.add_argument("--model", help="The embedding model whose loading is timed. Defaults to EMBEDDING_MODEL_NAME.")
+	parser.add_argument("--hashing-embeddings", action="store_true", help="Skip timing the embedding model's loading (e.g. where it cannot be downloaded).")
+	parser.add_argument("--reranker-model", help="A reranking model whose loading is also timed, if any.")
+	parser.add_argument("--dimension", type=int, default=384, help="The embedding dimension of the synthetic files, which should match the model's.")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--output", default=os.path.join("benchmarks", "results", f"startup-{datetime.now():%Y%m%d-%H%M%S}.json"), help="Where to save the results as JSON.")
+	parser.add_argument("--baseline", help="An earlier run's JSON results to compare step times against.")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="The fraction by which a step may slow before it counts as a regression.")
+	# Used internally, to time one startup in a fresh interpreter
+	parser.add_argument("--child", action="store_true", help=SUPPRESS)
+	parser.add_argument("--cache-filepath", help=SUPPRESS)
+	parser.add_argument("--cache-size", type=int, help=SUPPRESS)
+	parser.add_argument("--vectorstore-filepath", help=SUPPRESS)
+	arguments = parser.parse_args()
+	# Checked before importing anything else, so that the child's imports are all timed
+	if arguments.child: return runChild(arguments)
+	from Settings import EMBEDDING_MODEL_NAME
+	arguments.model = arguments.model or EMBEDDING_MODEL_NAME
+
+	results = {
+		"timestamp": datetime.now().isoformat(timespec="seconds"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"arguments": vars(arguments),
+		"runs": []
+	}
+	# Files must be within the benchmark's directory for the bot's components to accept their paths
+	os.makedirs(resultsDirectory := os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"), exist_ok=True)
+	with TemporaryDirectory(dir=resultsDirectory) as directory:
+		for size in arguments.sizes:
+			results["runs"].append(corpusResult := benchmarkSize(size, arguments, directory))
+			printRun(corpusResult)
+
+	os.makedirs(os.path.dirname(os.path.abspath(arguments.output)), exist_ok=True)
+	with open(arguments.output, "w", encoding="utf-8") as f: json.dump(results, f, indent="\t")
+	print(f"Results saved to {arguments.output}")
+
+	if arguments.baseline:
+		with open(arguments.baseline, encoding="utf-8") as f: baseline = json.load(f)
+		if regressions := findRegressions(results, baseline, arguments.tolerance):
+			print(f"{len(regressions)} regression{'s' if len(regressions) != 1 else ''} since {arguments.baseline}:")
+			for regression in regressions: print(f"- {regression}")
+			sys.exit(1)
+		print(f"No regressions since {arguments.baseline}.")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,74 @@
+# Compares the vectorstore's index types against exact (flat) search, reporting recall@k, query latency, build time, and memory.
+# By default, synthetic clustered embeddings are used, so that large corpora can be benchmarked without embedding anything. Pass --texts to embed real texts instead.
+# Usage: python benchmarks/vectorstoreIndex.py [--size 100000] [--queries 1000] [--k 4] [--types Flat IVF-Flat IVF-PQ HNSW] [--texts path/to/texts.txt]
+from argparse import ArgumentParser
+from numpy import float32, mean, ndarray, percentile, stack
+from numpy.linalg import norm
+from numpy.random import default_rng
+import os
+import sys
+from time import perf_counter
+from typing import get_args
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.components.vectorIndex import VectorIndex, VectorIndexType
+
+def makeSyntheticEmbeddings(count: int, dimension: int, clusterCount: int, seed: int) -> ndarray:
+	"""Returns unit-length vectors scattered around random centres, since real sentence embeddings also cluster by topic."""
+	rng = default_rng(seed)
+	centres = rng.standard_normal((clusterCount, dimension)).astype(float32)
+	vectors = centres[rng.integers(0, clusterCount, count)] + 0.75*rng.standard_normal((count, dimension)).astype(float32)
+	return vectors / norm(vectors, axis=1, keepdims=True)
+
+def makeTextEmbeddings(filepath: str, modelName: str) -> ndarray:
+	"""Returns the embeddings of each non-empty line of the provided file."""
+	from src.components.embedder import Embedder
+	with open(filepath, encoding="utf-8") as f: texts = [line.strip() for line in f if line.strip()]
+	return stack(Embedder(modelName).embedMany(texts)).astype(float32)
+
+def benchmark(indexType: VectorIndexType, corpus: ndarray, queries: ndarray, k: int, approximateMinimumSize: int) -> tuple[VectorIndex, float, list[float], ndarray]:
+	"""Builds an index of the provided type over the corpus, then searches it for each query one at a time (as the bot does). Returns the index, its build time, each query's latency, and the results' IDs."""
+	index = VectorIndex(corpus.shape[1], indexType, approximateMinimumSize)
+	ids = list(range(corpus.shape[0]))
+	start = perf_counter()
+	index.rebuild(ids, lambda chunk: corpus[chunk])
+	buildTime = perf_counter() - start
+	latencies: list[float] = []
+	results = []
+	for query in queries:
+		start = perf_counter()
+		_, resultIDs = index.search(query.reshape(1, -1), k, lambda chunk: corpus[chunk])
+		latencies.append(perf_counter() - start)
+		results.append(resultIDs[0])
+	return index, buildTime, latencies, stack(results)
+
+def main() -> None:
+	parser = ArgumentParser(description="Benchmarks the vectorstore's index types against exact search.")
+	parser.add_argument("--size", type=int, default=100000, help="The number of synthetic embeddings to index. Ignored if --texts is provided.")
+	parser.add_argument("--dimension", type=int, default=384, help="The dimension of synthetic embeddings. Ignored if --texts is provided.")
+	parser.add_argument("--clusters", type=int, default=1000, help="The number of topics synthetic embeddings are scattered around.")
+	parser.add_argument("--queries", type=int, default=1000, help="The number of queries, which are held out of the indexed corpus.")
+	parser.add_argument("--k", type=int, default=4, help="The number of results per query, as in Vectorstore.query.")
+	parser.add_argument("--types", nargs="+", choices=get_args(VectorIndexType), default=list(get_args(VectorIndexType)), help="The index types to benchmark.")
+	parser.add_argument("--approximate-minimum-size", type=int, default=10000, help="Mirrors VECTORSTORE_APPROXIMATE_INDEX_MINIMUM_SIZE.")
+	parser.add_argument("--texts", help="A file of texts, one per line, to embed and index instead of synthetic embeddings.")
+	parser.add_argument("--model", default="BAAI/bge-small-en-v1.5", help="The embedding model used with --texts.")
+	parser.add_argument("--seed", type=int, default=0)
+	arguments = parser.parse_args()
+
+	embeddings = makeTextEmbeddings(arguments.texts, arguments.model) if arguments.texts else makeSyntheticEmbeddings(arguments.size + arguments.queries, arguments.dimension, arguments.clusters, arguments.seed)
+	queryCount = min(arguments.queries, embeddings.shape[0] // 2)
+	queries, corpus = embeddings[:queryCount], embeddings[queryCount:]
+	print(f"Corpus: {corpus.shape[0]} x {corpus.shape[1]}, {queryCount} queries, k = {arguments.k}")
+
+	# Exact results are the baseline that recall is measured against
+	_, _, _, exactResults = benchmark("Flat", corpus, queries, arguments.k, arguments.approximate_minimum_size)
+	print(f"{'Index':<10}{'Approx.':>9}{'Recall@k':>10}{'Build (s)':>11}{'Mean (ms)':>11}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'Memory (MiB)':>14}")
+	for indexType in arguments.types:
+		index, buildTime, latencies, results = benchmark(indexType, corpus, queries, arguments.k, arguments.approximate_minimum_size)
+		recall = mean([len(set(result) & set(exactResult)) / arguments.k for result, exactResult in zip(results, exactResults)])
+		milliseconds = [1000*latency for latency in latencies]
+		print(f"{indexType:<10}{'yes' if index.isApproximate else 'no':>9}{recall:>10.3f}{buildTime:>11.2f}{mean(milliseconds):>11.3f}{percentile(milliseconds, 50):>10.3f}{percentile(milliseconds, 95):>10.3f}{percentile(milliseconds, 99):>10.3f}{index.memoryUsage / 2**20:>14.1f}")
+
+if __name__ == "__main__":
+	main()
@@ -1,8 +1,10 @@
+from collections.abc import AsyncIterator
 from langchain_groq import ChatGroq
 from pydantic import SecretStr
 
 from Settings import LANGUAGE
 from src.components.discord import Discord
+from src.components.metrics import Metrics
 from Translations import AITexts
 
 class AI:
@@ -10,7 +12,8 @@ class AI:
 	_systemPrompt: str
 	_maxInputCharacters: int | None
 	_maxOutputCharacters: int | None
-	def __init__(self, apiKey: SecretStr, systemPrompt: str, temperature: float = 0., maxInputCharacters: int | None = None, maxOutputCharacters: int | None = None) -> None:
+	_metrics: Metrics | None
+	def __init__(self, apiKey: SecretStr, systemPrompt: str, temperature: float = 0., maxInputCharacters: int | None = None, maxOutputCharacters: int | None = None, metrics: Metrics | None = None) -> None:
 		"""Initialization."""
 		# API key
 		if not isinstance(apiKey, SecretStr) or not apiKey: raise ValueError(AITexts.INVALID_API_KEY[LANGUAGE])
@@ -34,21 +37,65 @@ class AI:
 			if not isinstance(maxInputCharacters, int): raise ValueError(AITexts.INVALID_MAX_INPUT_CHARACTERS_TYPE[LANGUAGE].replace("[count]", f"{maxInputCharacters}"))
 			if maxInputCharacters <= len(systemPrompt): raise ValueError(AITexts.MAX_CHARACTERS_TOO_SMALL[LANGUAGE].replace("[count]", f"{maxInputCharacters}").replace("[promptLength]", f"{len(systemPrompt)}"))
 		self._maxInputCharacters = maxInputCharacters
+		# Failed requests are counted here, since they are otherwise only visible as error messages in the replies
+		self._metrics = metrics
 	
-	def query(self, query: str, context: str | None = None) -> str:
-		"""Generates and returns an answer for the provided query and context."""
+	def getContextBudget(self, query: str) -> int | None:
+		"""Returns how many characters of context can accompany the provided query without it being truncated, or None if there is no limit.
+		Queries are reserved at most half of the space left by the system prompt, so that overly long queries are truncated rather than leaving no room for context."""
+		if self._maxInputCharacters is None: return None
+		availableCharacters = self._maxInputCharacters - len(self._systemPrompt) - len("\n\n" + AITexts.CONTEXT_ADDITION[LANGUAGE].replace("[context]", ""))
+		return max(availableCharacters - min(len(query), availableCharacters//2), 0)
+
+	def _buildMessages(self, query: str, context: str | None = None) -> list[tuple[str, str]]:
+		"""Constructs the prompt for the provided query and context."""
 		systemPromptWithContext = self._systemPrompt + ("\n\n" + AITexts.CONTEXT_ADDITION[LANGUAGE].replace("[context]", f"{context}") if context is not None else "")
-		messages = [
+		return [
 			("system", systemPromptWithContext),
 			# Truncate query if necessary
 			("human", query[:(min(self._maxInputCharacters - len(systemPromptWithContext), len(query)) if self._maxInputCharacters is not None else len(query))])
 		]
+
+	def _truncateResponse(self, response: str | list[str | dict]) -> str:
+		"""Truncates the model's response if necessary."""
+		assert isinstance(response, str)
+		# References are handled outside of this function.
+		return Discord.truncate(response, self._maxOutputCharacters) if self._maxOutputCharacters is not None else response
+
+	def query(self, query: str, context: str | None = None) -> str:
+		"""Generates and returns an answer for the provided query and context.
+		Warning: This blocks until the model responds; prefer queryAsync from within the event loop."""
 		try:
-			response = self._ai.invoke(messages).content
+			response = self._ai.invoke(self._buildMessages(query, context)).content
 		except Exception as e:
+			if self._metrics is not None: self._metrics.increment("ai_errors")
 			return AITexts.QUERY_ERROR[LANGUAGE].replace("[error]", f"{e}")
-		
-		assert isinstance(response, str)
-		# Truncate response if necessary.
-		# References are handled outside of this function.
-		return Discord.truncate(response, self._maxOutputCharacters) if self._maxOutputCharacters is not None else response
\ No newline at end of file
+		return self._truncateResponse(response)
+
+	async def queryAsync(self, query: str, context: str | None = None) -> str:
+		"""Generates and returns an answer for the provided query and context, without blocking the event loop while waiting for the model."""
+		try:
+			response = (await self._ai.ainvoke(self._buildMessages(query, context))).content
+		except Exception as e:
+			if self._metrics is not None: self._metrics.increment("ai_errors")
+			return AITexts.QUERY_ERROR[LANGUAGE].replace("[error]", f"{e}")
+		return self._truncateResponse(response)
+
+	async def queryStream(self, query: str, context: str | None = None) -> AsyncIterator[str]:
+		"""Generates an answer for the provided query and context, yielding the whole answer so far each time more of it arrives.
+		Each yielded answer extends the previous one, including if an error occurs partway, in which case the error message is appended."""
+		response = ""
+		try:
+			async for chunk in self._ai.astream(self._buildMessages(query, context)):
+				if not chunk.content: continue
+				assert isinstance(chunk.content, str)
+				response += chunk.content
+				# Stop generating once the answer is too long, rather than waiting for the model to finish
+				# Unlike _truncateResponse, this cuts mid-sentence, since the answer so far may already be shown and so must not shrink
+				if self._maxOutputCharacters is not None and len(response) > self._maxOutputCharacters:
+					yield response[:self._maxOutputCharacters - 1] + "…"
+					return
+				yield response
+		except Exception as e:
+			if self._metrics is not None: self._metrics.increment("ai_errors")
+			yield (response + "\n\n" if response else "") + AITexts.QUERY_ERROR[LANGUAGE].replace("[error]", f"{e}")
@@ -0,0 +1,57 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from typing import Iterable
+
+from src.components.executor import Executor
+from src.components.metrics import Metrics, timeStage
+from src.components.saveableClass import SaveableClass
+
+# Periodically saves every object that has changed since it was last saved to its last-used filepath, and once more on shutdown, so that changes survive a restart without anyone running /save.
+# Each object is only snapshotted on the event loop; serializing it and writing it (to a temporary file that is fsynced and then renamed over the previous one) happen on the executor, so saving never stalls message handling.
+# While nothing changes, each interval only costs a counter comparison per object.
+class Autosaver:
+	_objects: tuple[SaveableClass, ...]
+	_interval: float
+	_executor: Executor
+	_metrics: Metrics | None
+	_task: Task[None] | None
+
+	def __init__(self, objects: Iterable[SaveableClass], interval: float, executor: Executor, metrics: Metrics | None = None) -> None:
+		"""Initialization."""
+		self._objects = tuple(objects)
+		if not isinstance(interval, (int, float)) or interval <= 0.: raise ValueError(f"Invalid autosave interval provided: {interval}")
+		self._interval = interval
+		self._executor = executor
+		self._metrics = metrics
+		self._task = None
+
+	def start(self) -> None:
+		"""Starts saving changed objects every interval, if not already doing so."""
+		if self._task is None: self._task = create_task(self._run())
+
+	async def stop(self) -> None:
+		"""Stops saving changed objects every interval, then saves any that have changed since."""
+		if self._task is not None:
+			self._task.cancel()
+			try: await self._task
+			except CancelledError: pass
+			self._task = None
+		await self.saveChanged()
+
+	async def saveChanged(self) -> int:
+		"""Saves every object that has changed since it was last saved. Returns the number of objects saved."""
+		savedCount = 0
+		for obj in self._objects:
+			if not obj.hasUnsavedChanges or (save := obj.snapshot()) is None: continue
+			try:
+				with timeStage(self._metrics, "autosave", object=type(obj).__name__): saved = await self._executor.run(save)
+			except OSError:
+				# The object stays changed, so saving it is retried next interval
+				if self._metrics is not None: self._metrics.increment("autosave_errors", object=type(obj).__name__)
+				continue
+			savedCount += saved
+		return savedCount
+
+	async def _run(self) -> None:
+		while True:
+			await sleep(self._interval)
+			await self.saveChanged()
@@ -1,92 +1,213 @@
-from cachetools import TTLCache
-from fastembed import TextEmbedding
+from cachetools import TLRUCache
 from fastembed.common.types import NumpyArray
-from math import sqrt
-from numpy import ndarray
-from pickle import dump, load
+from numpy import array, float32, float64, fromfile, memmap, ndarray
+from typing import Callable
+from struct import calcsize, pack, unpack, unpack_from
 
 from Settings import LANGUAGE
+from src.components.diskCache import DiskCache, DiskCacheEntry
+from src.components.embedder import Embedder
 from src.components.saveableClass import SaveableClass
+from src.components.semanticIndex import SemanticIndex
 from Translations import CacheTexts
 
-# TODO: Is there a way to save/load the cache (and by extension the Numpy arrays) without resorting to possibly-vulnerable Pickle serialization/deserialization?
+_CacheEntry = tuple[str, float] # (response, expiration timestamp)
+
+def _getExpiration(key: str, entry: _CacheEntry, now: float) -> float:
+	"""Each entry carries its own expiration timestamp, so that entries loaded from disk keep their remaining lifetimes."""
+	return entry[1]
+
+class _IndexedTLRUCache(TLRUCache[str, _CacheEntry]):
+	"""A TLRUCache that also drops its evicted and expired keys from a semantic index."""
+	_index: SemanticIndex
+
+	def __init__(self, maxSize: float, index: SemanticIndex) -> None:
+		super().__init__(maxSize, _getExpiration)
+		self._index = index
+
+	def __delitem__(self, key: str) -> None:
+		# Covers both explicit deletions and least-recently-used evictions (popitem); a missing key raises before the index is touched
+		super().__delitem__(key)
+		self._index.remove(key)
+
+	def expire(self, time: float | None = None) -> list[tuple[str, _CacheEntry]]:
+		expired = super().expire(time)
+		for key, _ in expired: self._index.remove(key)
+		return expired
+
+	def clear(self) -> None:
+		super().clear()
+		self._index.clear()
+
+# The cache's in-memory tier, holding the most recently used answers. If a disk tier is provided, every answer cached should also be written to it, lookups that miss should fall through to it, and its hits are promoted back into memory.
+# Only the in-memory tier is used by the plain lookups, so that they never block; the disk tier's methods block on disk I/O, so are meant to be run on the executor (and are thread-safe, since they only touch the disk tier).
 class Cache(SaveableClass):
-	_cache: TTLCache[str, tuple[str, NumpyArray]] | None # query: (response, query embedding)
-	_embeddingModel: TextEmbedding
+	# File format (little-endian):
+	# - Header: signature, version, entry count, embedding dimension, string table size in bytes
+	# - Remaining lifetime of each entry in seconds, as float64s (infinity if it never expires)
+	# - String table: each entry's key then response, each as a uint32 byte length followed by UTF-8 bytes
+	# - Zero padding up to a multiple of _FILE_ALIGNMENT bytes
+	# - Normalized embedding of each entry, as one contiguous float32 matrix (memory-mapped when loaded)
+	_FILE_SIGNATURE: bytes = b"RAGC"
+	_FILE_VERSION: int = 1
+	_FILE_HEADER_FORMAT: str = "<4sHIIQ"
+	_FILE_ALIGNMENT: int = 64
+
+	_cache: _IndexedTLRUCache | None # query: (response, expiration timestamp)
+	_index: SemanticIndex # query: query embedding
+	_embedder: Embedder
+	_maxSize: float
+	_expirationTime: float
 	_semanticSimilarityThreshold: float
+	_diskTier: DiskCache | None
 
-	def __init__(self, maxSize: float, expirationTime: float | None = None, semanticSimilarityThreshold: float | None = 0., filepath: str | None = None) -> None:
+	def __init__(self, embedder: Embedder, maxSize: float, expirationTime: float | None = None, semanticSimilarityThreshold: float | None = 0., filepath: str | None = None, approximateSearchMinimumSize: int | None = None, diskTier: DiskCache | None = None, deferLoading: bool = False) -> None:
 		"""Initialization."""
 		# Filepath
 		super().__init__(filepath)
 		# Embedding model
-		self._embeddingModel = TextEmbedding()
+		self._embedder = embedder
+		# Semantic index
+		self._index = SemanticIndex(approximateSearchMinimumSize)
 		# Semantic threshold
 		if semanticSimilarityThreshold is not None and (not isinstance(semanticSimilarityThreshold, (int, float)) or semanticSimilarityThreshold < 0. or semanticSimilarityThreshold > 1.): raise ValueError(CacheTexts.INVALID_SIMILARITY_THRESHOLD[LANGUAGE].replace("[threshold]", f"{semanticSimilarityThreshold}"))
 		self._semanticSimilarityThreshold = 0. if semanticSimilarityThreshold is None else semanticSimilarityThreshold
+		# Max size
+		if not isinstance(maxSize, (int, float)) or maxSize < 0.: raise ValueError(CacheTexts.INVALID_MAX_SIZE[LANGUAGE].replace("[size]", f"{maxSize}"))
+		self._maxSize = maxSize
+		# Expiration time
+		if expirationTime is not None and (not isinstance(expirationTime, (int, float)) or expirationTime < 0.): raise ValueError(CacheTexts.INVALID_EXPIRATION_TIME[LANGUAGE].replace("[time]", f"{expirationTime}"))
+		self._expirationTime = float("inf") if expirationTime is None else expirationTime
+		self._cache = _IndexedTLRUCache(maxSize, self._index) if maxSize > 0. and self._expirationTime > 0. else None
+		# Disk tier
+		self._diskTier = diskTier
 
-		if not self.load(filepath):
-			# Max size
-			if not isinstance(maxSize, (int, float)) or maxSize < 0.: raise ValueError(CacheTexts.INVALID_MAX_SIZE[LANGUAGE].replace("[size]", f"{maxSize}"))
-			# Expiration time
-			if expirationTime is not None and (not isinstance(expirationTime, (int, float)) or expirationTime < 0.): raise ValueError(CacheTexts.INVALID_EXPIRATION_TIME[LANGUAGE].replace("[time]", f"{expirationTime}"))
-			self._cache = TTLCache(maxSize, float("inf") if expirationTime is None else expirationTime) if maxSize > 0. and (expirationTime is None or expirationTime > 0.) else None
+		# Large caches may instead be loaded by a later call to load(), away from startup
+		if not deferLoading: self.load(filepath)
 
 	def __len__(self) -> int:
-		"""Returns the number of entries currently in the cache."""
+		"""Returns the number of entries currently in the in-memory tier."""
 		return len(self._cache) if self._cache is not None else 0
 
 	def __setitem__(self, key: str, value: tuple[str, NumpyArray]) -> None:
-		"""Associates the provided key to the provided value in the cache."""
+		"""Associates the provided key to the provided value in the in-memory tier (see storeOnDisk() for the disk tier)."""
 		# Verify key type
 		if not isinstance(key, str): raise ValueError(CacheTexts.INVALID_KEY[LANGUAGE].replace("[key]", f"{key}"))
 		# Verify value type
 		if not isinstance(value, tuple) or len(value) != 2 or not isinstance(value[0], str) or not isinstance(value[1], ndarray): raise ValueError(CacheTexts.INVALID_VALUE[LANGUAGE].replace("[value]", f"{value}"))
-		if self._cache is None: return
-		self._cache[key] = value
+		self._store(key, value[0], value[1], self._expirationTime)
 
-	@staticmethod
-	def cosineSimilarity(vectorA: NumpyArray, vectorB: NumpyArray) -> float:
-		"""Calculates the cosine similarity of the two provided vectors (in the range [0, 1])."""
-		squaredNormA: float = (vectorA*vectorA).sum()
-		squaredNormB: float = (vectorB*vectorB).sum()
-		return (vectorA*vectorB).sum() / (sqrt(squaredNormA) * sqrt(squaredNormB)) if squaredNormA and squaredNormB else 0.
+	@property
+	def hasDiskTier(self) -> bool:
+		return self._diskTier is not None
 
 	def embed(self, text: str) -> NumpyArray:
 		"""Constructs the embedding for the provided text."""
-		# If only one text is embedded, FastEmbed returns a generator producing a single element, so we discard the generator.
-		return list(self._embeddingModel.embed(text))[0]
+		return self._embedder.embedOne(text)
 
 	def getExactMatch(self, query: str) -> str | None:
-		"""Queries the cache for an exact match. Returns None if not found."""
+		"""Queries the in-memory tier for an exact match. Returns None if not found."""
 		return self._cache[query][0] if self._cache is not None and query in self._cache else None
 
-	def getSemanticMatch(self, query: str) -> str | None:
-		"""Queries the cache for the highest semantic match at or above the registered threshold. Returns None if none found."""
+	def getSemanticMatch(self, query: str, embedding: NumpyArray | None = None) -> str | None:
+		"""Queries the cache for the highest semantic match at or above the registered threshold. Returns None if none found.
+		If the query's embedding was already computed, it can be provided to avoid recomputing it."""
 		if self._cache is None or self._semanticSimilarityThreshold >= 1.:
 			return None
-		inputEmbedding = self.embed(query)
-		bestMatch = None
-		highestSimilarity = 0.
-		for cachedAnswer, cachedEmbedding in self._cache.values():
-			if (similarity := self.cosineSimilarity(inputEmbedding, cachedEmbedding)) <= highestSimilarity: continue
-			highestSimilarity = similarity
-			bestMatch = cachedAnswer
-		return bestMatch if highestSimilarity >= self._semanticSimilarityThreshold else None
-	
+		inputEmbedding = embedding if embedding is not None else self.embed(query)
+		# Drop expired entries first, so that they cannot be matched
+		self._cache.expire()
+		if (bestMatch := self._index.search(inputEmbedding)) is None: return None
+		bestKey, highestSimilarity = bestMatch
+		return entry[0] if highestSimilarity > 0. and highestSimilarity >= self._semanticSimilarityThreshold and (entry := self._cache.get(bestKey)) is not None else None
+
+	def getDiskExactMatch(self, query: str) -> tuple[str, DiskCacheEntry] | None:
+		"""Queries the disk tier for an exact match, returning its key and entry (to be passed to promote()). Returns None if not found.
+		Blocks on disk I/O, but is thread-safe."""
+		return (query, entry) if self._diskTier is not None and (entry := self._diskTier.getEntry(query)) is not None else None
+
+	def getDiskSemanticMatch(self, embedding: NumpyArray) -> tuple[str, DiskCacheEntry] | None:
+		"""Queries the disk tier for the highest semantic match at or above the registered threshold, returning its key and entry (to be passed to promote()). Returns None if none found.
+		Blocks on disk I/O, but is thread-safe."""
+		if self._diskTier is None or self._semanticSimilarityThreshold >= 1.: return None
+		return (key, entry) if (key := self._diskTier.getSemanticKey(embedding)) is not None and (entry := self._diskTier.getEntry(key)) is not None else None
+
+	def storeOnDisk(self, key: str, value: tuple[str, NumpyArray]) -> None:
+		"""Associates the provided key to the provided value in the disk tier, if any.
+		Blocks on disk I/O, but is thread-safe."""
+		if self._diskTier is not None: self._diskTier[key] = value
+
+	def promote(self, key: str, entry: DiskCacheEntry) -> str:
+		"""Copies the provided disk tier entry into memory under the provided key, without outliving its expiration on disk. Returns its response."""
+		response, embedding, remainingLifetime = entry
+		self._store(key, response, embedding, min(self._expirationTime, remainingLifetime))
+		return response
+
 	def clear(self) -> None:
-		"""Clears the cache."""
+		"""Clears the cache, including its disk tier."""
+		if self._diskTier is not None: self._diskTier.clear()
 		if self._cache is None: return
+		if self._cache: self.markChanged()
 		self._cache.clear()
 
-	def save(self, filepath: str | None = None) -> bool:
-		"""Saves the requests list to the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
-		if (filepath := super().getFilepath(filepath)) is None: return False
-		with open(filepath, "wb") as f: dump(self._cache, f)
-		return True
-	
+	def _store(self, key: str, response: str, embedding: NumpyArray, lifetime: float) -> None:
+		# An entry that has already expired would be dropped as soon as it was stored
+		if self._cache is None or lifetime <= 0.: return
+		# Expire stale entries (possibly including this key's previous entry) and then index, so that evictions caused by storing the response never remove the new embedding
+		self._cache.expire()
+		self._index.add(key, embedding)
+		self._cache[key] = (response, self._cache.timer() + lifetime)
+		self.markChanged()
+
+	def _snapshot(self) -> Callable[[], tuple[bytes, ...]]:
+		if self._cache is not None: self._cache.expire()
+		# Soonest-expiring (i.e. oldest) entries first, so that loading them in order approximately restores which entries are least recently used
+		entries = sorted(self._cache.items(), key=lambda entry: entry[1][1]) if self._cache is not None else []
+		# A copy, since the index may change before the snapshot is serialized
+		embeddings = self._index.getEmbeddings([key for key, _ in entries])
+		now = self._cache.timer() if self._cache is not None else 0.
+		def serialize() -> tuple[bytes, ...]:
+			remainingTimes = array([expiration - now for _, (_, expiration) in entries], dtype=float64)
+			stringTable = b"".join(pack("<I", len(encodedString)) + encodedString for key, (response, _) in entries for encodedString in (key.encode(), response.encode()))
+			header = pack(self._FILE_HEADER_FORMAT, self._FILE_SIGNATURE, self._FILE_VERSION, len(entries), embeddings.shape[1], len(stringTable))
+			unpaddedSize = len(header) + remainingTimes.nbytes + len(stringTable)
+			# The previous file may still be memory-mapped, which the atomic replacement leaves untouched
+			return header, remainingTimes.tobytes(), stringTable, bytes(-unpaddedSize % self._FILE_ALIGNMENT), embeddings.astype(float32, copy=False).tobytes()
+		return serialize
+
 	def load(self, filepath: str | None = None) -> bool:
-		"""Loads the requests list from the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
+		"""Loads the cache from the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
 		if (filepath := super().getFilepath(filepath)) is None: return False
-		with open(filepath, "rb") as f: self._cache = load(f)
-		return True
\ No newline at end of file
+		headerSize = calcsize(self._FILE_HEADER_FORMAT)
+		with open(filepath, "rb") as f:
+			# An empty file is an empty cache that has never been saved
+			if not (header := f.read(headerSize)):
+				# Only the in-memory tier, since the disk tier is loaded separately
+				if self._cache is not None: self._cache.clear()
+				self._markLoaded(filepath)
+				return True
+			if len(header) < headerSize: return False
+			signature, version, count, dimension, stringTableSize = unpack(self._FILE_HEADER_FORMAT, header)
+			if signature != self._FILE_SIGNATURE or version != self._FILE_VERSION: return False
+			remainingTimes = fromfile(f, float64, count)
+			stringTable = f.read(stringTableSize)
+		if self._cache is None: return True
+		strings: list[str] = []
+		offset = 0
+		for _ in range(2*count):
+			(length,) = unpack_from("<I", stringTable, offset)
+			strings.append(stringTable[offset + 4:offset + 4 + length].decode())
+			offset += 4 + length
+		unpaddedSize = headerSize + remainingTimes.nbytes + stringTableSize
+		embeddings = memmap(filepath, float32, "c", unpaddedSize + (-unpaddedSize % self._FILE_ALIGNMENT), (count, dimension)) if count else None
+		# Only keep entries that have not yet expired, and (if the maximum size shrank since saving) only the most recent of those
+		liveRows = [row for row in range(count) if remainingTimes[row] > 0.]
+		if len(liveRows) > self._maxSize: liveRows = liveRows[len(liveRows) - int(self._maxSize):]
+
+		self._cache.clear()
+		if embeddings is not None and liveRows:
+			self._index.load([strings[2*row] for row in liveRows], embeddings if len(liveRows) == count else embeddings[liveRows])
+		now = self._cache.timer()
+		for row in liveRows: self._cache[strings[2*row]] = (strings[2*row + 1], now + remainingTimes[row])
+		self._markLoaded(filepath)
+		return True
@@ -0,0 +1,36 @@
+import re
+from typing import Callable, Iterable
+
+from src.components.discord import Discord
+
+_Segment = tuple[str, str | None, float] # (text, source URL, relevance), as returned by Vectorstore.query
+
+# Fits retrieved segments into a prompt's context budget, in order of relevance, rather than sending them all and truncating the question to make room.
+# Segments that (nearly) repeat a more relevant one are dropped, and the last segment that only partly fits is trimmed at a sentence boundary, or dropped if too little of it would remain.
+class ContextPacker:
+	_duplicateSimilarityThreshold: float = 0.8 # The fraction of shared words (Jaccard similarity) at or above which a segment duplicates another
+	_minimumTrimmedLength: int = 200 # Trimming a segment any shorter than this leaves too little of it to be worth its overhead
+	_WORD_PATTERN: re.Pattern[str] = re.compile(r"\w+")
+
+	@staticmethod
+	def pack(segments: Iterable[_Segment], formatSegment: Callable[[str, str | None, float], str], budget: int | None = None, separator: str = "\n\n") -> str:
+		"""Joins the provided formatted segments in order (which should be most relevant first), skipping near-duplicates and stopping at the provided character budget (if any)."""
+		packedSegments: list[str] = []
+		packedWords: list[set[str]] = []
+		remainingBudget = budget
+		for text, sourceURL, score in segments:
+			words = set(ContextPacker._WORD_PATTERN.findall(text.casefold()))
+			if any(len(words & otherWords) >= ContextPacker._duplicateSimilarityThreshold*len(words | otherWords) for otherWords in packedWords if words or otherWords): continue
+			formattedSegment = formatSegment(text, sourceURL, score).strip()
+			if remainingBudget is not None:
+				remainingBudget -= len(separator) if packedSegments else 0
+				if len(formattedSegment) > remainingBudget:
+					# Trim the segment's text (never its formatting) to fit, or try the next, possibly shorter, segment instead
+					if (trimmedLength := remainingBudget - (len(formattedSegment) - len(text))) < ContextPacker._minimumTrimmedLength:
+						remainingBudget += len(separator) if packedSegments else 0
+						continue
+					formattedSegment = formatSegment(Discord.truncate(text, trimmedLength), sourceURL, score).strip()
+				remainingBudget -= len(formattedSegment)
+			packedSegments.append(formattedSegment)
+			packedWords.append(words)
+		return separator.join(packedSegments)
@@ -1,54 +1,46 @@
-from threading import Lock
+from collections import OrderedDict
 from time import monotonic
+from typing import Literal, get_args
 
+CooldownScope = Literal["user", "channel", "guild"]
+
+# Rate-limits queries separately per user, per channel, and per server, so that one noisy user or channel cannot put the whole bot on cooldown.
+# Uses the generic cell rate algorithm (GCRA): each key only stores the time its limit will have fully recovered by, so each check is O(1).
+# Keys whose limits have fully recovered carry no information, so are evicted, and at most a fixed number of keys are tracked per scope, evicting the least recently used first.
+# Only ever used from the event loop, so no locking is needed.
 class Cooldown:
-	# TODO: Split up cooldown per server/per user
-	_duration: float
-	_checkInterval: float
-	_maxMessagesBeforeCheck: int
-	_messageTimes: list[float]
-	_cooldownBeginningTimestamp: float | None
-	_mutex: Lock
+	_limits: dict[CooldownScope, tuple[float, float]] # Scope: (seconds each query takes to recover, seconds a burst of the maximum number of queries takes to recover)
+	_recoveryTimes: dict[CooldownScope, OrderedDict[int, float]] # Scope: ID: timestamp its limit will have fully recovered by, least recently used first
+	_maxKeys: int
 
-	def __init__(self, duration: float, checkInterval: float, maxMessagesBeforeCheck: int) -> None:
+	def __init__(self, limits: dict[CooldownScope, tuple[int, float]] | None = None, maxKeys: int = 10000) -> None:
 		"""Initialization."""
-		if not isinstance(duration, (int, float)) or duration < 0.: raise ValueError(f"Invalid cooldown duration provided: {duration}")
-		self._duration = duration
-		if not isinstance(checkInterval, (int, float)) or checkInterval < 0.: raise ValueError(f"Invalid cooldown check period provided: {checkInterval}")
-		self._checkInterval = checkInterval
-		if not isinstance(maxMessagesBeforeCheck, int) or maxMessagesBeforeCheck < 0: raise ValueError(f"Invalid maximum allowed messages before check provided: {maxMessagesBeforeCheck}")
-		self._maxMessagesBeforeCheck = maxMessagesBeforeCheck
-		self._messageTimes = []
-		self._cooldownBeginningTimestamp = None
-		self._mutex = Lock()
+		self._limits = {}
+		for scope, (maxQueries, interval) in (limits or {}).items():
+			if scope not in get_args(CooldownScope): raise ValueError(f"Invalid cooldown scope provided: {scope}")
+			if not isinstance(maxQueries, int) or maxQueries < 0: raise ValueError(f"Invalid maximum queries provided: {maxQueries}")
+			if not isinstance(interval, (int, float)) or interval < 0.: raise ValueError(f"Invalid cooldown interval provided: {interval}")
+			# Either being 0 disables the scope's limit
+			if maxQueries and interval: self._limits[scope] = (interval/maxQueries, interval)
+		if not isinstance(maxKeys, int) or maxKeys <= 0: raise ValueError(f"Invalid maximum tracked keys provided: {maxKeys}")
+		self._maxKeys = maxKeys
+		self._recoveryTimes = {scope: OrderedDict() for scope in self._limits}
 
-	def getRemainingTime(self) -> float:
-		"""Returns the number of remaining seconds until the user can resume."""
-		if not self._duration or not self._checkInterval or not self._maxMessagesBeforeCheck: return 0.
-		# Mutex to prevent race conditions
-		self._mutex.acquire_lock()
-		currentTimestamp = monotonic()
-		# If a cooldown exists:
-		if self._cooldownBeginningTimestamp is not None:
-			# And the duration has already elapsed, no problem exists
-			if currentTimestamp - self._cooldownBeginningTimestamp >= self._duration:
-				self._cooldownBeginningTimestamp = None
-				self._mutex.release_lock()
-				return 0.
-			# Case of duration not having elapsed falls through
-		else:
-			# Track last N message times. If < N messages have been sent or time between current and Nth message is above cooldown, no problem exists
-			self._messageTimes = self._messageTimes[-self._maxMessagesBeforeCheck:] + [currentTimestamp]
-			if (len(self._messageTimes) <= self._maxMessagesBeforeCheck or self._messageTimes[-1] - self._messageTimes[-self._maxMessagesBeforeCheck - 1] >= self._checkInterval):
-				self._mutex.release_lock()
-				return 0.
-			# Set timestamp of cooldown beginning
-			self._cooldownBeginningTimestamp = currentTimestamp
+	def __len__(self) -> int:
+		"""Returns the number of keys currently being tracked, across all scopes."""
+		return sum(len(recoveryTimes) for recoveryTimes in self._recoveryTimes.values())
 
-		# Return remaining time
-		self._mutex.release_lock()
-		return max(self._duration + self._cooldownBeginningTimestamp - currentTimestamp, 0.)
-	
-	def isBlocking(self) -> bool:
-		"""Returns whether a cooldown is currently active."""
-		return not self.getRemainingTime()
\ No newline at end of file
+	def getRemainingTime(self, userID: int, channelID: int | None = None, guildID: int | None = None) -> float:
+		"""Returns the number of remaining seconds until the provided user can query in the provided channel and server, or 0 if they can now, in which case the query is counted against each limit.
+		Refused queries are not counted, so that repeatedly retrying does not extend the cooldown."""
+		currentTimestamp = monotonic()
+		keys: list[tuple[CooldownScope, int]] = [(scope, id) for scope, id in (("user", userID), ("channel", channelID), ("guild", guildID)) if scope in self._limits and id is not None]
+		# The query is allowed if no limit would need longer than its full interval to recover after counting it
+		remainingTime = max((self._recoveryTimes[scope].get(id, currentTimestamp) + self._limits[scope][0] - self._limits[scope][1] - currentTimestamp for scope, id in keys), default=0.)
+		if remainingTime > 0.: return remainingTime
+		for scope, id in keys:
+			recoveryTimes = self._recoveryTimes[scope]
+			recoveryTimes[id] = max(recoveryTimes.pop(id, currentTimestamp), currentTimestamp) + self._limits[scope][0]
+			# Evict keys that have fully recovered, then the least recently used if still too many are tracked
+			while recoveryTimes and (len(recoveryTimes) > self._maxKeys or next(iter(recoveryTimes.values())) <= currentTimestamp): recoveryTimes.popitem(last=False)
+		return 0.
@@ -1,25 +1,102 @@
-from discord import Interaction, InteractionMessage, Message, StageChannel, TextChannel, Thread, VoiceChannel, WebhookMessage
+from asyncio import Task, create_task, current_task, shield
+from cachetools import TTLCache
+from collections.abc import AsyncIterable
+from discord import Forbidden, Interaction, InteractionMessage, Message, NotFound, PartialMessage, WebhookMessage
 from discord.abc import Snowflake
 from discord.ext.commands import Bot # type: ignore
-from typing import overload
+from hashlib import sha256
+import json
+from math import inf
+import os
+import re
+from time import monotonic
+from typing import Iterator, overload
 
 class Discord:
 	MESSAGE_CHARACTER_LIMIT: int = 2000
 	DESCRIPTION_CHARACTER_LIMIT: int = 100
+	_messages: TTLCache[tuple[int, int], Message] | None = None # (channel ID, message ID): recently-fetched message, if configured by configureMessageCache()
+	_messageFetches: dict[tuple[int, int], Task[Message | None]] = {} # (channel ID, message ID): fetch in flight
+	_SENTENCE_ENDING_CHARACTERS: frozenset[str] = frozenset({".", "!", "?", ")", "\n"})
+	# Match up to and including the last character that is, in order of findSentenceEnd's cases: whitespace after terminating punctuation that itself follows a non-whitespace character, whitespace after terminating punctuation, whitespace after an alphanumeric character, and any whitespace
+	# The last pattern instead matches the last alphanumeric character after whitespace, where overlapping segments start. ([^\W_] matches exactly what str.isalnum() does, and \s what str.isspace() does.)
+	_LAST_BOUNDARY_PATTERNS: tuple[re.Pattern[str], ...] = tuple(re.compile(r"(?s:.*)" + pattern) for pattern in (r"(?<=\S[.!?)\n])\s", r"(?<=[.!?)\n])\s", r"(?<=[^\W_])\s", r"\s", r"(?<=\s)[^\W_]"))
 
 	@staticmethod
-	async def getMessage(url: str, *, bot: Bot) -> Message | None:
-		"""Attempts to retrieve a message from a URL, provided the bot is able to see said message.
-		Warning: This consumes an API call."""
+	def parseURL(url: str) -> tuple[int | None, int, int] | None:
+		"""Returns the server ID (None for DMs), channel ID, and message ID of a message's URL, or None if it is not one."""
 		# Adapted from Stack Overflow: https://stackoverflow.com/a/63212069
 		# Standard format is https: / / www.discord.com / channels / [server ID] / [channel ID] / [message ID]
 		splitURL = url.split("/", maxsplit=7)
 		if len(splitURL) < 7: return None
 		try:
-			channelID, messageID = int(splitURL[5]), int(splitURL[6])
+			return None if splitURL[4] == "@me" else int(splitURL[4]), int(splitURL[5]), int(splitURL[6])
 		except ValueError: return None
-		return (await channel.fetch_message(messageID)) if (channel := bot.get_channel(channelID)) is not None and isinstance(channel, (StageChannel, Thread, TextChannel, VoiceChannel)) else None
+
+	@staticmethod
+	def configureMessageCache(size: int, expirationTime: float) -> None:
+		"""Sets how many messages retrieved by getMessage() are remembered (0 to remember none), and for how many seconds each."""
+		if not isinstance(size, int) or size < 0: raise ValueError(f"Invalid message cache size provided: {size}")
+		if not isinstance(expirationTime, (int, float)) or expirationTime <= 0.: raise ValueError(f"Invalid message cache expiration time provided: {expirationTime}")
+		Discord._messages = TTLCache(size, expirationTime) if size else None
+
+	@staticmethod
+	async def getMessage(url: str, *, bot: Bot) -> Message | None:
+		"""Attempts to retrieve a message from a URL, provided the bot is able to see said message.
+		Warning: This consumes an API call, unless the message was retrieved recently (and not since edited or deleted) or is already being retrieved."""
+		if (ids := Discord.parseURL(url)) is None: return None
+		guildID, channelID, messageID = ids
+		if Discord._messages is not None and (message := Discord._messages.get((channelID, messageID))) is not None: return message
+		# Concurrent retrievals of the same message share a single API call
+		if (fetch := Discord._messageFetches.get(key := (channelID, messageID))) is None:
+			fetch = Discord._messageFetches[key] = create_task(Discord._fetchMessage(guildID, channelID, messageID, bot=bot))
+			fetch.add_done_callback(lambda fetch: Discord._messageFetches.pop(key) if Discord._messageFetches.get(key) is fetch else None)
+		# Shielded, so that a cancelled caller does not also cancel the fetch for everyone else
+		return await shield(fetch)
+
+	@staticmethod
+	async def _fetchMessage(guildID: int | None, channelID: int, messageID: int, *, bot: Bot) -> Message | None:
+		try:
+			# A partial channel needs no lookup, so this works for channels that are not cached
+			message = await bot.get_partial_messageable(channelID, guild_id=guildID).fetch_message(messageID)
+		except (Forbidden, NotFound): return None
+		# A message edited or deleted while it was being fetched is not remembered, since what was fetched may predate the change
+		if Discord._messages is not None and Discord._messageFetches.get((channelID, messageID)) is current_task(): Discord._messages[(channelID, messageID)] = message
+		return message
+
+	@staticmethod
+	def forgetMessage(channelID: int, messageID: int) -> None:
+		"""Forgets the message with the provided IDs, if retrieved recently, so that it is fetched again the next time it is retrieved. Should be called whenever a message is edited or deleted."""
+		if Discord._messages is not None: Discord._messages.pop((channelID, messageID), None)
+		Discord._messageFetches.pop((channelID, messageID), None)
+
+	@staticmethod
+	def getPartialMessage(url: str, *, bot: Bot) -> PartialMessage | None:
+		"""Returns a reference to the message at a URL that can be edited, replied to, or deleted without first fetching it, or None if the URL is not a message's."""
+		if (ids := Discord.parseURL(url)) is None: return None
+		guildID, channelID, messageID = ids
+		return bot.get_partial_messageable(channelID, guild_id=guildID).get_partial_message(messageID)
 	
+	@staticmethod
+	async def syncCommands(hashFilepath: str | None = None, *, bot: Bot) -> bool:
+		"""Syncs the bot's slash commands with Discord, unless they are unchanged since the sync whose hash was recorded at the provided filepath. Returns whether they were synced."""
+		commands = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda command: command["name"])
+		commandHash = sha256(json.dumps({"applicationID": bot.application_id, "commands": commands}, sort_keys=True).encode()).hexdigest()
+		if hashFilepath is not None and os.path.isfile(hashFilepath):
+			with open(hashFilepath) as f:
+				if f.read().strip() == commandHash: return False
+		await bot.tree.sync()
+		# Only recorded once synced, so that a failed sync is retried on the next startup
+		if hashFilepath is not None:
+			os.makedirs(os.path.dirname(hashFilepath), exist_ok=True)
+			with open(hashFilepath, "w") as f: f.write(commandHash)
+		return True
+
+	@staticmethod
+	def getJumpURL(guildID: int | None, channelID: int, messageID: int) -> str:
+		"""Returns the URL of the message with the provided IDs, formatted identically to Message.jump_url so the two can be compared."""
+		return f"https://discord.com/channels/{guildID if guildID is not None else '@me'}/{channelID}/{messageID}"
+
 	@staticmethod
 	async def convertToMessage(obj: str | Message, *, bot: Bot) -> Message | None:
 		return await Discord.getMessage(obj, bot=bot) if isinstance(obj, str) else obj
@@ -29,13 +106,12 @@ class Discord:
 		"""Attempts to return the index after the end of the last complete sentence in the text."""
 		if desiredCharacterLimit <= 0: raise ValueError(f"Invalid desired character limit provided: {desiredCharacterLimit}")
 		if len(text) < desiredCharacterLimit: return len(text)
-		SENTENCE_ENDING_CHARACTERS = {".", "!", "?", ")", "\n"}
 		# Best-case scenario: end the segment at a terminating punctuation mark, immediately preceded by a non-whitespace character, and followed by whitespace.
 		for i in range(desiredCharacterLimit, minimumLength + 1, -1):
-			if text[i].isspace() and text[i - 1] in SENTENCE_ENDING_CHARACTERS and not text[i - 2].isspace(): return i
+			if text[i].isspace() and text[i - 1] in Discord._SENTENCE_ENDING_CHARACTERS and not text[i - 2].isspace(): return i
 		# Next-best: end the segment at a terminating punctuation mark, followed by whitespace.
 		for i in range(desiredCharacterLimit, minimumLength + 1, -1):
-			if text[i].isspace() and text[i - 1] in SENTENCE_ENDING_CHARACTERS: return i
+			if text[i].isspace() and text[i - 1] in Discord._SENTENCE_ENDING_CHARACTERS: return i
 		# Third-best: end the segment at an alphanumeric character, followed by whitespace.
 		for i in range(desiredCharacterLimit, minimumLength, -1):
 			if text[i].isspace() and text[i - 1].isalnum(): return i
@@ -45,24 +121,43 @@ class Discord:
 		# Last-ditch: Just use the character limit
 		return desiredCharacterLimit
 
+	@staticmethod
+	def iterateSegments(text: str, desiredCharacterLimit: int = MESSAGE_CHARACTER_LIMIT, *, overlapSentences: bool = False) -> Iterator[tuple[int, int]]:
+		"""Lazily yields the (start, end) offsets of the segments that splitIntoSentences would split the provided text into, without copying any of it."""
+		if len(text) <= desiredCharacterLimit:
+			yield 0, len(text)
+			return
+		if desiredCharacterLimit <= 0: raise ValueError(f"Invalid desired character limit provided: {desiredCharacterLimit}")
+		sentenceEnd, punctuationEnd, wordEnd, space, wordStart = Discord._LAST_BOUNDARY_PATTERNS
+
+		def findLast(pattern: re.Pattern[str], first: int, last: int) -> int:
+			"""Returns the last position in [first, last] where the provided pattern's boundary lies, or -1 if none does."""
+			# Each pattern's leading .* is greedy, so this searches backwards from the last position
+			return match.end() - 1 if first <= last and (match := pattern.match(text, first, last + 1)) is not None else -1
+
+		minimumLength = int(0.2*desiredCharacterLimit)
+		start = 0
+		while len(text) - start > desiredCharacterLimit:
+			limit = start + desiredCharacterLimit
+			# The same cases in the same order as findSentenceEnd, falling back to the character limit
+			if (end := findLast(sentenceEnd, start + minimumLength + 2, limit)) < 0 and (end := findLast(punctuationEnd, start + minimumLength + 2, limit)) < 0 and (end := findLast(wordEnd, start + minimumLength + 1, limit)) < 0 and (end := findLast(space, start + minimumLength + 1, limit)) < 0: end = limit
+			yield start, end
+			if overlapSentences and (overlapLimit := int(0.85*(end - start))) > 1:
+				# Start the next segment at the last word starting within the first 85% of this one, or (as splitIntoSentences always has) at its third character if none does
+				start = overlapStart if (overlapStart := findLast(wordStart, start + 2, start + overlapLimit)) >= 0 else start + 2
+			else: start = end
+		yield start, len(text)
+
 	@staticmethod
 	def splitIntoSentences(text: str, desiredCharacterLimit: int = MESSAGE_CHARACTER_LIMIT, *, overlapSentences: bool = False) -> list[str]:
 		"""Splits the provided text into multiple segments, based on the provided desired character limit per segment."""
-		segments: list[str] = []
-		minimumLength = int(0.2*desiredCharacterLimit)
-		while len(text) > desiredCharacterLimit:
-			i = Discord.findSentenceEnd(text, minimumLength, desiredCharacterLimit)
-			segments.append(text[:i])
-			if overlapSentences:
-				for i in range(int(i * 0.85), 1, -1):
-					if text[i].isalnum() and text[i - 1].isspace(): break
-			text = text[i:]
-		return segments + [text]
+		return [text[start:end] for start, end in Discord.iterateSegments(text, desiredCharacterLimit, overlapSentences=overlapSentences)]
 
 	@staticmethod
 	def truncate(text: str, desiredCharacterLimit: int = MESSAGE_CHARACTER_LIMIT) -> str:
-		if not (splitText := Discord.splitIntoSentences(text, desiredCharacterLimit - 1)): return ""
-		return splitText[0] + ("…" if len(splitText) > 1 else "")
+		# Only the first segment is needed, so the rest of the text is never split
+		start, end = next(segments := Discord.iterateSegments(text, desiredCharacterLimit - 1))
+		return text[start:end] + ("…" if next(segments, None) is not None else "")
 
 	@staticmethod
 	async def tryAddReaction(source: Message, emoji: str) -> bool:
@@ -128,6 +223,31 @@ class Discord:
 				else await lastMessage.reply(segment, mention_author=False))
 		return sentMessages
 	
+	@staticmethod
+	async def streamWithinCharacterLimit(message: Interaction | Message, texts: AsyncIterable[str], placeholder: str, limit: int = MESSAGE_CHARACTER_LIMIT, *, editInterval: float = 1.) -> str:
+		"""Replies with the placeholder, then edits the reply to show each provided text as it arrives, rolling over into follow-up messages past the character limit. Returns the final text.
+		Each text must extend the previous one, since text rolled over into earlier messages is never edited again. Edits are made at most once per edit interval (in seconds), except that the final text is always shown."""
+		currentMessage = (await Discord.replyWithinCharacterLimit(message, placeholder, limit))[-1]
+		rolledOverLength = 0 # The length of the text shown in earlier messages
+		shownText = placeholder
+		text = ""
+		lastEditTime = -inf
+
+		async def show() -> None:
+			nonlocal currentMessage, rolledOverLength, shownText, lastEditTime
+			# Trailing whitespace is held back, so that text rolled over never leaves a blank message
+			if not (remainingText := text[rolledOverLength:].rstrip()) or remainingText == shownText: return
+			*_, (lastSegmentStart, _) = Discord.iterateSegments(remainingText, limit)
+			currentMessage = (await Discord.editWithinCharacterLimit(currentMessage, remainingText, limit))[-1]
+			rolledOverLength += lastSegmentStart
+			shownText = remainingText[lastSegmentStart:]
+			lastEditTime = monotonic()
+
+		async for text in texts:
+			if monotonic() - lastEditTime >= editInterval: await show()
+		await show()
+		return text
+
 	@staticmethod
 	async def indicateSuccess(message: Interaction | Message, text: str | None = None) -> None:
 		if isinstance(message, Message):
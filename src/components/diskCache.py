@@ -0,0 +1,156 @@
+from fastembed.common.types import NumpyArray
+from numpy import empty, float32, frombuffer, ndarray
+import os
+import sqlite3
+from threading import Lock
+from time import time
+from typing import Iterable
+
+from Settings import LANGUAGE
+from src.components.semanticIndex import SemanticIndex
+from Translations import CacheTexts
+
+DiskCacheEntry = tuple[str, ndarray, float] # (response, normalized embedding, remaining lifetime in seconds)
+
+# The cache's second tier: an SQLite database that can hold hundreds of thousands of answers with their embeddings, and that is written to as answers are cached, so that it survives restarts without saving.
+# Entries expire after their own expiration time, and the least recently used are evicted past their own maximum size, independently of the in-memory tier in front of it.
+# Every method blocks on disk I/O, so is meant to be run on the executor; a mutex makes them thread-safe.
+# The embeddings are also kept in a semantic index in memory (about 1.5 KB per entry for 384-dimensional embeddings), so that semantic lookups never scan the database.
+class DiskCache:
+	# Database schema version, stored as SQLite's user_version
+	_FILE_VERSION: int = 1
+
+	_filepath: str
+	_connection: sqlite3.Connection | None # Opened by load()
+	_connectionMutex: Lock # Methods may run on several worker threads at once
+	_index: SemanticIndex # key: normalized key embedding
+	_maxSize: float
+	_expirationTime: float
+	_semanticSimilarityThreshold: float
+	_size: int
+
+	def __init__(self, filepath: str, maxSize: float, expirationTime: float | None = None, semanticSimilarityThreshold: float | None = 0., approximateSearchMinimumSize: int | None = None, deferLoading: bool = False) -> None:
+		"""Initialization."""
+		if not isinstance(filepath, str) or not filepath: raise ValueError(f"Invalid disk cache filepath provided: {filepath}")
+		self._filepath = filepath
+		self._connection = None
+		self._connectionMutex = Lock()
+		self._index = SemanticIndex(approximateSearchMinimumSize)
+		if semanticSimilarityThreshold is not None and (not isinstance(semanticSimilarityThreshold, (int, float)) or semanticSimilarityThreshold < 0. or semanticSimilarityThreshold > 1.): raise ValueError(CacheTexts.INVALID_SIMILARITY_THRESHOLD[LANGUAGE].replace("[threshold]", f"{semanticSimilarityThreshold}"))
+		self._semanticSimilarityThreshold = 0. if semanticSimilarityThreshold is None else semanticSimilarityThreshold
+		if not isinstance(maxSize, (int, float)) or maxSize <= 0.: raise ValueError(CacheTexts.INVALID_MAX_SIZE[LANGUAGE].replace("[size]", f"{maxSize}"))
+		self._maxSize = maxSize
+		if expirationTime is not None and (not isinstance(expirationTime, (int, float)) or expirationTime <= 0.): raise ValueError(CacheTexts.INVALID_EXPIRATION_TIME[LANGUAGE].replace("[time]", f"{expirationTime}"))
+		self._expirationTime = float("inf") if expirationTime is None else expirationTime
+		self._size = 0
+
+		# Large databases may instead be loaded by a later call to load(), away from startup
+		if not deferLoading: self.load()
+
+	def __len__(self) -> int:
+		"""Returns the number of entries currently in the cache (possibly including some that have expired but not yet been dropped)."""
+		return self._size
+
+	def __setitem__(self, key: str, value: tuple[str, NumpyArray]) -> None:
+		"""Associates the provided key to the provided value in the cache."""
+		if not isinstance(key, str): raise ValueError(CacheTexts.INVALID_KEY[LANGUAGE].replace("[key]", f"{key}"))
+		if not isinstance(value, tuple) or len(value) != 2 or not isinstance(value[0], str) or not isinstance(value[1], ndarray): raise ValueError(CacheTexts.INVALID_VALUE[LANGUAGE].replace("[value]", f"{value}"))
+		if self._connection is None: return
+		embedding = SemanticIndex.normalize(value[1])
+		now = time()
+		with self._connectionMutex:
+			self._expire(now)
+			isNew = self._connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is None
+			self._connection.execute(
+				"INSERT INTO entries (key, response, embedding, expiration, lastUsed) VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET response = excluded.response, embedding = excluded.embedding, expiration = excluded.expiration, lastUsed = excluded.lastUsed",
+				(key, value[0], embedding.tobytes(), now + self._expirationTime, now)
+			)
+			self._size += isNew
+			if self._isSemantic: self._index.add(key, embedding)
+			# Evict the least recently used entries once over the maximum size
+			if self._size > self._maxSize: self._forget(self._connection.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY lastUsed LIMIT ?) RETURNING key", (self._size - int(self._maxSize),)))
+
+	def getEntry(self, key: str) -> DiskCacheEntry | None:
+		"""Returns the provided key's unexpired entry, marking it as recently used. Returns None if not found."""
+		if self._connection is None: return None
+		now = time()
+		with self._connectionMutex:
+			if (row := self._connection.execute("SELECT response, embedding, expiration FROM entries WHERE key = ? AND expiration > ?", (key, now)).fetchone()) is None: return None
+			self._connection.execute("UPDATE entries SET lastUsed = ? WHERE key = ?", (now, key))
+		response, embedding, expiration = row
+		return response, frombuffer(embedding, float32), expiration - now
+
+	def getSemanticKey(self, embedding: NumpyArray) -> str | None:
+		"""Returns the key of the unexpired entry most semantically similar to the provided embedding, if at or above the registered threshold. Returns None if none found."""
+		if self._connection is None or not self._isSemantic: return None
+		with self._connectionMutex:
+			# Drop expired entries first, so that they cannot be matched
+			self._expire(time())
+			if (bestMatch := self._index.search(embedding)) is None: return None
+		bestKey, highestSimilarity = bestMatch
+		return bestKey if highestSimilarity > 0. and highestSimilarity >= self._semanticSimilarityThreshold else None
+
+	def clear(self) -> None:
+		"""Clears the cache."""
+		if self._connection is None: return
+		with self._connectionMutex:
+			self._connection.execute("DELETE FROM entries")
+			self._index.clear()
+			self._size = 0
+
+	def load(self) -> bool:
+		"""Opens the database, creating it if needed, and indexes its entries' embeddings. Returns whether it succeeded."""
+		os.makedirs(os.path.dirname(self._filepath) or ".", exist_ok=True)
+		# Autocommitted, and write-ahead-logged without syncing on every commit: a crash can lose the last few answers, which is harmless for a cache
+		connection = sqlite3.connect(self._filepath, isolation_level=None, check_same_thread=False)
+		connection.execute("PRAGMA journal_mode = WAL")
+		connection.execute("PRAGMA synchronous = NORMAL")
+		if (version := connection.execute("PRAGMA user_version").fetchone()[0]) not in (0, self._FILE_VERSION):
+			connection.close()
+			return False
+		connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT NOT NULL PRIMARY KEY, response TEXT NOT NULL, embedding BLOB NOT NULL, expiration REAL NOT NULL, lastUsed REAL NOT NULL)")
+		connection.execute("CREATE INDEX IF NOT EXISTS entriesByExpiration ON entries (expiration)")
+		connection.execute("CREATE INDEX IF NOT EXISTS entriesByLastUse ON entries (lastUsed)")
+		if not version: connection.execute(f"PRAGMA user_version = {self._FILE_VERSION}")
+
+		with self._connectionMutex:
+			if self._connection is not None: self._connection.close()
+			self._connection = connection
+			self._index.clear()
+			connection.execute("DELETE FROM entries WHERE expiration <= ?", (time(),))
+			self._size = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+			# If the maximum size shrank since the entries were cached, keep only the most recently used
+			if self._size > self._maxSize:
+				connection.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY lastUsed LIMIT ?)", (self._size - int(self._maxSize),))
+				self._size = int(self._maxSize)
+			if self._isSemantic and self._size:
+				keys: list[str] = []
+				embeddings: ndarray | None = None
+				for key, embedding in connection.execute("SELECT key, embedding FROM entries"):
+					if embeddings is None: embeddings = empty((self._size, len(embedding)//float32().itemsize), dtype=float32)
+					# Embeddings of another size (from a previous embedding model) can only be matched exactly
+					if len(embedding) != embeddings.shape[1]*float32().itemsize: continue
+					embeddings[len(keys)] = frombuffer(embedding, float32)
+					keys.append(key)
+				if embeddings is not None: self._index.load(keys, embeddings[:len(keys)])
+		return True
+
+	def close(self) -> None:
+		"""Closes the database, which is reopened by the next call to load()."""
+		with self._connectionMutex:
+			if self._connection is not None: self._connection.close()
+			self._connection = None
+
+	@property
+	def _isSemantic(self) -> bool:
+		return self._semanticSimilarityThreshold < 1.
+
+	def _expire(self, now: float) -> None:
+		assert self._connection is not None
+		self._forget(self._connection.execute("DELETE FROM entries WHERE expiration <= ? RETURNING key", (now,)))
+
+	def _forget(self, deletedKeys: Iterable[tuple[str]]) -> None:
+		"""Drops the provided deleted rows' keys from the semantic index and the size."""
+		for (key,) in deletedKeys:
+			self._index.remove(key)
+			self._size -= 1
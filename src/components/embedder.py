@@ -0,0 +1,44 @@
+from fastembed import TextEmbedding
+from fastembed.common.types import NumpyArray
+from threading import Lock
+from typing import Iterable
+
+# A single embedding model shared by the cache and the vectorstore, so that it is only loaded once and both always use the same model
+# The model is only loaded (and if need be downloaded) by load() or the first embedding, so that constructing an Embedder is instant
+class Embedder:
+	_model: TextEmbedding | None
+	_modelName: str
+	_threads: int | None
+	_batchSize: int
+	_mutex: Lock # The model may first be needed by several worker threads at once
+
+	def __init__(self, modelName: str = "BAAI/bge-small-en-v1.5", threads: int | None = None, batchSize: int = 256) -> None:
+		"""Initialization."""
+		if not isinstance(modelName, str) or not modelName: raise ValueError(f"Invalid embedding model name provided: {modelName}")
+		self._modelName = modelName
+		if threads is not None and (not isinstance(threads, int) or threads <= 0): raise ValueError(f"Invalid embedding thread count provided: {threads}")
+		self._threads = threads
+		if not isinstance(batchSize, int) or batchSize <= 0: raise ValueError(f"Invalid embedding batch size provided: {batchSize}")
+		self._batchSize = batchSize
+		self._model = None
+		self._mutex = Lock()
+
+	@property
+	def modelName(self) -> str:
+		return self._modelName
+
+	def load(self) -> TextEmbedding:
+		"""Loads the model, if not already loaded, and returns it."""
+		with self._mutex:
+			if self._model is None: self._model = TextEmbedding(self._modelName, threads=self._threads)
+			return self._model
+
+	def embedMany(self, texts: Iterable[str]) -> list[NumpyArray]:
+		"""Constructs the embeddings for the provided texts, in batches of the originally-specified size."""
+		return list(self.load().embed(list(texts), batch_size=self._batchSize))
+
+	def embedOne(self, text: str) -> NumpyArray:
+		"""Constructs the embedding for the provided text."""
+		# If only one text is embedded, FastEmbed returns a generator producing a single element, so we discard the generator.
+		return next(iter(self.load().embed([text], batch_size=1)))
+
@@ -0,0 +1,37 @@
+from asyncio import Semaphore, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractAsyncContextManager, nullcontext
+from functools import partial
+from typing import Callable, ParamSpec, TypeVar
+
+_Parameters = ParamSpec("_Parameters")
+_Result = TypeVar("_Result")
+
+# Runs blocking work (embedding, vectorstore searches) on a bounded thread pool, so that it never stalls Discord's event loop.
+# FastEmbed's ONNX Runtime and FAISS both release the GIL while they compute, so threads suffice.
+class Executor:
+	_pool: ThreadPoolExecutor
+	_querySlots: Semaphore | None
+
+	def __init__(self, maxWorkers: int | None = None, maxConcurrentQueries: int | None = None) -> None:
+		"""Initialization."""
+		if maxWorkers is not None and (not isinstance(maxWorkers, int) or maxWorkers <= 0): raise ValueError(f"Invalid maximum worker count provided: {maxWorkers}")
+		self._pool = ThreadPoolExecutor(maxWorkers, thread_name_prefix="Executor")
+		if maxConcurrentQueries is not None and (not isinstance(maxConcurrentQueries, int) or maxConcurrentQueries <= 0): raise ValueError(f"Invalid maximum concurrent query count provided: {maxConcurrentQueries}")
+		self._querySlots = Semaphore(maxConcurrentQueries) if maxConcurrentQueries is not None else None
+
+	async def run(self, function: Callable[_Parameters, _Result], *args: _Parameters.args, **kwargs: _Parameters.kwargs) -> _Result:
+		"""Runs the provided blocking function on the worker pool and waits for its result without blocking the event loop."""
+		return await get_running_loop().run_in_executor(self._pool, partial(function, *args, **kwargs))
+
+	def querySlot(self) -> AbstractAsyncContextManager[object]:
+		"""Returns a context manager that waits until fewer than the maximum number of concurrent queries are being answered."""
+		return self._querySlots if self._querySlots is not None else nullcontext()
+
+	def shutdown(self) -> None:
+		"""Stops accepting new work and waits for all pending work to finish."""
+		self._pool.shutdown(wait=True)
+
+async def runBlocking(executor: Executor | None, function: Callable[_Parameters, _Result], *args: _Parameters.args, **kwargs: _Parameters.kwargs) -> _Result:
+	"""Runs the provided blocking function on the executor if one exists, or directly otherwise."""
+	return await executor.run(function, *args, **kwargs) if executor is not None else function(*args, **kwargs)
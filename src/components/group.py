@@ -1,4 +1,4 @@
-from typing import Iterable
+from typing import Callable, Iterable
 
 from src.components.saveableClass import SaveableClass
 
@@ -19,6 +19,7 @@ class Group(SaveableClass):
 		"""Adds texts to the group. Returns the number of users added."""
 		count = 0
 		for mID in ([memberID] if isinstance(memberID, int) else memberID):
+			if mID not in self._members: self.markChanged()
 			self._members.add(mID)
 			count += 1
 		return count
@@ -27,27 +28,27 @@ class Group(SaveableClass):
 		"""Removes users from the group. Returns the number of users removed."""
 		count = 0
 		for mID in ([memberID] if isinstance(memberID, int) else memberID):
-			if mID in self._members: self._members.remove(mID)
+			if mID in self._members:
+				self._members.remove(mID)
+				self.markChanged()
 			count += 1
 		return count
 	
 	def clear(self) -> None:
+		if self._members: self.markChanged()
 		self._members.clear()
 	
 	def __contains__(self, memberID: int) -> bool:
 		return memberID in self._members
 	
-	def save(self, filepath: str | None = None) -> bool:
-		"""Saves the group to the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
-		if (filepath := super().getFilepath(filepath)) is None: return False
-		with open(filepath, mode="w") as f:
-			for entry in self._members:
-				f.write(f"{entry}\n")
-		return True
+	def _snapshot(self) -> Callable[[], tuple[bytes]]:
+		members = list(self._members)
+		return lambda: ("".join(f"{entry}\n" for entry in members).encode(),)
 	
 	def load(self, filepath: str | None = None) -> bool:
 		"""Loads the group from the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
 		if (filepath := super().getFilepath(filepath)) is None: return False
 		with open(filepath, mode="r") as f:
 			self._members = {int(entry) for entry in f.readlines()}
+		self._markLoaded(filepath)
 		return True
\ No newline at end of file
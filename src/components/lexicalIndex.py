@@ -0,0 +1,61 @@
+from collections import Counter
+from heapq import nlargest
+from math import log
+import re
+
+# An inverted index that ranks stored texts against a query by Okapi BM25, keyed by the vectorstore's stable segment IDs.
+# Complements embedding similarity, which handles exact identifiers (command names, item IDs, error strings) badly, since those only match as whole words here.
+# Not persisted: it is rebuilt from the stored texts whenever the vectorstore is loaded, which only takes a pass over them.
+class LexicalIndex:
+	_postings: dict[str, dict[int, int]] # Term -> segment ID -> the term's count in that segment
+	_lengths: dict[int, int] # Segment ID -> its number of terms
+	_totalLength: int
+	_termSaturation: float = 1.2 # BM25's k1: how quickly repeating a term stops increasing a text's score
+	_lengthNormalization: float = 0.75 # BM25's b: how much longer texts are penalized for containing more terms
+	_TERM_PATTERN: re.Pattern[str] = re.compile(r"\w+")
+
+	def __init__(self) -> None:
+		"""Initialization."""
+		self.clear()
+
+	def __len__(self) -> int:
+		return len(self._lengths)
+
+	@staticmethod
+	def tokenize(text: str) -> list[str]:
+		"""Returns the provided text's terms: its runs of letters, digits, and underscores, ignoring case."""
+		return LexicalIndex._TERM_PATTERN.findall(text.casefold())
+
+	def add(self, id: int, text: str) -> None:
+		"""Indexes the provided text under the provided ID, which must not already be indexed."""
+		terms = self.tokenize(text)
+		for term, count in Counter(terms).items(): self._postings.setdefault(term, {})[id] = count
+		self._lengths[id] = len(terms)
+		self._totalLength += len(terms)
+
+	def remove(self, id: int, text: str) -> None:
+		"""Removes the provided ID, which must have been indexed with the provided text."""
+		if (length := self._lengths.pop(id, None)) is None: return
+		self._totalLength -= length
+		for term in set(self.tokenize(text)):
+			postings = self._postings[term]
+			del postings[id]
+			if not postings: del self._postings[term]
+
+	def clear(self) -> None:
+		self._postings = {}
+		self._lengths = {}
+		self._totalLength = 0
+
+	def search(self, query: str, maxResults: int) -> list[tuple[int, float]]:
+		"""Returns the IDs and BM25 scores of the highest-scoring texts containing any of the query's terms, highest first."""
+		if not self._lengths: return []
+		averageLength = self._totalLength/len(self._lengths) or 1.
+		scores: dict[int, float] = {}
+		for term in set(self.tokenize(query)):
+			if (postings := self._postings.get(term)) is None: continue
+			# Rarer terms are worth more, so that common words barely influence the ranking
+			inverseFrequency = log(1. + (len(self._lengths) - len(postings) + 0.5)/(len(postings) + 0.5))
+			for id, count in postings.items():
+				scores[id] = scores.get(id, 0.) + inverseFrequency*count*(self._termSaturation + 1.)/(count + self._termSaturation*(1. - self._lengthNormalization + self._lengthNormalization*self._lengths[id]/averageLength))
+		return nlargest(maxResults, scores.items(), key=lambda idAndScore: idAndScore[1])
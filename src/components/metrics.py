@@ -0,0 +1,161 @@
+from aiohttp import web
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from time import perf_counter
+
+_Labels = tuple[tuple[str, str], ...] # Sorted (name, value) pairs
+
+# Records how long each stage of the bot's work takes in fixed-bucket histograms, counts notable events (cache hits, AI errors), and tracks current levels (queued deletions), for /stats and optionally for Prometheus.
+# Fixed buckets keep each observation O(log buckets) and memory constant however long the bot runs, at the cost of percentiles only being estimates.
+# Only ever used from the event loop, so no locking is needed.
+class Metrics:
+	_histograms: dict[tuple[str, _Labels], list[float]] # (name, labels): count per bucket (the last being unbounded), then the sum of observations
+	_counters: dict[tuple[str, _Labels], int]
+	_gauges: dict[tuple[str, _Labels], float]
+	_buckets: tuple[float, ...]
+	_runner: web.AppRunner | None
+	_PREFIX: str = "discord_rag_"
+	_DESCRIPTIONS: dict[str, str] = {
+		"ask": "Time to answer a query, from receiving it to the answer being sent.",
+		"cache_exact": "Time to look up a query in the cache.",
+		"embed": "Time to embed a query.",
+		"cache_semantic": "Time to look up a query's embedding in the cache.",
+		"cache_disk_exact": "Time to look up a query in the cache's disk tier.",
+		"cache_disk_semantic": "Time to look up a query's embedding in the cache's disk tier.",
+		"retrieval": "Time to retrieve a query's context from the vectorstore.",
+		"rerank": "Time to rerank retrieved context.",
+		"generation": "Time to generate and send an answer from a query and its context.",
+		"vectorstore_add": "Time to add texts to the vectorstore.",
+		"vectorstore_update": "Time to re-embed an edited message in the vectorstore.",
+		"requests_resolve": "Time to resolve a request.",
+		"save": "Time to save an object.",
+		"load": "Time to load an object.",
+		"autosave": "Time to serialize and write a changed object in the background.",
+		"warmup": "Time to load a model or file in the background after connecting to Discord.",
+		"queries": "Queries received, excluding those refused by cooldowns.",
+		"cooldowns": "Queries refused by cooldowns.",
+		"cache_exact_hits": "Queries answered by an exact cache match.",
+		"cache_semantic_hits": "Queries answered by a semantic cache match.",
+		"cache_disk_hits": "Queries whose exact or semantic cache match was found in the disk tier.",
+		"coalesced": "Queries answered by sharing the answer of an identical or similar query in flight.",
+		"retrieval_hits": "Queries for which the vectorstore found relevant context.",
+		"retrieval_misses": "Queries for which the vectorstore found no relevant context.",
+		"ai_errors": "AI requests that failed.",
+		"rate_limited": "Discord API requests that were rate limited (responded to with 429), and retried.",
+		"bulk_deletions": "Requests to delete several messages at once.",
+		"queued_deletions": "Messages waiting to be deleted.",
+		"warmup_errors": "Warm-up steps that failed, and were skipped.",
+		"autosave_errors": "Background saves that failed, and will be retried.",
+	}
+
+	def __init__(self, buckets: tuple[float, ...] = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)) -> None:
+		"""Initialization."""
+		if not buckets or any(not isinstance(bucket, (int, float)) or bucket <= 0. for bucket in buckets) or list(buckets) != sorted(set(buckets)): raise ValueError(f"Invalid histogram buckets provided: {buckets}")
+		self._buckets = tuple(float(bucket) for bucket in buckets)
+		self._histograms = {}
+		self._counters = {}
+		self._gauges = {}
+		self._runner = None
+
+	def observe(self, name: str, seconds: float, **labels: str) -> None:
+		"""Records that the provided stage took the provided number of seconds."""
+		if (histogram := self._histograms.get(key := (name, tuple(sorted(labels.items()))))) is None:
+			histogram = self._histograms[key] = [0.]*(len(self._buckets) + 2)
+		histogram[bisect_left(self._buckets, seconds)] += 1
+		histogram[-1] += seconds
+
+	@contextmanager
+	def time(self, name: str, **labels: str) -> Iterator[None]:
+		"""Records how long the context takes as the provided stage, including if it raises."""
+		start = perf_counter()
+		try:
+			yield
+		finally: self.observe(name, perf_counter() - start, **labels)
+
+	def increment(self, name: str, amount: int = 1, **labels: str) -> None:
+		"""Adds the provided amount to the provided counter."""
+		key = (name, tuple(sorted(labels.items())))
+		self._counters[key] = self._counters.get(key, 0) + amount
+
+	def set(self, name: str, value: float, **labels: str) -> None:
+		"""Sets the provided gauge's current value."""
+		self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+	def getCount(self, name: str, **labels: str) -> int:
+		"""Returns the provided counter's value, or how many times the provided stage was observed."""
+		key = (name, tuple(sorted(labels.items())))
+		return int(sum(histogram[:-1])) if (histogram := self._histograms.get(key)) is not None else self._counters.get(key, 0)
+
+	def getTimings(self) -> Iterator[tuple[str, dict[str, str], int, float, float, float]]:
+		"""Yields each observed stage's name, labels, number of observations, and mean, median, and 95th percentile in seconds, in order of first observation.
+		Percentiles are interpolated within their buckets, as Prometheus does, so are only estimates."""
+		for (name, labels), histogram in self._histograms.items():
+			count = sum(histogram[:-1])
+			yield name, dict(labels), int(count), histogram[-1]/count, self._getQuantile(histogram, .5), self._getQuantile(histogram, .95)
+
+	def render(self) -> str:
+		"""Returns every metric in Prometheus' text exposition format."""
+		lines: list[str] = []
+		describedNames: set[str] = set()
+		def describe(name: str, suffix: str, type: str) -> None:
+			if name in describedNames: return
+			describedNames.add(name)
+			if name in self._DESCRIPTIONS: lines.append(f"# HELP {self._PREFIX}{name}{suffix} {self._DESCRIPTIONS[name]}")
+			lines.append(f"# TYPE {self._PREFIX}{name}{suffix} {type}")
+		for (name, labels), histogram in sorted(self._histograms.items()):
+			describe(name, "_seconds", "histogram")
+			cumulativeCount = 0.
+			for bound, count in zip((*(f"{bucket:g}" for bucket in self._buckets), "+Inf"), histogram[:-1]):
+				cumulativeCount += count
+				lines.append(f"{self._PREFIX}{name}_seconds_bucket{self._formatLabels(labels + (('le', bound),))} {cumulativeCount:g}")
+			lines.append(f"{self._PREFIX}{name}_seconds_sum{self._formatLabels(labels)} {histogram[-1]!r}")
+			lines.append(f"{self._PREFIX}{name}_seconds_count{self._formatLabels(labels)} {cumulativeCount:g}")
+		describedNames.clear()
+		for (name, labels), count in sorted(self._counters.items()):
+			describe(name, "_total", "counter")
+			lines.append(f"{self._PREFIX}{name}_total{self._formatLabels(labels)} {count}")
+		describedNames.clear()
+		for (name, labels), value in sorted(self._gauges.items()):
+			describe(name, "", "gauge")
+			lines.append(f"{self._PREFIX}{name}{self._formatLabels(labels)} {value:g}")
+		return "\n".join(lines) + "\n"
+
+	async def serve(self, host: str, port: int) -> None:
+		"""Serves the metrics in Prometheus' text format at http://[host]:[port]/metrics until stopped."""
+		if not isinstance(port, int) or port < 0 or port > 65535: raise ValueError(f"Invalid metrics port provided: {port}")
+		await self.stop()
+		application = web.Application()
+		application.router.add_get("/metrics", lambda _: web.Response(body=self.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}))
+		self._runner = web.AppRunner(application, access_log=None)
+		await self._runner.setup()
+		await web.TCPSite(self._runner, host, port).start()
+
+	async def stop(self) -> None:
+		"""Stops serving the metrics, if they are being served."""
+		if self._runner is None: return
+		await self._runner.cleanup()
+		self._runner = None
+
+	def _getQuantile(self, histogram: list[float], quantile: float) -> float:
+		"""Estimates the provided quantile of the histogram's observations, assuming they are spread evenly within each bucket."""
+		rank = quantile*sum(histogram[:-1])
+		cumulativeCount = 0.
+		for i, count in enumerate(histogram[:-1]):
+			if count and cumulativeCount + count >= rank:
+				# Observations beyond the last bucket cannot be placed, so are reported at its bound
+				if i == len(self._buckets): return self._buckets[-1]
+				lowerBound = self._buckets[i - 1] if i else 0.
+				return lowerBound + (self._buckets[i] - lowerBound)*(rank - cumulativeCount)/count
+			cumulativeCount += count
+		return 0.
+
+	@staticmethod
+	def _formatLabels(labels: _Labels) -> str:
+		if not labels: return ""
+		# Backslashes, quotes, and newlines must be escaped in label values
+		return "{" + ",".join(f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for name, value in labels) + "}"
+
+def timeStage(metrics: Metrics | None, name: str, **labels: str) -> AbstractContextManager[None]:
+	"""Returns a context manager that records how long it takes as the provided stage, if metrics are being recorded."""
+	return metrics.time(name, **labels) if metrics is not None else nullcontext()
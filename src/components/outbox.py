@@ -0,0 +1,104 @@
+from asyncio import Future, Task, create_task, gather, get_running_loop, sleep
+from datetime import timedelta
+from discord import Forbidden, HTTPException, Message, NotFound, PartialMessage, StageChannel, TextChannel, Thread, VoiceChannel
+from discord.ext.commands import Bot # type: ignore
+from discord.utils import utcnow
+import logging
+from typing import Iterable
+
+from src.components.metrics import Metrics
+
+_DeletableMessage = Message | PartialMessage
+
+class _RateLimitCounter(logging.Filter):
+	"""Counts the 429 responses discord.py receives, which it only reports by logging a warning before retrying. Never filters anything out."""
+	_metrics: Metrics
+
+	def __init__(self, metrics: Metrics) -> None:
+		super().__init__()
+		self._metrics = metrics
+
+	def filter(self, record: logging.LogRecord) -> bool:
+		if isinstance(record.msg, str) and record.msg.startswith("We are being rate limited."): self._metrics.increment("rate_limited")
+		return True
+
+# Queues the bot's message deletions per channel, so that deletions requested close together (a request's messages, or several requests resolved at once) cost one bulk deletion rather than an API call per message.
+# Bulk deletion only works in servers, on messages under 14 days old, and with the Manage Messages permission; other queued messages are deleted individually, all at once, with discord.py pacing them within Discord's rate limits.
+# Also reports how many deletions are queued, and counts the rate-limited (429) responses of all of the bot's API requests, as metrics.
+class Outbox:
+	_bot: Bot
+	_batchingDelay: float
+	_metrics: Metrics | None
+	_queues: dict[int, list[tuple[_DeletableMessage, Future[None]]]] # Channel ID: messages awaiting deletion, with the futures their deleters wait on
+	_flushes: set[Task[None]] # Held so that pending flushes are not garbage-collected
+	_BULK_DELETION_MAXIMUM_AGE: timedelta = timedelta(days=14) # Discord refuses to bulk delete older messages
+	_BULK_DELETION_MAXIMUM_SIZE: int = 100
+
+	def __init__(self, bot: Bot, batchingDelay: float = .1, metrics: Metrics | None = None) -> None:
+		"""Initialization."""
+		self._bot = bot
+		if not isinstance(batchingDelay, (int, float)) or batchingDelay < 0.: raise ValueError(f"Invalid batching delay provided: {batchingDelay}")
+		self._batchingDelay = batchingDelay
+		self._metrics = metrics
+		self._queues = {}
+		self._flushes = set()
+		if metrics is not None: logging.getLogger("discord.http").addFilter(_RateLimitCounter(metrics))
+
+	def __len__(self) -> int:
+		"""Returns the number of messages queued for deletion."""
+		return sum(len(queue) for queue in self._queues.values())
+
+	async def delete(self, messages: Iterable[_DeletableMessage], delay: float = 0.) -> None:
+		"""Deletes the provided messages after the provided number of seconds, together with any others queued for deletion in their channels by then. Messages that no longer exist are ignored."""
+		if delay > 0.: await sleep(delay)
+		deletions: list[Future[None]] = []
+		for message in messages:
+			if (queue := self._queues.get(message.channel.id)) is None:
+				queue = self._queues[message.channel.id] = []
+				self._flushes.add(flush := create_task(self._flush(message.channel.id)))
+				flush.add_done_callback(self._flushes.discard)
+			queue.append((message, deletion := get_running_loop().create_future()))
+			deletions.append(deletion)
+		self._reportQueueLength()
+		await gather(*deletions)
+
+	async def _flush(self, channelID: int) -> None:
+		"""Deletes everything queued for deletion in the provided channel, once the batching delay has passed."""
+		await sleep(self._batchingDelay)
+		queue = self._queues.pop(channelID)
+		self._reportQueueLength()
+		try:
+			await self._deleteAll(channelID, list({message.id: message for message, _ in queue}.values()))
+		except Exception as e:
+			for _, deletion in queue:
+				if not deletion.done(): deletion.set_exception(e)
+			return
+		for _, deletion in queue:
+			if not deletion.done(): deletion.set_result(None)
+
+	async def _deleteAll(self, channelID: int, messages: list[_DeletableMessage]) -> None:
+		channel = self._bot.get_channel(channelID)
+		cutoff = utcnow() - self._BULK_DELETION_MAXIMUM_AGE
+		# Channels without servers (DMs) cannot be bulk deleted from
+		bulkDeletable = [message for message in messages if message.created_at > cutoff] if isinstance(channel, (StageChannel, TextChannel, Thread, VoiceChannel)) else []
+		individuallyDeletable = [message for message in messages if message not in bulkDeletable]
+		if len(bulkDeletable) >= 2:
+			try:
+				for start in range(0, len(bulkDeletable), self._BULK_DELETION_MAXIMUM_SIZE):
+					await channel.delete_messages(bulkDeletable[start:start + self._BULK_DELETION_MAXIMUM_SIZE]) # type: ignore
+					if self._metrics is not None: self._metrics.increment("bulk_deletions")
+				bulkDeletable = []
+			# Missing the Manage Messages permission, or a message was already deleted, so fall back to deleting each
+			except (Forbidden, NotFound): pass
+			except HTTPException as e:
+				if e.status != 400: raise
+		await gather(*(self._deleteOne(message) for message in individuallyDeletable + bulkDeletable))
+
+	@staticmethod
+	async def _deleteOne(message: _DeletableMessage) -> None:
+		try:
+			await message.delete()
+		except NotFound: pass
+
+	def _reportQueueLength(self) -> None:
+		if self._metrics is not None: self._metrics.set("queued_deletions", len(self))
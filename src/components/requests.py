@@ -1,111 +1,183 @@
-from discord import Message
-from pickle import dump, load
-from typing import ItemsView, Iterable, TypeAlias, TypedDict
+from asyncio import gather
+from discord import Message, PartialMessage, WebhookMessage
+from discord.abc import Snowflake
+from discord.ext.commands import Bot # type: ignore
+import json
+from typing import Callable, ItemsView, Iterable, TypeAlias, TypedDict
 
 from Settings import LANGUAGE
+from src.components.discord import Discord
+from src.components.executor import Executor, runBlocking
 from src.components.group import Group
 from src.components.saveableClass import SaveableClass
 from src.components.vectorstore import Vectorstore
 from Translations import RequestsTexts
 
 RequestableObjects: TypeAlias = Group | Vectorstore
+_RequestMessage: TypeAlias = Message | PartialMessage | WebhookMessage
 
 # TODO: Have requests expire and auto-delete themselves after a configurable amount of time
-# TODO: Pickle cannot save/load the requests dictionary (possible due to Message?)
+# Messages are only stored as their jump URLs, and fetched (or referenced without fetching) when needed, so that requests hold no live Discord objects and can be saved as JSON
 class RequestData(TypedDict):
+	requestMessageURL: str
 	recipientID: int
 	requesterIDs: list[int]
-	desiredMessages: list[Message]
-	previousRequestMessages: list[Message]
+	desiredMessageURLs: list[str]
+	previousRequestMessageURLs: list[str]
 	
 class Requests(SaveableClass):
-	# Keys are request messages' IDs
-	_requests: dict[Message, RequestData]
+	_requests: dict[int, RequestData] # Request message ID -> request
+	_idsByRecipient: dict[int, set[int]] # Recipient ID -> their requests' message IDs
+	_idsByRequester: dict[int, set[int]] # Requester ID -> their requests' message IDs
+	_maxPendingPerRequester: int | None
 	associatedObject: RequestableObjects
 	message: str
-	def __init__(self, associatedObject: RequestableObjects, message: str, filepath: str | None = None) -> None:
+	_FILE_VERSION: int = 1
+	def __init__(self, associatedObject: RequestableObjects, message: str, filepath: str | None = None, maxPendingPerRequester: int | None = None) -> None:
 		super().__init__(filepath)
 		self.associatedObject = associatedObject
 		if not message: raise ValueError(f"Invalid message provided: {message}")
 		self.message = message
+		if maxPendingPerRequester is not None and (not isinstance(maxPendingPerRequester, int) or maxPendingPerRequester <= 0): raise ValueError(f"Invalid maximum pending requests per requester provided: {maxPendingPerRequester}")
+		self._maxPendingPerRequester = maxPendingPerRequester
 
-		if not self.load(filepath):
-			self._requests = {}
+		self._requests = {}
+		self._idsByRecipient = {}
+		self._idsByRequester = {}
+		self.load(filepath)
 	
-	def __contains__(self, key: Message | int) -> bool:
-		return key in self._requests if isinstance(key, Message) else any(key == entry["recipientID"] for entry in self._requests.values())
+	def __contains__(self, key: Snowflake | int) -> bool:
+		"""Returns whether the provided user ID is the recipient of any request, or the provided message is a request message."""
+		return key in self._idsByRecipient if isinstance(key, int) else key.id in self._requests
 	
 	def __len__(self):
 		return len(self._requests)
 
-	def items(self) -> ItemsView[Message, RequestData]:
+	def items(self) -> ItemsView[int, RequestData]:
 		return self._requests.items()
 
-	def __getitem__(self, requestMessage: Message) -> RequestData | None:
-		return self._requests.get(requestMessage)
+	def __getitem__(self, requestMessage: Snowflake) -> RequestData | None:
+		return self._requests.get(requestMessage.id)
 
-	def add(self, requestMessage: Message, recipientID: int | None = None, requesterIDs: int | Iterable[int] | None = None, desiredMessages: Message | Iterable[Message] | None = None, previousRequestMessages: Iterable[Message] | None = None) -> bool:
-		"""Adds a new request record if one does not already exist with the provided request message ID. Otherwise, appends the provided information to the existing record."""
+	def getByRecipient(self, recipientID: int) -> tuple[int, RequestData] | None:
+		"""Returns the message ID and data of the provided user's oldest pending request, or None if they have none."""
+		if not (requestMessageIDs := self._idsByRecipient.get(recipientID)): return None
+		# Message IDs are snowflakes, which increase over time
+		requestMessageID = min(requestMessageIDs)
+		return requestMessageID, self._requests[requestMessageID]
+
+	def getByRequester(self, requesterID: int) -> list[tuple[int, RequestData]]:
+		"""Returns the message IDs and data of every pending request made by the provided user, oldest first."""
+		return [(requestMessageID, self._requests[requestMessageID]) for requestMessageID in sorted(self._idsByRequester.get(requesterID, ()))]
+
+	def canRequest(self, requesterID: int, recipientID: int) -> bool:
+		"""Returns whether the provided user may request the provided recipient's messages: either by joining the recipient's pending request, or without exceeding the maximum number of pending requests per requester."""
+		if self._maxPendingPerRequester is None or len(self._idsByRequester.get(requesterID, ())) < self._maxPendingPerRequester: return True
+		# Already a requester of the recipient's request, which adding more messages to does not make any more pending
+		return (existingRequest := self.getByRecipient(recipientID)) is not None and requesterID in existingRequest[1]["requesterIDs"]
+
+	def add(self, requestMessage: _RequestMessage, recipientID: int | None = None, requesterIDs: int | Iterable[int] | None = None, desiredMessages: Message | Iterable[Message] | None = None, previousRequestMessages: Iterable[_RequestMessage] | None = None) -> bool:
+		"""Adds a new request record if one does not already exist with the provided request message ID. Otherwise, appends the provided information to the existing record.
+		Returns whether a record was added or changed."""
 		# Standardize requesterIDs and desiredMessageLinks as lists
-		requesterIDsList = [] if requesterIDs is None else [requesterIDs] if isinstance(requesterIDs, int) else list(set(requesterIDs))
-		desiredMessagesList: list[Message] = [] if desiredMessages is None else list(set(desiredMessages)) if isinstance(desiredMessages, Iterable) else [desiredMessages]
-		previousRequestMessagesList = [] if previousRequestMessages is None else list(previousRequestMessages)
+		requesterIDsList = [] if requesterIDs is None else [requesterIDs] if isinstance(requesterIDs, int) else list(dict.fromkeys(requesterIDs))
+		desiredMessageURLs = [] if desiredMessages is None else list(dict.fromkeys(desiredMessage.jump_url for desiredMessage in desiredMessages)) if isinstance(desiredMessages, Iterable) else [desiredMessages.jump_url]
+		previousRequestMessageURLs = [] if previousRequestMessages is None else [previousRequestMessage.jump_url for previousRequestMessage in previousRequestMessages]
 		# If entry already exists, add new elements to existing ones
-		if requestMessage in self._requests:
+		if (record := self._requests.get(requestMessage.id)) is not None:
 			# ...except for recipient ID, which is immutable
-			if recipientID is not None and recipientID != self._requests[requestMessage]["recipientID"]:
+			if recipientID is not None and recipientID != record["recipientID"]:
 				raise ValueError(RequestsTexts.RECIPIENT_ID_UNCHANGEABLE[LANGUAGE])
-			self._requests[requestMessage]["requesterIDs"] += [r for r in requesterIDsList if r not in self._requests[requestMessage]["requesterIDs"]]
-			self._requests[requestMessage]["desiredMessages"] += [l for l in desiredMessagesList if l not in self._requests[requestMessage]["desiredMessages"]]
-			self._requests[requestMessage]["previousRequestMessages"] += [p for p in previousRequestMessagesList if p not in self._requests[requestMessage]["previousRequestMessages"]]
+			changed = False
+			for key, values in (("requesterIDs", requesterIDsList), ("desiredMessageURLs", desiredMessageURLs), ("previousRequestMessageURLs", previousRequestMessageURLs)):
+				if newValues := [value for value in values if value not in record[key]]:
+					# Replaced rather than extended, so that snapshots awaiting saving never see the change
+					record[key] = record[key] + newValues
+					changed = True
+			for requesterID in requesterIDsList: self._idsByRequester.setdefault(requesterID, set()).add(requestMessage.id)
+			if changed: self.markChanged()
+			return changed
 		# Otherwise create a new entry
-		else:
-			# Recipient ID cannot be None
-			if recipientID is None:
-				raise ValueError(RequestsTexts.RECIPIENT_ID_MUST_EXIST[LANGUAGE])
-			self._requests[requestMessage] = {
-				"recipientID": recipientID,
-				"requesterIDs": requesterIDsList,
-				"desiredMessages": desiredMessagesList,
-				"previousRequestMessages": previousRequestMessagesList
-			}
+		# Recipient ID cannot be None
+		if recipientID is None:
+			raise ValueError(RequestsTexts.RECIPIENT_ID_MUST_EXIST[LANGUAGE])
+		self._insert(requestMessage.id, {
+			"requestMessageURL": requestMessage.jump_url,
+			"recipientID": recipientID,
+			"requesterIDs": requesterIDsList,
+			"desiredMessageURLs": desiredMessageURLs,
+			"previousRequestMessageURLs": previousRequestMessageURLs
+		})
+		self.markChanged()
 		return True
 
-	def remove(self, requestMessage: Message) -> bool:
-		if requestMessage not in self._requests: return False
-		del self._requests[requestMessage]
+	def remove(self, requestMessage: Snowflake) -> bool:
+		if (record := self._requests.pop(requestMessage.id, None)) is None: return False
+		for idsByUser, userID in ((self._idsByRecipient, record["recipientID"]), *((self._idsByRequester, requesterID) for requesterID in record["requesterIDs"])):
+			idsByUser[userID].discard(requestMessage.id)
+			if not idsByUser[userID]: del idsByUser[userID]
+		self.markChanged()
 		return True
 	
 	def clear(self) -> None:
-		self._requests.clear()
+		if self._requests: self.markChanged()
+		self._requests = {}
+		self._idsByRecipient = {}
+		self._idsByRequester = {}
 		
 	def populateMessage(self, data: RequestData) -> str:
-		return self.message.replace("[recipientID]", f"<@{data['recipientID']}>").replace("[requesterIDs]", ", ".join(f"<@{requesterID}>" for requesterID in data["requesterIDs"])).replace("[desiredMessageLinks]", "\n".join(f"- {desiredMessage.jump_url}" for desiredMessage in data["desiredMessages"]))
+		return self.message.replace("[recipientID]", f"<@{data['recipientID']}>").replace("[requesterIDs]", ", ".join(f"<@{requesterID}>" for requesterID in data["requesterIDs"])).replace("[desiredMessageLinks]", "\n".join(f"- {desiredMessageURL}" for desiredMessageURL in data["desiredMessageURLs"]))
 	
-	def save(self, filepath: str | None = None) -> bool:
-		"""Saves the requests list to the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
-		if (filepath := super().getFilepath(filepath)) is None: return False
-		with open(filepath, "wb") as f: dump(self._requests, f)
-		return True
+	def _snapshot(self) -> Callable[[], tuple[bytes]]:
+		# Records' lists are only ever replaced, never modified, so copying each record suffices
+		records = [RequestData(**record) for record in self._requests.values()]
+		return lambda: (json.dumps({"version": self._FILE_VERSION, "requests": records}).encode(),)
 	
 	def load(self, filepath: str | None = None) -> bool:
 		"""Loads the requests list from the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
 		if (filepath := super().getFilepath(filepath)) is None: return False
-		with open(filepath, "rb") as f: self._requests = load(f)
+		with open(filepath, encoding="utf-8") as f:
+			# An empty file is an empty requests list that has never been saved
+			if not (contents := f.read().strip()):
+				self.clear()
+				self._markLoaded(filepath)
+				return True
+		try:
+			saved = json.loads(contents)
+			if saved["version"] != self._FILE_VERSION: return False
+			# Each request is keyed by its message's ID, which its URL ends with
+			records = {int(record["requestMessageURL"].rsplit("/", 1)[-1]): record for record in saved["requests"]}
+		except (KeyError, TypeError, ValueError): return False
+		self.clear()
+		for requestMessageID, record in records.items(): self._insert(requestMessageID, record)
+		self._markLoaded(filepath)
 		return True
 	
-	def resolve(self, requestMessage: Message, yes: bool) -> bool:
-		"""Handles a response to a request."""
-		record = self._requests.get(requestMessage)
+	async def resolve(self, requestMessage: Message, yes: bool, *, bot: Bot, executor: Executor | None = None) -> tuple[int, int] | None:
+		"""Handles a response to a request, fetching the requested messages if it was accepted.
+		Returns the number of entries added, and the number of texts skipped for already being in the vectorstore (both 0 if the request was rejected, or its messages were all deleted), or None if the request could not be resolved.
+		Additions to the vectorstore embed and log the texts, so are done on the executor if one is provided."""
+		record = self._requests.get(requestMessage.id)
+		addedCount = skippedCount = 0
 		if yes:
 			# If the request was for a user to join permitting:
 			if isinstance(self.associatedObject, Group):
-				if record is None or self.associatedObject.add(record["recipientID"]) < 1: return False
+				if record is None or (addedCount := self.associatedObject.add(record["recipientID"])) < 1: return None
 				# Request message is deleted, so fall-through
 			else:
 				# If the request was for a user's message to be added to the vectorstore, and no record exists, it must have been self/permitting-added
 				if record is None:
-					if self.associatedObject.add(requestMessage.content, sources=requestMessage.jump_url) < 1: return False
-				# Otherwise it was an individual request that was accepted
-				elif self.associatedObject.add((desiredMessage.content for desiredMessage in record["desiredMessages"]), sources=(desiredMessage.jump_url for desiredMessage in record["desiredMessages"])) < len(record["desiredMessages"]): return False
-		return self.remove(requestMessage)
\ No newline at end of file
+					addedCount, skippedCount = await runBlocking(executor, self.associatedObject.add, requestMessage.content, sources=requestMessage.jump_url, authors=requestMessage.author.id)
+					if addedCount + skippedCount < 1: return None
+				# Otherwise it was an individual request that was accepted, so add the requested messages' current contents, skipping any since deleted
+				else:
+					desiredMessages = [desiredMessage for desiredMessage in await gather(*(Discord.getMessage(desiredMessageURL, bot=bot) for desiredMessageURL in record["desiredMessageURLs"])) if desiredMessage is not None]
+					# If they were all deleted since, there is nothing to add, but the request is still resolved
+					if desiredMessages: addedCount, skippedCount = await runBlocking(executor, self.associatedObject.add, [desiredMessage.content for desiredMessage in desiredMessages], sources=[desiredMessage.jump_url for desiredMessage in desiredMessages], authors=[desiredMessage.author.id for desiredMessage in desiredMessages])
+					if addedCount + skippedCount < len(desiredMessages): return None
+		return (addedCount, skippedCount) if self.remove(requestMessage) else None
+
+	def _insert(self, requestMessageID: int, record: RequestData) -> None:
+		self._requests[requestMessageID] = record
+		self._idsByRecipient.setdefault(record["recipientID"], set()).add(requestMessageID)
+		for requesterID in record["requesterIDs"]: self._idsByRequester.setdefault(requesterID, set()).add(requestMessageID)
@@ -0,0 +1,55 @@
+from cachetools import LRUCache
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+from threading import Lock
+from typing import TypeVar
+
+_Result = TypeVar("_Result", bound=tuple) # Any tuple whose first element is the text, e.g. Vectorstore.query's results
+
+# Rescores retrieved texts against the query with a small cross-encoder, which reads both together and so judges relevance far more precisely than comparing their separate embeddings.
+# Runs on the CPU only, and remembers the scores of recent (query, text) pairs, since the same questions tend to retrieve the same texts.
+# Like the Embedder, the model is only loaded by load() or the first reranking.
+class Reranker:
+	_model: TextCrossEncoder | None
+	_modelName: str
+	_threads: int | None
+	_scores: LRUCache[tuple[str, str], float] # (query, text): score
+	_mutex: Lock # Reranking runs on worker threads
+
+	def __init__(self, modelName: str = "Xenova/ms-marco-MiniLM-L-6-v2", threads: int | None = None, cacheSize: int = 4096) -> None:
+		"""Initialization."""
+		if not isinstance(modelName, str) or not modelName: raise ValueError(f"Invalid reranker model name provided: {modelName}")
+		self._modelName = modelName
+		if threads is not None and (not isinstance(threads, int) or threads <= 0): raise ValueError(f"Invalid reranker thread count provided: {threads}")
+		self._threads = threads
+		if not isinstance(cacheSize, int) or cacheSize <= 0: raise ValueError(f"Invalid reranker cache size provided: {cacheSize}")
+		self._scores = LRUCache(cacheSize)
+		self._mutex = Lock()
+		self._model = None
+
+	@property
+	def modelName(self) -> str:
+		return self._modelName
+
+	def load(self) -> TextCrossEncoder:
+		"""Loads the model, if not already loaded, and returns it."""
+		with self._mutex:
+			if self._model is None: self._model = TextCrossEncoder(self._modelName, threads=self._threads, providers=["CPUExecutionProvider"])
+			return self._model
+
+	def score(self, query: str, texts: list[str]) -> list[float]:
+		"""Returns the relevance of each provided text to the provided query, as unbounded scores where higher is more relevant."""
+		with self._mutex:
+			scores = {text: score for text in texts if (score := self._scores.get((query, text))) is not None}
+		if unscoredTexts := list(dict.fromkeys(text for text in texts if text not in scores)):
+			newScores = dict(zip(unscoredTexts, self.load().rerank(query, unscoredTexts)))
+			with self._mutex:
+				for text, score in newScores.items(): self._scores[(query, text)] = score
+			scores.update(newScores)
+		return [scores[text] for text in texts]
+
+	def rerank(self, query: str, results: list[_Result], maxResults: int) -> list[_Result]:
+		"""Returns the provided results whose texts (their first elements) are most relevant to the provided query, most relevant first."""
+		if not results: return []
+		scores = self.score(query, [result[0] for result in results])
+		# Negative key preserves order of equally-scored results, which reverse=True would invert
+		return [result for _, result in sorted(zip(scores, results), key=lambda scoreAndResult: -scoreAndResult[0])][:maxResults]
@@ -1,20 +1,32 @@
 import os
 from sys import argv
+from threading import Lock
+from typing import Callable, Iterable
 
 class SaveableClass:
 	_filepath: str | None
+	_changeCount: int # Incremented by every change, so that saving can be skipped when nothing has changed
+	_savedChangeCount: int # The change count as of the last save to (or load from) the last-used filepath
+	_saveMutex: Lock # Saves may be written from worker threads
 
 	def __init__(self, filepath: str | None = None) -> None:
 		"""Initialization."""
-		if filepath is not None and (not isinstance(filepath, str) or not os.path.isfile(filepath)): raise RuntimeError(f"Invalid or nonexistent path provided: {filepath}")
+		if filepath is not None and (not isinstance(filepath, str) or os.path.isdir(filepath)): raise RuntimeError(f"Invalid or nonexistent path provided: {filepath}")
+		# A missing file (e.g. on the first run, or after an upgrade changed the default filepath) is created empty, which every subclass loads as empty
+		if filepath is not None and not os.path.exists(filepath):
+			os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+			open(filepath, "xb").close()
 		self._filepath = filepath
-	
+		self._changeCount = 0
+		self._savedChangeCount = 0
+		self._saveMutex = Lock()
+
 	def verify(self, proposedPath: str) -> bool:
 		"""Attempts to ensure the proposed filepath will not cause damage."""
 		currentDirectory = os.path.abspath(os.path.dirname(argv[0]))
 		canonicalPath = os.path.abspath(proposedPath)
 		return os.path.commonpath((canonicalPath, currentDirectory)).startswith(currentDirectory) and (not os.path.exists(canonicalPath) or (self._filepath is not None and os.path.samefile(proposedPath, self._filepath)))
-	
+
 	def getFilepath(self, filepath: str | None = None) -> str | None:
 		"""Internally updates and returns the filepath to use, or None if no feasible filepath exists."""
 		if filepath is not None and not self.verify(filepath): return None
@@ -24,4 +36,53 @@ class SaveableClass:
 		elif not self._filepath:
 			self._filepath = filepath
 		os.makedirs(os.path.dirname(filepath), exist_ok=True)
-		return filepath
\ No newline at end of file
+		return filepath
+
+	@property
+	def hasUnsavedChanges(self) -> bool:
+		"""Whether the object has changed since it was last saved to (or loaded from) its last-used filepath."""
+		return self._changeCount != self._savedChangeCount
+
+	def markChanged(self) -> None:
+		self._changeCount += 1
+
+	def save(self, filepath: str | None = None) -> bool:
+		"""Saves the object to the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
+		return (save := self.snapshot(filepath)) is not None and save()
+
+	def snapshot(self, filepath: str | None = None) -> Callable[[], bool] | None:
+		"""Captures the object's current state, and returns a function that saves it to the provided filepath, or the last-used filepath if none is provided. Returns None if no feasible filepath exists.
+		Capturing only copies what later changes could alter; the returned function does the serializing and writing, and may be called from another thread."""
+		if (filepath := self.getFilepath(filepath)) is None: return None
+		changeCount, serialize = self._changeCount, self._snapshot()
+		def save() -> bool:
+			with self._saveMutex:
+				# A newer snapshot may have been saved while this one waited, and must not be overwritten by it
+				if self._isOwnFilepath(filepath) and changeCount < self._savedChangeCount: return True
+				self._writeAtomically(filepath, *serialize())
+				if self._isOwnFilepath(filepath): self._savedChangeCount = changeCount
+			return True
+		return save
+
+	def _snapshot(self) -> Callable[[], Iterable[bytes]]:
+		"""Captures the object's current state, returning a function that serializes it into the blocks of its file (and which may be called from another thread)."""
+		raise NotImplementedError
+
+	def _markLoaded(self, filepath: str) -> None:
+		"""Records that the object's state now matches the file at the provided filepath."""
+		if self._isOwnFilepath(filepath): self._savedChangeCount = self._changeCount
+		else: self.markChanged()
+
+	def _isOwnFilepath(self, filepath: str) -> bool:
+		# A filepath that does not exist yet (e.g. a new save location) cannot be the object's own
+		return self._filepath is not None and os.path.exists(self._filepath) and os.path.exists(filepath) and os.path.samefile(filepath, self._filepath)
+
+	@staticmethod
+	def _writeAtomically(filepath: str, *blocks: bytes) -> None:
+		"""Writes the provided blocks to a temporary file and then renames it over the provided filepath, so that a crash never leaves a partially-written file."""
+		temporaryFilepath = filepath + ".tmp"
+		with open(temporaryFilepath, "wb") as f:
+			for block in blocks: f.write(block)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(temporaryFilepath, filepath)
@@ -0,0 +1,150 @@
+import faiss
+from fastembed.common.types import NumpyArray
+from math import sqrt
+from numpy import argmax, array, asarray, float32, int64, ndarray, zeros
+from numpy.linalg import norm
+
+# Keeps the cached query embeddings L2-normalized in one contiguous matrix, so that finding the most similar entry is a single matrix-vector product.
+# Above a configurable size, an approximate FAISS IVF inner-product index is also maintained, so lookups stay sub-millisecond for tens of thousands of entries.
+class SemanticIndex:
+	_matrix: ndarray | None # Rows [0, len(self)) are in use; allocated on the first addition, once the embedding dimension is known
+	_keys: list[str] # Row -> key
+	_rows: dict[str, int] # Key -> row
+	_approximateMinimumSize: int | None
+	_approximateQuantizer: faiss.IndexFlatIP | None # Must outlive the approximate index, which does not own it
+	_approximateIndex: faiss.IndexIVFFlat | None
+	_approximateKeys: dict[int, str] # IVF ID -> key
+	_approximateIDs: dict[str, int] # Key -> IVF ID
+	_approximateTrainedSize: int
+	_nextApproximateID: int
+	_approximateProbes: int = 8
+	_trainingPointsPerList: int = 64
+
+	def __init__(self, approximateMinimumSize: int | None = None) -> None:
+		"""Initialization."""
+		if approximateMinimumSize is not None and (not isinstance(approximateMinimumSize, int) or approximateMinimumSize <= 0): raise ValueError(f"Invalid approximate search minimum size provided: {approximateMinimumSize}")
+		self._approximateMinimumSize = approximateMinimumSize
+		self._matrix = None
+		self._keys = []
+		self._rows = {}
+		self._resetApproximate()
+
+	def __len__(self) -> int:
+		return len(self._keys)
+
+	def __contains__(self, key: str) -> bool:
+		return key in self._rows
+
+	@staticmethod
+	def normalize(embedding: NumpyArray) -> ndarray:
+		"""Returns the provided embedding as a unit-length float32 vector (or unchanged if it is all zeroes)."""
+		vector = asarray(embedding, dtype=float32).ravel()
+		return vector / vectorNorm if (vectorNorm := norm(vector)) else vector
+
+	def add(self, key: str, embedding: NumpyArray) -> None:
+		"""Adds the provided key's embedding, replacing its previous embedding if one exists."""
+		vector = self.normalize(embedding)
+		if key in self._rows:
+			self.remove(key)
+		if self._matrix is None:
+			self._matrix = zeros((16, vector.size), dtype=float32)
+		elif len(self._keys) == self._matrix.shape[0]:
+			# Double capacity, so that additions are amortized O(1)
+			grownMatrix = zeros((2*self._matrix.shape[0], self._matrix.shape[1]), dtype=float32)
+			grownMatrix[:len(self._keys)] = self._matrix[:len(self._keys)]
+			self._matrix = grownMatrix
+		self._matrix[len(self._keys)] = vector
+		self._rows[key] = len(self._keys)
+		self._keys.append(key)
+
+		# Once built, the approximate index must hold every key, since searches only consult it
+		if self._approximateIndex is None and (self._approximateMinimumSize is None or len(self._keys) < self._approximateMinimumSize): return
+		# Retrain once the index has quadrupled since it was last trained, so that its lists stay balanced
+		if self._approximateIndex is None or len(self._keys) >= 4*self._approximateTrainedSize: self._rebuildApproximate()
+		else: self._addApproximate(key, vector.reshape(1, -1))
+
+	def remove(self, key: str) -> bool:
+		"""Removes the provided key's embedding. Returns whether it existed."""
+		if (row := self._rows.pop(key, None)) is None: return False
+		assert self._matrix is not None
+		# Move the last row into the vacated one, so that rows in use stay contiguous
+		lastKey = self._keys.pop()
+		if lastKey != key:
+			self._matrix[row] = self._matrix[len(self._keys)]
+			self._keys[row] = lastKey
+			self._rows[lastKey] = row
+
+		if self._approximateIndex is not None and (id := self._approximateIDs.pop(key, None)) is not None:
+			del self._approximateKeys[id]
+			self._approximateIndex.remove_ids(array([id], dtype=int64))
+		# Drop the approximate index once the index has shrunk well below the minimum size, rather than right at it, so that hovering around the minimum does not retrain it over and over
+		if self._approximateIndex is not None and self._approximateMinimumSize is not None and 2*len(self._keys) < self._approximateMinimumSize: self._resetApproximate()
+		return True
+
+	def load(self, keys: list[str], embeddings: ndarray) -> None:
+		"""Replaces the index's contents with the provided keys and their already-normalized embeddings, one per row.
+		The embeddings are used as-is without copying, so they may be memory-mapped."""
+		if len(keys) != embeddings.shape[0]: raise ValueError(f"Mismatched key and embedding counts provided: {len(keys)} vs. {embeddings.shape[0]}")
+		self._matrix = embeddings if keys else None
+		self._keys = list(keys)
+		self._rows = {key: row for row, key in enumerate(self._keys)}
+		self._resetApproximate()
+		if self._approximateMinimumSize is not None and len(self._keys) >= self._approximateMinimumSize: self._rebuildApproximate()
+
+	def getEmbeddings(self, keys: list[str]) -> ndarray:
+		"""Returns the normalized embeddings of the provided keys, one per row."""
+		if self._matrix is None: return zeros((0, 0), dtype=float32)
+		return self._matrix[[self._rows[key] for key in keys]]
+
+	def clear(self) -> None:
+		self._matrix = None
+		self._keys.clear()
+		self._rows.clear()
+		self._resetApproximate()
+
+	def search(self, embedding: NumpyArray) -> tuple[str, float] | None:
+		"""Returns the key whose embedding is most similar to the provided one, alongside their cosine similarity. Returns None if the index is empty."""
+		if not self._keys: return None
+		assert self._matrix is not None
+		vector = self.normalize(embedding)
+		if self._approximateIndex is not None:
+			similarities, ids = self._approximateIndex.search(vector.reshape(1, -1), 1)
+			if ids[0][0] >= 0: return self._approximateKeys[int(ids[0][0])], float(similarities[0][0])
+			# The probed lists were all empty, so fall through to an exact search
+		similarities = self._matrix[:len(self._keys)] @ vector
+		return self._keys[bestRow := int(argmax(similarities))], float(similarities[bestRow])
+
+	def _resetApproximate(self) -> None:
+		self._approximateQuantizer = None
+		self._approximateIndex = None
+		self._approximateKeys = {}
+		self._approximateIDs = {}
+		self._approximateTrainedSize = 0
+		self._nextApproximateID = 0
+
+	def _addApproximate(self, key: str, vectors: ndarray) -> None:
+		assert self._approximateIndex is not None
+		self._approximateIDs[key] = self._nextApproximateID
+		self._approximateKeys[self._nextApproximateID] = key
+		self._approximateIndex.add_with_ids(vectors, array([self._nextApproximateID], dtype=int64))
+		self._nextApproximateID += 1
+
+	def _rebuildApproximate(self) -> None:
+		"""Retrains and repopulates the approximate index from the rows currently in use."""
+		assert self._matrix is not None
+		self._resetApproximate()
+		vectors = self._matrix[:len(self._keys)]
+		listCount = max(1, int(sqrt(len(self._keys))))
+		self._approximateQuantizer = faiss.IndexFlatIP(vectors.shape[1])
+		self._approximateIndex = faiss.IndexIVFFlat(self._approximateQuantizer, vectors.shape[1], listCount, faiss.METRIC_INNER_PRODUCT)
+		# Train on a subsample with few iterations: the lists only need to be roughly balanced, not optimal
+		self._approximateIndex.cp.max_points_per_centroid = self._trainingPointsPerList
+		self._approximateIndex.cp.niter = 10
+		self._approximateIndex.train(vectors)
+		self._approximateIndex.nprobe = min(self._approximateProbes, listCount)
+		# A hashtable direct map lets single entries be removed without scanning every list
+		self._approximateIndex.set_direct_map_type(faiss.DirectMap.Hashtable)
+		self._approximateIndex.add_with_ids(vectors, array(range(len(self._keys)), dtype=int64))
+		self._approximateKeys = dict(enumerate(self._keys))
+		self._approximateIDs = {key: id for id, key in enumerate(self._keys)}
+		self._approximateTrainedSize = self._nextApproximateID = len(self._keys)
@@ -0,0 +1,71 @@
+from asyncio import CancelledError, Future, get_running_loop, shield
+from collections.abc import AsyncIterator, Awaitable
+from contextlib import asynccontextmanager
+from fastembed.common.types import NumpyArray
+from numpy import argmax, ndarray, stack
+from typing import Generic, TypeVar
+
+from src.components.semanticIndex import SemanticIndex
+
+_Result = TypeVar("_Result")
+
+# Coalesces identical work that is in flight at the same time: while a leader computes a query's result, later callers with the same query wait for that result instead of repeating the work.
+# Queries are compared after normalizing their case and whitespace, and optionally also by the cosine similarity of their embeddings, as the cache's semantic matches are.
+class SingleFlight(Generic[_Result]):
+	_flights: dict[str, tuple[Future[_Result], ndarray | None]] # Normalized query: (result, normalized embedding once known)
+	_similarityThreshold: float | None
+
+	def __init__(self, similarityThreshold: float | None = None) -> None:
+		"""Initialization."""
+		if similarityThreshold is not None and (not isinstance(similarityThreshold, (int, float)) or similarityThreshold < 0. or similarityThreshold > 1.): raise ValueError(f"Invalid similarity threshold provided: {similarityThreshold}")
+		# Only exact matches are coalesced at a threshold of 1, as with the cache
+		self._similarityThreshold = similarityThreshold if similarityThreshold is not None and similarityThreshold < 1. else None
+		self._flights = {}
+
+	def __len__(self) -> int:
+		return len(self._flights)
+
+	@staticmethod
+	def normalize(query: str) -> str:
+		"""Returns the provided query with its case and whitespace normalized, so that trivially-different queries are coalesced."""
+		return " ".join(query.casefold().split())
+
+	def follow(self, query: str) -> Awaitable[_Result] | None:
+		"""Returns an awaitable for the result of the same query in flight, which raises if its leader failed. Returns None if no such query is in flight."""
+		# Shielded, so that a follower being cancelled does not cancel the leader's result for everyone else
+		return shield(flight[0]) if (flight := self._flights.get(self.normalize(query))) is not None else None
+
+	def followSimilar(self, query: str, embedding: NumpyArray) -> Awaitable[_Result] | None:
+		"""Records the provided query's embedding if it is in flight, so that later similar queries can follow it, then returns an awaitable for the result of the most similar other query in flight.
+		Returns None if no similarity threshold was set, or no other query in flight is similar enough."""
+		key = self.normalize(query)
+		vector = SemanticIndex.normalize(embedding)
+		if (flight := self._flights.get(key)) is not None: self._flights[key] = (flight[0], vector)
+		if self._similarityThreshold is None: return None
+		# Queries only follow ones whose embeddings were recorded before their own, so that no two queries can ever wait on each other
+		if not (candidates := [candidate for candidateKey, candidate in self._flights.items() if candidateKey != key and candidate[1] is not None]): return None
+		similarities = stack([candidateEmbedding for _, candidateEmbedding in candidates]) @ vector
+		return shield(candidates[bestRow][0]) if similarities[bestRow := int(argmax(similarities))] >= self._similarityThreshold else None
+
+	@asynccontextmanager
+	async def lead(self, query: str) -> AsyncIterator[Future[_Result]]:
+		"""Registers the provided query as in flight until the context exits, yielding the future that its result must be set on for any followers.
+		If the context exits by raising, followers receive the same exception; if it exits without setting a result, followers are cancelled."""
+		key = self.normalize(query)
+		result: Future[_Result] = get_running_loop().create_future()
+		self._flights[key] = (result, None)
+		try:
+			yield result
+		except CancelledError:
+			result.cancel()
+			raise
+		except Exception as e:
+			if not result.done():
+				result.set_exception(e)
+				# Marks the exception as retrieved, so that asyncio does not warn about it when there are no followers
+				result.exception()
+			raise
+		finally:
+			# Another leader may have since registered the same query, if it was led without checking follow() first
+			if self._flights.get(key, (None,))[0] is result: del self._flights[key]
+			if not result.done(): result.cancel()
@@ -0,0 +1,167 @@
+import faiss
+from math import sqrt
+from numpy import argsort, array, float32, frombuffer, full, inf, int64, ndarray, uint8
+from numpy.random import default_rng
+from typing import Callable, Literal, get_args
+
+VectorIndexType = Literal["Flat", "IVF-Flat", "IVF-PQ", "HNSW"]
+
+# The FAISS index that the vectorstore searches by squared Euclidean distance, keyed by stable segment IDs.
+# Below the approximate minimum size (or with the "Flat" type), vectors are searched exactly. Otherwise:
+# - "IVF-Flat" partitions the vectors into lists around trained centroids and only searches the lists nearest to each query.
+# - "IVF-PQ" does the same, but also compresses each vector to a byte per _pqDimensionsPerSubquantizer dimensions, trading some recall for a fraction of the memory.
+# - "HNSW" searches a proximity graph. It is the fastest, but keeps full vectors plus the graph, and cannot remove vectors, so removed IDs are filtered out of searches until the next rebuild.
+# Approximate indexes are rebuilt (and retrained) from the vectorstore's stored embeddings whenever the corpus outgrows what they were built for.
+class VectorIndex:
+	_indexType: VectorIndexType
+	_approximateMinimumSize: int
+	_dimension: int
+	_index: faiss.Index
+	_quantizer: faiss.IndexFlatL2 | None # Must outlive an IVF index, which does not own it
+	_isApproximate: bool
+	_builtSize: int
+	_tombstones: set[int] # HNSW only
+	_tombstoneSelector: faiss.IDSelectorNot | None
+	_tombstoneBatch: faiss.IDSelectorBatch | None # Must outlive the selector that wraps it
+	_probes: int = 16
+	_trainingPointsPerList: int = 64
+	_trainingIterations: int = 10
+	_minimumTrainingSize: int = 1024
+	_pqDimensionsPerSubquantizer: int = 8
+	_pqRefinementFactor: int = 8 # How many times more candidates are reranked than results returned
+	_hnswNeighbors: int = 32
+	_hnswConstructionDepth: int = 80
+	_hnswSearchDepth: int = 64
+	_rebuildChunkSize: int = 65536
+
+	def __init__(self, dimension: int, indexType: VectorIndexType = "Flat", approximateMinimumSize: int | None = None) -> None:
+		"""Initialization."""
+		if not isinstance(dimension, int) or dimension <= 0: raise ValueError(f"Invalid dimension provided: {dimension}")
+		self._dimension = dimension
+		if indexType not in get_args(VectorIndexType): raise ValueError(f"Invalid index type provided: {indexType}")
+		self._indexType = indexType
+		if approximateMinimumSize is not None and (not isinstance(approximateMinimumSize, int) or approximateMinimumSize <= 0): raise ValueError(f"Invalid approximate index minimum size provided: {approximateMinimumSize}")
+		# Training needs enough vectors to place every centroid
+		self._approximateMinimumSize = max(self._minimumTrainingSize, approximateMinimumSize or 0)
+		self._buildExact()
+
+	def __len__(self) -> int:
+		return self._index.ntotal - len(self._tombstones)
+
+	@property
+	def dimension(self) -> int:
+		return self._dimension
+
+	@property
+	def isApproximate(self) -> bool:
+		return self._isApproximate
+
+	@property
+	def memoryUsage(self) -> int:
+		"""Approximately how many bytes the index occupies in memory. Slow for large indexes, since the index is serialized to measure it."""
+		return faiss.serialize_index(self._index).size
+
+	def add(self, ids: list[int], vectors: ndarray) -> None:
+		"""Adds the provided vectors under the provided IDs."""
+		self._index.add_with_ids(vectors, array(ids, dtype=int64))
+
+	def remove(self, ids: list[int]) -> None:
+		"""Removes the vectors with the provided IDs."""
+		if not ids: return
+		if self._isApproximate and self._indexType == "HNSW":
+			self._tombstones.update(ids)
+			self._tombstoneBatch = faiss.IDSelectorBatch(array(sorted(self._tombstones), dtype=int64))
+			self._tombstoneSelector = faiss.IDSelectorNot(self._tombstoneBatch)
+		else: self._index.remove_ids(array(ids, dtype=int64))
+
+	def search(self, vectors: ndarray, maxResults: int, getVectors: Callable[[list[int]], ndarray] | None = None) -> tuple[ndarray, ndarray]:
+		"""Returns the squared distances and IDs of the nearest vectors to each provided vector. Missing results have an ID of -1.
+		For IVF-PQ, providing a function that returns the original vectors of IDs lets more candidates be fetched and reranked by their exact distances."""
+		if self._isApproximate and self._indexType == "HNSW":
+			parameters = faiss.SearchParametersHNSW()
+			parameters.efSearch = max(self._hnswSearchDepth, maxResults)
+			if self._tombstoneSelector is not None: parameters.sel = self._tombstoneSelector
+			return self._index.search(vectors, maxResults, params=parameters)
+		if self._isApproximate and self._indexType == "IVF-PQ" and getVectors is not None:
+			# Compressed distances are only rough, so more candidates are fetched and then reranked by their exact distances
+			_, candidateIDs = self._index.search(vectors, maxResults*self._pqRefinementFactor)
+			return self._refine(vectors, candidateIDs, maxResults, getVectors)
+		return self._index.search(vectors, maxResults)
+
+	def needsRebuild(self) -> bool:
+		"""Returns whether the index should be rebuilt for its current size: to switch to or retrain an approximate index, or to purge HNSW's removed vectors."""
+		if self._indexType == "Flat": return False
+		if not self._isApproximate: return len(self) >= self._approximateMinimumSize
+		if self._indexType == "HNSW": return 4*len(self._tombstones) > self._index.ntotal
+		# Retrain once the corpus has quadrupled since training, so that the lists stay balanced
+		return len(self) >= 4*self._builtSize
+
+	def rebuild(self, ids: list[int], getVectors: Callable[[list[int]], ndarray]) -> None:
+		"""Rebuilds (and if necessary retrains) the index from the provided IDs, whose vectors are fetched in chunks via the provided function, so that they never all need to be in memory at once."""
+		if self._indexType == "Flat" or len(ids) < self._approximateMinimumSize: self._buildExact()
+		elif self._indexType == "HNSW":
+			self._reset(faiss.IndexIDMap2(faiss.IndexHNSWFlat(self._dimension, self._hnswNeighbors)), True)
+			faiss.downcast_index(self._index.index).hnsw.efConstruction = self._hnswConstructionDepth
+		else:
+			listCount = max(1, int(sqrt(len(ids))))
+			quantizer = faiss.IndexFlatL2(self._dimension)
+			index = faiss.IndexIVFFlat(quantizer, self._dimension, listCount) if self._indexType == "IVF-Flat" else faiss.IndexIVFPQ(quantizer, self._dimension, listCount, self._subquantizerCount(), 8)
+			# Train on a subsample with few iterations: the lists only need to be roughly balanced, not optimal
+			index.cp.max_points_per_centroid = self._trainingPointsPerList
+			index.cp.niter = self._trainingIterations
+			if self._indexType == "IVF-PQ": index.pq.cp.niter = self._trainingIterations
+			trainingIDs = sorted(default_rng(0).choice(ids, min(len(ids), listCount*self._trainingPointsPerList), replace=False).tolist())
+			index.train(getVectors(trainingIDs))
+			index.nprobe = min(self._probes, listCount)
+			# A hashtable direct map lets single vectors be removed without scanning every list
+			index.set_direct_map_type(faiss.DirectMap.Hashtable)
+			self._reset(index, True)
+			self._quantizer = quantizer
+		for start in range(0, len(ids), self._rebuildChunkSize):
+			chunk = ids[start:start + self._rebuildChunkSize]
+			self.add(chunk, getVectors(chunk))
+		self._builtSize = len(ids)
+
+	def serialize(self) -> bytes | None:
+		"""Returns the approximate index as bytes, so that it need not be retrained when loaded. Returns None if there is nothing worth saving."""
+		return faiss.serialize_index(self._index).tobytes() if self._isApproximate and not self._tombstones else None
+
+	def deserialize(self, data: bytes) -> bool:
+		"""Replaces the index with one serialized by serialize(). Returns whether it succeeded, which requires the index to be of the currently-selected type."""
+		# Already downcast to its concrete type (and downcasting again would leave the index unowned)
+		index = faiss.deserialize_index(frombuffer(data, uint8))
+		expectedType = {"IVF-Flat": faiss.IndexIVFFlat, "IVF-PQ": faiss.IndexIVFPQ, "HNSW": faiss.IndexIDMap2}.get(self._indexType)
+		if expectedType is None or type(index) is not expectedType or index.d != self._dimension: return False
+		if self._indexType == "HNSW" and not isinstance(faiss.downcast_index(index.index), faiss.IndexHNSWFlat): return False
+		self._reset(index, True)
+		self._builtSize = index.ntotal
+		return True
+
+	@staticmethod
+	def _refine(vectors: ndarray, candidateIDs: ndarray, maxResults: int, getVectors: Callable[[list[int]], ndarray]) -> tuple[ndarray, ndarray]:
+		"""Returns the nearest of the provided candidates to each provided vector by exact squared distance, in the same format as search()."""
+		distances = full((vectors.shape[0], maxResults), inf, dtype=float32)
+		ids = full((vectors.shape[0], maxResults), -1, dtype=int64)
+		for row, (vector, candidates) in enumerate(zip(vectors, candidateIDs)):
+			candidates = candidates[candidates >= 0]
+			exactDistances = ((getVectors(candidates.tolist()) - vector)**2).sum(axis=1)
+			nearest = argsort(exactDistances, kind="stable")[:maxResults]
+			distances[row, :nearest.size] = exactDistances[nearest]
+			ids[row, :nearest.size] = candidates[nearest]
+		return distances, ids
+
+	def _buildExact(self) -> None:
+		self._reset(faiss.IndexIDMap2(faiss.IndexFlatL2(self._dimension)), False)
+
+	def _reset(self, index: faiss.Index, isApproximate: bool) -> None:
+		self._index = index
+		self._quantizer = None
+		self._isApproximate = isApproximate
+		self._builtSize = 0
+		self._tombstones = set()
+		self._tombstoneSelector = None
+		self._tombstoneBatch = None
+
+	def _subquantizerCount(self) -> int:
+		"""Returns the number of bytes each vector is compressed to by IVF-PQ, which must divide the dimension."""
+		return next(count for count in range(max(1, self._dimension//self._pqDimensionsPerSubquantizer), 0, -1) if self._dimension % count == 0)
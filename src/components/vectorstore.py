@@ -1,83 +1,418 @@
-# import faiss
-# from fastembed import TextEmbedding
+from fastembed.common.types import NumpyArray
+from hashlib import blake2b
+from io import BufferedWriter
 from itertools import repeat
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain_community.vectorstores import FAISS
+import json
+from math import sqrt
+from numpy import asarray, empty, float32, frombuffer, memmap, ndarray, stack
 import os
-from typing import Iterable
+from struct import calcsize, pack, unpack, unpack_from
+from threading import Lock
+from typing import Callable, Iterable, TypeVar
+from unicodedata import normalize
+from zlib import crc32
 
+from Settings import LANGUAGE
 from src.components.discord import Discord
+from src.components.embedder import Embedder
+from src.components.lexicalIndex import LexicalIndex
 from src.components.saveableClass import SaveableClass
+from src.components.vectorIndex import VectorIndex, VectorIndexType
+from Translations import VectorstoreTexts
 
-# EMBEDDING_MODEL = TextEmbedding()
-EMBEDDING_MODEL = FastEmbedEmbeddings()
-# embeddingDimension = list(EMBEDDING_MODEL.embed(""))[0].size
+_Segment = tuple[str, str | None, int | None] # (text, source URL, author ID)
+_Key = TypeVar("_Key")
 
+# Every change is appended (and flushed to disk) to a log next to the last-saved or last-loaded snapshot before it is acknowledged, and loading replays that log on top of the snapshot.
+# Saving, either explicitly or once the log grows past the compaction size, rewrites the snapshot and starts a new, empty log.
 class Vectorstore(SaveableClass):
-	# _vectorstore: faiss.IndexFlatL2
-	_vectorstore: FAISS
+	# Snapshot file format (little-endian):
+	# - Header: signature, version, generation, segment count, embedding dimension, docstore size in bytes, serialized search index size in bytes
+	# - Docstore: one JSON object ({"id": ..., "text": ..., "url": ..., "author": ...}) per line per segment, in UTF-8
+	# - Zero padding up to a multiple of _FILE_ALIGNMENT bytes
+	# - Embedding of each segment, as one contiguous float32 matrix (memory-mapped when loaded, and only read when the search index is rebuilt)
+	# - The serialized approximate search index, if any, so that it need not be retrained when loaded
+	# Log file format (little-endian), at the snapshot's filepath + _LOG_EXTENSION:
+	# - Header: signature, version, generation of the snapshot it extends (a log for any other generation is stale, and ignored)
+	# - Records, each a uint32 payload size and the payload's CRC-32, followed by the payload:
+	#   a uint32 JSON size, a JSON operation, then any added embeddings as float32s. Operations are one of
+	#   {"operation": "add", "ids": [...], "texts": [...], "urls": [...], "authors": [...], "removedIDs": [...]}, {"operation": "remove", "ids": [...]}, or {"operation": "clear"}
+	_FILE_SIGNATURE: bytes = b"RAGV"
+	_FILE_VERSION: int = 3
+	_FILE_HEADER_FORMAT: str = "<4sHQIIQQ"
+	_FILE_ALIGNMENT: int = 64
+	_LOG_SIGNATURE: bytes = b"RAGL"
+	_LOG_VERSION: int = 2
+	_LOG_HEADER_FORMAT: str = "<4sHQ"
+	_LOG_RECORD_HEADER_FORMAT: str = "<II"
+	_LOG_EXTENSION: str = ".log"
+	_SNAPSHOT_CHUNK_SIZE: int = 65536
+	_FUSION_CANDIDATE_FACTOR: int = 4 # How many times more candidates each retriever contributes to fusion than results are returned
+	_FUSION_RANK_CONSTANT: int = 60 # Reciprocal rank fusion's k, which keeps either retriever's top few ranks from dominating
+
+	_index: VectorIndex | None # Created on the first addition, once the embedding dimension is known
+	_lexicalIndex: LexicalIndex | None # None if lexical search is disabled
+	_vectors: memmap | None # The snapshot's embeddings, left on disk
+	_vectorRows: dict[int, int] # Segment ID -> row in the snapshot's embeddings
+	_pendingVectors: dict[int, ndarray] # Segment ID -> embedding, for segments added since the snapshot was written
+	_segments: dict[int, _Segment] # Segment ID -> segment
+	_idsByHash: dict[bytes, set[int]] # Normalized text's hash -> segment IDs, to find duplicates without embedding them
+	_idsBySource: dict[str, set[int]]
+	_idsByAuthor: dict[int, set[int]]
+	_nextID: int
+	_embedder: Embedder
 	_minimumRelevance: float
 	_segmentSize: int | None
+	_indexType: VectorIndexType
+	_approximateIndexMinimumSize: int | None
+	_logCompactionSize: int | None
+	_snapshotFilepath: str | None # The snapshot that the open log extends
+	_generation: int
+	_log: BufferedWriter | None
+	_mutex: Lock # Searches and changes may run on several worker threads at once
 
-	def __init__(self, filepath: str | None = None, minimumRelevance: float | None = None, segmentSize: int | None = None) -> None:
+	def __init__(self, embedder: Embedder, filepath: str | None = None, minimumRelevance: float | None = None, segmentSize: int | None = None, logCompactionSize: int | None = None, indexType: VectorIndexType = "Flat", approximateIndexMinimumSize: int | None = None, lexicalSearch: bool = True, deferLoading: bool = False) -> None:
 		"""Initialization."""
 		super().__init__(filepath)
+		self._embedder = embedder
 		if minimumRelevance is not None and (not isinstance(minimumRelevance, (int, float)) or minimumRelevance < 0. or minimumRelevance > 1.): raise ValueError(f"Invalid minimum relevance provided: {minimumRelevance}")
 		self._minimumRelevance = 0. if minimumRelevance is None else minimumRelevance
 		if segmentSize is not None and (not isinstance(segmentSize, int) or segmentSize <= 0): raise ValueError(f"Invalid segment size provided: {segmentSize}")
 		self._segmentSize = segmentSize
+		if logCompactionSize is not None and (not isinstance(logCompactionSize, int) or logCompactionSize <= 0): raise ValueError(f"Invalid log compaction size provided: {logCompactionSize}")
+		self._logCompactionSize = logCompactionSize
+		# Validated by VectorIndex once the embedding dimension is known
+		self._indexType = indexType
+		self._approximateIndexMinimumSize = approximateIndexMinimumSize
+		self._lexicalIndex = LexicalIndex() if lexicalSearch else None
+		self._mutex = Lock()
+		self._reset()
+		self._snapshotFilepath = None
+		self._generation = 0
+		self._log = None
 
-		# self._vectorstore = faiss.read_index(filepath) if path else faiss.IndexFlatL2(embeddingDimension)
-		if not self.load(filepath):
-			self._vectorstore = FAISS.from_texts([""], EMBEDDING_MODEL)
+		# Large vectorstores may instead be loaded by a later call to load(), away from startup; loading discards any changes made before then
+		if not deferLoading: self.load(filepath)
 
 	def __len__(self) -> int:
-		return self._vectorstore.index.ntotal # From Stack Overflow
-
-	def query(self, query: str, maxResults: int = 4) -> list[tuple[str, str | None, float]]:
-		"""Returns the most relevant results (text + score pairs + source URL) for the provided query, at or above the originally-specified relevance threshold."""
-		# embedding = list(EMBEDDING_MODEL.embed(query))[0]
-		# scores, indices = self._vectorstore.search(embedding, maxResults)
-		# ...
-		return sorted(((text.page_content, url if isinstance(url := text.metadata.get("url"), str) else None, score) for text, score in self._vectorstore.similarity_search_with_relevance_scores(query, maxResults, score_threshold=self._minimumRelevance)), key=lambda textAndScore: -textAndScore[2]) # Negative key preserves order of equally-scored texts, which reverse=True would invert
-	
-	def add(self, texts: str | Iterable[str], sources: str | Iterable[str] | None = None) -> int:
-		"""Adds texts to the vectorstore. Returns the number of documents added."""
-		# embedding = list(EMBEDDING_MODEL.embed(text))[0]
-		# self._vectorstore.add(embedding)
-		# ...?
+		return len(self._segments)
+
+	def __contains__(self, source: str) -> bool:
+		"""Returns whether any segments from the provided source URL are stored."""
+		return source in self._idsBySource
+
+	def embed(self, text: str) -> NumpyArray:
+		"""Constructs the embedding for the provided text."""
+		return self._embedder.embedOne(text)
+
+	def split(self, text: str) -> list[str]:
+		"""Splits the provided text into the segments that would be stored for it."""
+		return Discord.splitIntoSentences(text, self._segmentSize, overlapSentences=True) if self._segmentSize is not None else [text]
+
+	def query(self, query: str, maxResults: int = 4, embedding: NumpyArray | None = None) -> list[tuple[str, str | None, float]]:
+		"""Returns the most relevant results (text + score pairs + source URL) for the provided query, at or above the originally-specified relevance threshold.
+		With lexical search enabled, results are ranked by fusing their embedding similarity and keyword (BM25) rankings, though their scores remain their embedding similarity.
+		If the query's embedding was already computed, it can be provided to avoid recomputing it."""
+		queryEmbedding = asarray(embedding if embedding is not None else self.embed(query), dtype=float32).reshape(1, -1)
+		with self._mutex:
+			if self._index is None or not len(self._index): return []
+			if self._lexicalIndex is None:
+				distances, ids = self._index.search(queryEmbedding, maxResults, self._getVectors)
+				# Converts squared Euclidean distances between unit vectors to [0, 1] relevance scores
+				textsWithScores = [(self._segments[int(id)][0], self._segments[int(id)][1], 1. - float(distance)/sqrt(2)) for distance, id in zip(distances[0], ids[0]) if id >= 0]
+				return sorted(((text, url, score) for text, url, score in textsWithScores if score >= self._minimumRelevance), key=lambda textAndScore: -textAndScore[2]) # Negative key preserves order of equally-scored texts, which reverse=True would invert
+			# Fuse the embedding and keyword rankings by reciprocal rank, so that texts ranked highly by either are returned
+			_, denseIDs = self._index.search(queryEmbedding, maxResults*self._FUSION_CANDIDATE_FACTOR, self._getVectors)
+			fusedScores: dict[int, float] = {}
+			for ranking in ([int(id) for id in denseIDs[0] if id >= 0], [id for id, _ in self._lexicalIndex.search(query, maxResults*self._FUSION_CANDIDATE_FACTOR)]):
+				for rank, id in enumerate(ranking): fusedScores[id] = fusedScores.get(id, 0.) + 1./(self._FUSION_RANK_CONSTANT + rank + 1)
+			ids = sorted(fusedScores, key=lambda id: -fusedScores[id])
+			# Relevance is still judged by embedding similarity, so that texts sharing only common words with the query are filtered out, before taking the top results so that they never take the place of relevant ones
+			distances = ((self._getVectors(ids) - queryEmbedding)**2).sum(axis=1) if ids else []
+			return [(text, url, score) for id, distance in zip(ids, distances) for text, url, _ in (self._segments[id],) if (score := 1. - float(distance)/sqrt(2)) >= self._minimumRelevance][:maxResults]
+
+	def add(self, texts: str | Iterable[str], sources: str | Iterable[str] | None = None, authors: int | Iterable[int] | None = None) -> tuple[int, int]:
+		"""Adds texts to the vectorstore, optionally alongside their source URLs and authors' IDs. Returns the number of documents added, and the number skipped for duplicating stored ones."""
 		# if sources is not None and isinstance(texts, str) != isinstance(sources, str): return 0
-		splitTextsWithSources = [
-			(segment, source)
-			for text, source in zip([texts] if isinstance(texts, str) else texts, repeat(None) if sources is None else [sources] if isinstance(sources, str) else sources)
-			for segment in (Discord.splitIntoSentences(text, self._segmentSize, overlapSentences=True) if self._segmentSize is not None else [text])
-		]
-		splitTexts, splitSources = zip(*splitTextsWithSources, strict=True) # From Stack Overflow
-		self._vectorstore.add_texts(splitTexts, metadatas=[{"url": splitSource} for splitSource in splitSources])
-		return len(splitTexts)
-	
+		return self._addSegments([
+			(segment, source, author)
+			for text, source, author in zip(
+				[texts] if isinstance(texts, str) else texts,
+				repeat(None) if sources is None else [sources] if isinstance(sources, str) else sources,
+				repeat(None) if authors is None else [authors] if isinstance(authors, int) else authors
+			)
+			for segment in self.split(text)
+		])
+
+	def update(self, source: str, text: str) -> int:
+		"""Replaces the stored segments from the provided source URL with the provided text's segments, keeping their author. Returns the number of documents added.
+		Nothing is done (and 0 is returned) if no segments from the source are stored, or if their texts are unchanged."""
+		with self._mutex:
+			if (ids := self._idsBySource.get(source)) is None: return 0
+			oldSegments = [self._segments[id] for id in sorted(ids)]
+		newTexts = self.split(text)
+		if [oldText for oldText, _, _ in oldSegments] == newTexts: return 0
+		return self._addSegments([(newText, source, oldSegments[0][2]) for newText in newTexts], replacedSource=source)[0]
+
 	def remove(self, text: str | Iterable[str]) -> int:
-		"""Removes texts from the vectorstore. Returns the number of documents removed.
-		Not yet implemented."""
-		raise NotImplementedError
-		# allTexts = [text] if isinstance(text, str) else list(text)
-		# ...
-		# return len(allTexts)
-	
+		"""Removes texts from the vectorstore, matching either whole stored segments or the segments the texts would be split into. Returns the number of texts removed."""
+		return self._removeMatching(lambda text: set().union(*(self._idsByHash.get(self._hash(segment), ()) for segment in {text, *self.split(text)})), [text] if isinstance(text, str) else text)
+
+	def removeBySource(self, source: str | Iterable[str]) -> int:
+		"""Removes all texts from the provided source URLs from the vectorstore. Returns the number of sources removed."""
+		return self._removeMatching(lambda source: self._idsBySource.get(source, set()), [source] if isinstance(source, str) else source)
+
+	def removeByAuthor(self, authorID: int | Iterable[int]) -> int:
+		"""Removes all texts by the provided authors from the vectorstore. Returns the number of authors removed."""
+		return self._removeMatching(lambda authorID: self._idsByAuthor.get(authorID, set()), [authorID] if isinstance(authorID, int) else authorID)
+
 	def clear(self) -> None:
-		del self._vectorstore
-		self._vectorstore = FAISS.from_texts([""], EMBEDDING_MODEL)
-	
-	def save(self, filepath: str | None = None) -> bool:
-		"""Saves the vectorstore to the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
-		if (filepath := super().getFilepath(filepath)) is None: return False
-		# faiss.write_index(self._vectorstore, filepath)
-		self._vectorstore.save_local(os.path.dirname(filepath), os.path.splitext(os.path.basename(filepath))[0])
-		return True
-	
+		with self._mutex:
+			self._appendToLog({"operation": "clear"})
+			self._reset()
+
+	def snapshot(self, filepath: str | None = None) -> Callable[[], bool] | None:
+		"""Returns a function that saves the vectorstore to the provided filepath, or the last-used filepath if none is provided, or None if no feasible filepath exists.
+		Saving to its own filepath starts a new log there; saving anywhere else only writes a copy, and further changes are still logged alongside its own file. Since every change is logged as it happens, the vectorstore never has unsaved changes to autosave."""
+		if (filepath := super().getFilepath(filepath)) is None: return None
+		def save() -> bool:
+			self._writeSnapshot(filepath)
+			return True
+		return save
+
 	def load(self, filepath: str | None = None) -> bool:
-		"""Loads the vectorstore from the provided filepath, or the last-used filepath if none is provided. Returns whether it succeeded."""
+		"""Loads the vectorstore from the provided filepath, or the last-used filepath if none is provided, then replays any changes logged since it was saved. Returns whether it succeeded.
+		Loading from anywhere but its own filepath then saves what was loaded to its own filepath, so that it and further changes are not lost on restart."""
 		if (filepath := super().getFilepath(filepath)) is None: return False
-		# self._vectorstore = faiss.read_index(filepath)
-		self._vectorstore = FAISS.load_local(os.path.dirname(filepath), EMBEDDING_MODEL, os.path.splitext(os.path.basename(filepath))[0], allow_dangerous_deserialization=True)
-		return True
\ No newline at end of file
+		isOwnFilepath = self._isSnapshotFilepath(filepath)
+		headerSize = calcsize(self._FILE_HEADER_FORMAT)
+		with open(filepath, "rb") as f:
+			header = f.read(headerSize)
+			# An empty file is an empty vectorstore that has never been saved
+			if header:
+				if len(header) < headerSize: return False
+				signature, version, generation, count, dimension, docstoreSize, serializedIndexSize = unpack(self._FILE_HEADER_FORMAT, header)
+				if signature != self._FILE_SIGNATURE or version != self._FILE_VERSION: return False
+				docstore = [json.loads(line) for line in f.read(docstoreSize).splitlines()]
+				unpaddedSize = headerSize + docstoreSize
+				f.seek(unpaddedSize + (-unpaddedSize % self._FILE_ALIGNMENT) + 4*count*dimension)
+				serializedIndex = f.read(serializedIndexSize)
+			else: generation, count, dimension, docstore, unpaddedSize, serializedIndex = 0, 0, 0, [], 0, b""
+
+		with self._mutex:
+			self._reset()
+			if count:
+				ids = [segment["id"] for segment in docstore]
+				for id, segment in zip(ids, docstore): self._register(id, (segment["text"], segment["url"], segment["author"]))
+				self._vectors = memmap(filepath, float32, "r", unpaddedSize + (-unpaddedSize % self._FILE_ALIGNMENT), (count, dimension))
+				self._vectorRows = {id: row for row, id in enumerate(ids)}
+				self._index = VectorIndex(dimension, self._indexType, self._approximateIndexMinimumSize)
+				if not (serializedIndex and self._index.deserialize(serializedIndex) and len(self._index) == count): self._index.rebuild(ids, self._getVectors)
+			self._generation = generation
+			self._replayLog(filepath, generation, isOwnFilepath)
+		if not isOwnFilepath:
+			assert self._filepath is not None
+			self._writeSnapshot(self._filepath)
+		return True
+
+	def _addSegments(self, segments: list[_Segment], replacedSource: str | None = None) -> tuple[int, int]:
+		"""Embeds and adds the provided segments that are not already stored, replacing the provided source's segments if one is provided. Returns the numbers of segments added and skipped."""
+		segmentCount = len(segments)
+		# Skip duplicates before embedding them, so that they cost nothing
+		with self._mutex: segments = [segments[row] for row in self._findNewSegments(segments, replacedSource)]
+		if not segments and replacedSource is None: return 0, segmentCount
+		# Embed outside of the mutex, so that searches are only blocked for the insertion itself
+		embeddings = stack(self._embedder.embedMany(text for text, _, _ in segments)).astype(float32, copy=False) if segments else None
+		with self._mutex:
+			# The same segments may have been added by another thread while these were embedded
+			if len(newRows := self._findNewSegments(segments, replacedSource)) < len(segments):
+				segments = [segments[row] for row in newRows]
+				embeddings = embeddings[newRows] if embeddings is not None else None
+			removedIDs = sorted(self._idsBySource.get(replacedSource, ())) if replacedSource is not None else []
+			# Log before changing anything, so that a change is never visible without also being durable
+			if segments and embeddings is not None:
+				ids = list(range(self._nextID, self._nextID + len(segments)))
+				self._appendToLog({"operation": "add", "ids": ids, "texts": [text for text, _, _ in segments], "urls": [url for _, url, _ in segments], "authors": [author for _, _, author in segments], "removedIDs": removedIDs}, embeddings)
+				self._delete(removedIDs)
+				self._insert(ids, segments, embeddings)
+			elif removedIDs:
+				self._appendToLog({"operation": "remove", "ids": removedIDs})
+				self._delete(removedIDs)
+		self._compactIfNeeded()
+		return len(segments), segmentCount - len(segments)
+
+	def _findNewSegments(self, segments: list[_Segment], replacedSource: str | None = None) -> list[int]:
+		"""Returns the indices of the provided segments whose texts are neither stored (outside of the replaced source's segments) nor repeated earlier in the list."""
+		replacedIDs = self._idsBySource.get(replacedSource, set()) if replacedSource is not None else set()
+		seenHashes: set[bytes] = set()
+		newRows: list[int] = []
+		for row, (text, _, _) in enumerate(segments):
+			if (textHash := self._hash(text)) in seenHashes or not self._idsByHash.get(textHash, set()) <= replacedIDs: continue
+			seenHashes.add(textHash)
+			newRows.append(row)
+		return newRows
+
+	@staticmethod
+	def _hash(text: str) -> bytes:
+		"""Returns a digest of the provided text that ignores differences in case, whitespace, and Unicode representation."""
+		return blake2b(" ".join(normalize("NFKC", text).casefold().split()).encode(), digest_size=16).digest()
+
+	def _removeMatching(self, findIDs: Callable[[_Key], Iterable[int]], keys: Iterable[_Key]) -> int:
+		"""Removes the segments matching each of the provided keys. Returns the number of keys that matched any segments."""
+		with self._mutex:
+			idsPerKey = [set(findIDs(key)) for key in keys]
+			if not (ids := sorted(set().union(*idsPerKey))): return 0
+			self._appendToLog({"operation": "remove", "ids": ids})
+			self._delete(ids)
+		self._compactIfNeeded()
+		return sum(1 for keyIDs in idsPerKey if keyIDs)
+
+	def _writeSnapshot(self, filepath: str) -> None:
+		"""Rewrites the snapshot at the provided filepath, then starts a new, empty log alongside it if it is the vectorstore's own filepath."""
+		isOwnFilepath = self._isSnapshotFilepath(filepath)
+		with self._mutex:
+			ids = list(self._segments)
+			dimension = self._index.dimension if self._index is not None else 0
+			docstore = b"".join(json.dumps({"id": id, "text": text, "url": url, "author": author}, ensure_ascii=False).encode() + b"\n" for id in ids for text, url, author in (self._segments[id],))
+			serializedIndex = (self._index.serialize() if self._index is not None else None) or b""
+			generation = self._generation + 1
+			header = pack(self._FILE_HEADER_FORMAT, self._FILE_SIGNATURE, self._FILE_VERSION, generation, len(ids), dimension, len(docstore), len(serializedIndex))
+			unpaddedSize = len(header) + len(docstore)
+			temporaryFilepath = filepath + ".tmp"
+			with open(temporaryFilepath, "wb") as f:
+				for block in (header, docstore, bytes(-unpaddedSize % self._FILE_ALIGNMENT)): f.write(block)
+				# Copy the embeddings over in chunks, so that they never all need to be in memory at once
+				for start in range(0, len(ids), self._SNAPSHOT_CHUNK_SIZE): f.write(self._getVectors(ids[start:start + self._SNAPSHOT_CHUNK_SIZE]).tobytes())
+				f.write(serializedIndex)
+				f.flush()
+				os.fsync(f.fileno())
+			# A copy saved elsewhere leaves the own snapshot, its log, and the embeddings read from them untouched
+			if not isOwnFilepath: return os.replace(temporaryFilepath, filepath)
+			# The previous snapshot's memory map must be closed before it can be replaced on some platforms
+			self._vectors = None
+			os.replace(temporaryFilepath, filepath)
+			self._vectors = memmap(filepath, float32, "r", unpaddedSize + (-unpaddedSize % self._FILE_ALIGNMENT), (len(ids), dimension)) if ids else None
+			self._vectorRows = {id: row for row, id in enumerate(ids)}
+			self._pendingVectors = {}
+			# Only once the snapshot is in place can the log it supersedes be replaced; a crash in between leaves a stale log, which loading ignores
+			self._openLog(filepath, generation, truncate=True)
+
+	def _compactIfNeeded(self) -> None:
+		if self._log is not None and self._snapshotFilepath is not None and self._logCompactionSize is not None and self._log.tell() >= self._logCompactionSize:
+			self._writeSnapshot(self._snapshotFilepath)
+
+	def _reset(self) -> None:
+		self._index = None
+		if self._lexicalIndex is not None: self._lexicalIndex.clear()
+		self._vectors = None
+		self._vectorRows = {}
+		self._pendingVectors = {}
+		self._segments = {}
+		self._idsByHash = {}
+		self._idsBySource = {}
+		self._idsByAuthor = {}
+		self._nextID = 0
+
+	def _insert(self, ids: list[int], segments: list[_Segment], embeddings: ndarray) -> None:
+		if self._index is None: self._index = VectorIndex(embeddings.shape[1], self._indexType, self._approximateIndexMinimumSize)
+		self._index.add(ids, embeddings)
+		for row, (id, segment) in enumerate(zip(ids, segments)):
+			self._register(id, segment)
+			self._pendingVectors[id] = embeddings[row]
+		self._rebuildIndexIfNeeded()
+
+	def _register(self, id: int, segment: _Segment) -> None:
+		text, url, author = self._segments[id] = segment
+		if self._lexicalIndex is not None: self._lexicalIndex.add(id, text)
+		self._idsByHash.setdefault(self._hash(text), set()).add(id)
+		if url is not None: self._idsBySource.setdefault(url, set()).add(id)
+		if author is not None: self._idsByAuthor.setdefault(author, set()).add(id)
+		self._nextID = max(self._nextID, id + 1)
+
+	def _delete(self, ids: list[int]) -> None:
+		if not ids or self._index is None: return
+		# Segment IDs are stable, so only the removed segments are touched: nothing is re-embedded
+		self._index.remove(ids)
+		for id in ids:
+			self._vectorRows.pop(id, None)
+			self._pendingVectors.pop(id, None)
+			text, url, author = self._segments.pop(id)
+			if self._lexicalIndex is not None: self._lexicalIndex.remove(id, text)
+			for idsByKey, key in ((self._idsByHash, self._hash(text)), (self._idsBySource, url), (self._idsByAuthor, author)):
+				if key is None: continue
+				idsByKey[key].discard(id)
+				if not idsByKey[key]: del idsByKey[key]
+		self._rebuildIndexIfNeeded()
+
+	def _rebuildIndexIfNeeded(self) -> None:
+		if self._index is not None and self._index.needsRebuild(): self._index.rebuild(list(self._segments), self._getVectors)
+
+	def _getVectors(self, ids: list[int]) -> ndarray:
+		"""Returns the stored embeddings of the provided segment IDs, one per row."""
+		assert self._index is not None
+		vectors = empty((len(ids), self._index.dimension), dtype=float32)
+		snapshotPositions: list[int] = []
+		snapshotRows: list[int] = []
+		for position, id in enumerate(ids):
+			if (vector := self._pendingVectors.get(id)) is not None: vectors[position] = vector
+			else:
+				snapshotPositions.append(position)
+				snapshotRows.append(self._vectorRows[id])
+		if snapshotRows:
+			assert self._vectors is not None
+			vectors[snapshotPositions] = self._vectors[snapshotRows]
+		return vectors
+
+	def _appendToLog(self, operation: dict, embeddings: ndarray | None = None) -> None:
+		if self._log is None:
+			# Until its file has loaded, there is nowhere to log changes to, so they are refused rather than lost on restart
+			if self._filepath is not None: raise RuntimeError(VectorstoreTexts.NOT_LOADED[LANGUAGE].replace("[filepath]", self._filepath))
+			return
+		encodedOperation = json.dumps(operation, ensure_ascii=False).encode()
+		payload = pack("<I", len(encodedOperation)) + encodedOperation + (embeddings.tobytes() if embeddings is not None else b"")
+		self._log.write(pack(self._LOG_RECORD_HEADER_FORMAT, len(payload), crc32(payload)) + payload)
+		self._log.flush()
+		os.fsync(self._log.fileno())
+
+	def _replayLog(self, snapshotFilepath: str, generation: int, reopen: bool = True) -> None:
+		"""Applies the operations logged since the provided snapshot was saved, then reopens the log for appending if requested (i.e. if the snapshot is the vectorstore's own)."""
+		logFilepath = snapshotFilepath + self._LOG_EXTENSION
+		logHeaderSize, recordHeaderSize = calcsize(self._LOG_HEADER_FORMAT), calcsize(self._LOG_RECORD_HEADER_FORMAT)
+		try:
+			with open(logFilepath, "rb") as f: log = f.read()
+		except FileNotFoundError: log = b""
+		if len(log) < logHeaderSize or unpack_from(self._LOG_HEADER_FORMAT, log) != (self._LOG_SIGNATURE, self._LOG_VERSION, generation):
+			return self._openLog(snapshotFilepath, generation, truncate=True) if reopen else None
+		offset = logHeaderSize
+		while offset + recordHeaderSize <= len(log):
+			payloadSize, checksum = unpack_from(self._LOG_RECORD_HEADER_FORMAT, log, offset)
+			payload = log[offset + recordHeaderSize:offset + recordHeaderSize + payloadSize]
+			# A torn or corrupted final record was never acknowledged, so it is discarded
+			if len(payload) < payloadSize or crc32(payload) != checksum: break
+			(operationSize,) = unpack_from("<I", payload)
+			operation = json.loads(payload[4:4 + operationSize])
+			if operation["operation"] == "add":
+				self._delete(operation["removedIDs"])
+				self._insert(operation["ids"], list(zip(operation["texts"], operation["urls"], operation["authors"])), frombuffer(payload, float32, offset=4 + operationSize).reshape(len(operation["ids"]), -1))
+			elif operation["operation"] == "remove":
+				self._delete(operation["ids"])
+			elif operation["operation"] == "clear":
+				self._reset()
+			offset += recordHeaderSize + payloadSize
+		if not reopen: return
+		# Drop any discarded tail, so that new records are appended after the last valid one
+		if offset < len(log):
+			with open(logFilepath, "r+b") as f: f.truncate(offset)
+		self._openLog(snapshotFilepath, generation, truncate=False)
+
+	def _isSnapshotFilepath(self, filepath: str) -> bool:
+		"""Returns whether the provided filepath is the vectorstore's own, alongside which its changes are logged."""
+		return self._filepath is not None and (os.path.abspath(filepath) == os.path.abspath(self._filepath) or self._isOwnFilepath(filepath))
+
+	def _openLog(self, snapshotFilepath: str, generation: int, truncate: bool) -> None:
+		if self._log is not None: self._log.close()
+		logFilepath = snapshotFilepath + self._LOG_EXTENSION
+		if truncate: self._writeAtomically(logFilepath, pack(self._LOG_HEADER_FORMAT, self._LOG_SIGNATURE, self._LOG_VERSION, generation))
+		self._log = open(logFilepath, "ab")
+		self._snapshotFilepath = snapshotFilepath
+		self._generation = generation
@@ -0,0 +1,56 @@
+from asyncio import Event, Task, create_task, shield
+import logging
+from typing import Callable, Iterable
+
+from src.components.executor import Executor
+from src.components.metrics import Metrics, timeStage
+
+# Loads the models and large files the bot needs to answer queries in the background once it has connected to Discord, rather than before, so that it comes online within seconds however large they are.
+# Until warm-up finishes, commands that need them are answered with a "warming up" reply, while events that nobody sees a reply to wait for it instead.
+# A step that fails (e.g. a model download, or a corrupt cache file) is logged and skipped rather than keeping the bot warming up forever; models that failed to load are retried when first used, while a vectorstore that failed to load refuses changes until it is loaded.
+class Warmup:
+	_steps: tuple[tuple[str, Callable[[], object]], ...]
+	_executor: Executor
+	_metrics: Metrics | None
+	_ready: Event
+	_task: Task[None] | None
+	_failedSteps: list[str]
+
+	def __init__(self, steps: Iterable[tuple[str, Callable[[], object]]], executor: Executor, metrics: Metrics | None = None) -> None:
+		"""Initialization. Each step is a name (for timing) and a blocking function, and steps run one after another on the executor. A step fails if it raises or returns False (as loading a file that cannot be read does)."""
+		self._steps = tuple(steps)
+		self._executor = executor
+		self._metrics = metrics
+		self._ready = Event()
+		self._task = None
+		self._failedSteps = []
+
+	@property
+	def isReady(self) -> bool:
+		return self._ready.is_set()
+
+	@property
+	def failedSteps(self) -> tuple[str, ...]:
+		"""The names of the steps that failed, if any."""
+		return tuple(self._failedSteps)
+
+	def start(self) -> None:
+		"""Starts warming up in the background, if not already started."""
+		if self._task is None: self._task = create_task(self._run())
+
+	async def wait(self) -> None:
+		"""Waits until warm-up has finished, starting it if needed."""
+		self.start()
+		# Shielded, so that a cancelled waiter does not also cancel warm-up
+		if self._task is not None: await shield(self._task)
+
+	async def _run(self) -> None:
+		for name, step in self._steps:
+			try:
+				with timeStage(self._metrics, "warmup", step=name): succeeded = await self._executor.run(step)
+				if succeeded is False: raise RuntimeError(f"Warm-up step {name} reported failure")
+			except Exception:
+				logging.getLogger(__name__).exception(f"Warm-up step {name} failed, so the bot continues without it")
+				if self._metrics is not None: self._metrics.increment("warmup_errors", step=name)
+				self._failedSteps.append(name)
+		self._ready.set()
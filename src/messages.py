@@ -1,19 +1,34 @@
-from discord import Interaction, Message
+from collections.abc import AsyncIterator
+from contextlib import nullcontext
+from discord import Forbidden, Interaction, Message, Object, StageChannel, TextChannel, Thread, VoiceChannel
 from discord.ext.commands import Bot # type: ignore
+from fastembed.common.types import NumpyArray
 from itertools import repeat
 from typing import Iterable
 
 from Settings import *
 from src.components.ai import AI
 from src.components.cache import Cache
+from src.components.contextPacker import ContextPacker
 from src.components.cooldown import Cooldown
+from src.components.executor import Executor, runBlocking
 from src.components.group import Group
+from src.components.metrics import Metrics, timeStage
 from src.components.discord import Discord
 from src.components.requests import Requests
+from src.components.reranker import Reranker
+from src.components.singleFlight import SingleFlight
 from src.components.vectorstore import Vectorstore
 from Translations import MessagesTexts, getLanguagePlural
 
 
+async def _withAIDisclaimer(responses: AsyncIterator[str]) -> AsyncIterator[str]:
+	"""Yields each of the provided streamed responses, then the last one again with the AI disclaimer appended."""
+	response = ""
+	async for response in responses: yield response
+	yield response + "\n-# " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE]
+
+
 async def message_add(source: Interaction | Message, *entries: str, obj: Group) -> None:
 	"""(Trusted command) Adds the specified entry to the specified object."""
 	# Temporary
@@ -26,6 +41,47 @@ async def message_add(source: Interaction | Message, *entries: str, obj: Group)
 	await Discord.indicateSuccess(source)
 
 
+async def _answer(
+	source: Interaction | Message,
+	query: str,
+	queryEmbedding: NumpyArray | None,
+	*,
+	ai: AI | None = None,
+	executor: Executor | None = None,
+	metrics: Metrics | None = None,
+	reranker: Reranker | None = None,
+	vectorstore: Vectorstore | None = None
+) -> tuple[str | None, str]:
+	"""Retrieves context for and answers the provided query, replying with the answer. Returns the response to cache (or None if it should not be), and the full reply."""
+	# Retrieve context and scores from vectorstore, fitting as much of the most relevant context as possible alongside the whole query (less the newline prepended below)
+	contextBudget = max(budget - 1, 0) if ai is not None and (budget := ai.getContextBudget(query)) is not None else None
+	if vectorstore is not None and reranker is not None:
+		# Retrieve more candidates than needed, and keep only those the reranker judges most relevant, most relevant first
+		with timeStage(metrics, "retrieval"): results = await runBlocking(executor, vectorstore.query, query, RERANKER_CANDIDATES, queryEmbedding)
+		with timeStage(metrics, "rerank"): results = await runBlocking(executor, reranker.rerank, query, results, RERANKER_MAX_RESULTS)
+	elif vectorstore is not None:
+		with timeStage(metrics, "retrieval"): results = await runBlocking(executor, vectorstore.query, query, embedding=queryEmbedding)
+	if vectorstore is not None and metrics is not None: metrics.increment("retrieval_hits" if results else "retrieval_misses")
+	context = ContextPacker.pack(results, lambda text, sourceURL, score: f"{'' if ai is not None else (sourceURL if sourceURL is not None else '[' + MessagesTexts.ASK__DEFAULT_SOURCE[LANGUAGE] + ']') + ' '}_({MessagesTexts.ASK__RELEVANCE_ESTIMATE[LANGUAGE].replace('[relevance]', f'**{score:.2%}**')})_\n{text}", contextBudget) if vectorstore is not None else MessagesTexts.ASK__DEFAULT_CONTEXT[LANGUAGE]
+	if context and context != MessagesTexts.ASK__DEFAULT_CONTEXT[LANGUAGE]:
+		context = "\n" + context
+	# If context is required, and no context is found, return error
+	elif AI_REQUIRE_CONTEXT:
+		await Discord.replyWithinCharacterLimit(source, reply := MessagesTexts.ASK__ERROR_IF_NO_CONTEXT[LANGUAGE])
+		return None, reply
+
+	with timeStage(metrics, "generation"):
+		# Show the AI response while it is generated, since users would otherwise see nothing until it is complete
+		if ai is not None and AI_STREAM_RESPONSES:
+			reply = await Discord.streamWithinCharacterLimit(source, _withAIDisclaimer(ai.queryStream(query, context)), MessagesTexts.ASK__STREAMING_PLACEHOLDER[LANGUAGE], editInterval=DISCORD_STREAM_EDIT_INTERVAL)
+			return reply.removesuffix("\n-# " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE]), reply
+		# Retrieve AI response
+		# TODO: Automatically truncate number of context messages returned if AI is disabled but max AI output characters is specified
+		response = await ai.queryAsync(query, context) if ai is not None else MessagesTexts.ASK__RETURN_VECTORSTORE[LANGUAGE].replace("[messages]", context)
+		await Discord.replyWithinCharacterLimit(source, reply := response + ("\n-# " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE] if ai is not None else ""))
+	return response, reply
+
+
 async def message_ask(
 	source: Interaction | Message,
 	query: str,
@@ -33,42 +89,71 @@ async def message_ask(
 	ai: AI | None = None,
 	cache: Cache | None = None,
 	cooldown: Cooldown | None = None,
+	executor: Executor | None = None,
+	inFlightQueries: SingleFlight[str] | None = None,
+	metrics: Metrics | None = None,
+	reranker: Reranker | None = None,
 	vectorstore: Vectorstore | None = None
 ) -> None:
-	"""Generate an answer to the provided query, subject to a cooldown."""
+	"""Generate an answer to the provided query, subject to per-user, per-channel, and per-server cooldowns."""
 	# Check cooldown
 	if cooldown is not None:
-		if (remainingCooldown := cooldown.getRemainingTime()) > 0.:
+		if (remainingCooldown := cooldown.getRemainingTime(source.user.id if isinstance(source, Interaction) else source.author.id, source.channel_id if isinstance(source, Interaction) else source.channel.id, source.guild_id if isinstance(source, Interaction) else source.guild.id if source.guild is not None else None)) > 0.:
+			if metrics is not None: metrics.increment("cooldowns")
 			return await Discord.indicateFailure(source, MessagesTexts.ASK__COOLDOWN[LANGUAGE].replace("[seconds]", f"{remainingCooldown:.2g}"))
-	# Check cache
-	if cache is not None:
-		if response := cache.getExactMatch(query):
-			await Discord.replyWithinCharacterLimit(source, response + "\n-# " + MessagesTexts.ASK__CACHED_RESPONSE[LANGUAGE] + (" " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE] if ai is not None else ""))
-			return
-		if response := cache.getSemanticMatch(query):
-			await Discord.replyWithinCharacterLimit(source, response + "\n-# " + MessagesTexts.ASK__CACHED_RESPONSE[LANGUAGE] + (" " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE] if ai is not None else ""))
-			return
-	# Retrieve context and scores from vectorstore
-	context = "\n\n".join(f"{'' if ai is not None else (sourceURL if sourceURL is not None else '[' + MessagesTexts.ASK__DEFAULT_SOURCE[LANGUAGE] + ']') + ' '}_({MessagesTexts.ASK__RELEVANCE_ESTIMATE[LANGUAGE].replace('[relevance]', f'**{score:.2%}**')})_\n{text}".strip() for text, sourceURL, score in vectorstore.query(query)) if vectorstore is not None else MessagesTexts.ASK__DEFAULT_CONTEXT[LANGUAGE]
-	if context and context != MessagesTexts.ASK__DEFAULT_CONTEXT[LANGUAGE]:
-		context = "\n" + context
-	# If context is required, and no context is found, return error
-	elif AI_REQUIRE_CONTEXT:
-		await Discord.replyWithinCharacterLimit(source, MessagesTexts.ASK__ERROR_IF_NO_CONTEXT[LANGUAGE])
-		return
-
-	# Retrieve AI response
-	# TODO: Automatically truncate number of context messages returned if AI is disabled but max AI output characters is specified
-	response = ai.query(query, context) if ai is not None else MessagesTexts.ASK__RETURN_VECTORSTORE[LANGUAGE].replace("[messages]", context)
-	# Send message to user, and cache for future
-	await Discord.replyWithinCharacterLimit(source, response + ("\n-# " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE] if ai is not None else ""))
-	if cache is not None:
-		cache[query] = (response, cache.embed(query))
+	if metrics is not None: metrics.increment("queries")
+	with timeStage(metrics, "ask"):
+		# Check cache
+		if cache is not None:
+			with timeStage(metrics, "cache_exact"): response = cache.getExactMatch(query)
+			# Fall through to the disk tier, off the event loop
+			if not response and cache.hasDiskTier:
+				with timeStage(metrics, "cache_disk_exact"): diskMatch = await runBlocking(executor, cache.getDiskExactMatch, query)
+				if diskMatch is not None:
+					if metrics is not None: metrics.increment("cache_disk_hits")
+					response = cache.promote(*diskMatch)
+			if response:
+				if metrics is not None: metrics.increment("cache_exact_hits")
+				await Discord.replyWithinCharacterLimit(source, response + "\n-# " + MessagesTexts.ASK__CACHED_RESPONSE[LANGUAGE] + (" " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE] if ai is not None else ""))
+				return
+		# If the same query is already being answered, reuse its answer rather than answering it again
+		if inFlightQueries is not None and (inFlightReply := inFlightQueries.follow(query)) is not None:
+			if metrics is not None: metrics.increment("coalesced")
+			return await Discord.replyWithinCharacterLimit(source, await inFlightReply)
+		async with (inFlightQueries.lead(query) if inFlightQueries is not None else nullcontext()) as result:
+			response = cachedResponse = similarReply = None
+			# Wait for a free slot if too many queries are already being answered
+			async with (executor.querySlot() if executor is not None else nullcontext()):
+				# Embed the query only once, and reuse that embedding for the semantic cache lookup, the vectorstore search, and the cache insertion
+				with timeStage(metrics, "embed"): queryEmbedding = await runBlocking(executor, cache.embed, query) if cache is not None else await runBlocking(executor, vectorstore.embed, query) if vectorstore is not None else None
+				if cache is not None:
+					with timeStage(metrics, "cache_semantic"): cachedResponse = cache.getSemanticMatch(query, queryEmbedding)
+					if not cachedResponse and cache.hasDiskTier and queryEmbedding is not None:
+						with timeStage(metrics, "cache_disk_semantic"): diskMatch = await runBlocking(executor, cache.getDiskSemanticMatch, queryEmbedding)
+						if diskMatch is not None:
+							if metrics is not None: metrics.increment("cache_disk_hits")
+							cachedResponse = cache.promote(*diskMatch)
+				if cachedResponse:
+					if metrics is not None: metrics.increment("cache_semantic_hits")
+					await Discord.replyWithinCharacterLimit(source, reply := cachedResponse + "\n-# " + MessagesTexts.ASK__CACHED_RESPONSE[LANGUAGE] + (" " + MessagesTexts.ASK__AI_DISCLAIMER[LANGUAGE] if ai is not None else ""))
+				# Likewise reuse the answer of a similar query, now that the query's embedding is known
+				elif inFlightQueries is None or queryEmbedding is None or (similarReply := inFlightQueries.followSimilar(query, queryEmbedding)) is None:
+					response, reply = await _answer(source, query, queryEmbedding, ai=ai, executor=executor, metrics=metrics, reranker=reranker, vectorstore=vectorstore)
+			# Waiting for another query's answer needs no slot
+			if similarReply is not None:
+				if metrics is not None: metrics.increment("coalesced")
+				await Discord.replyWithinCharacterLimit(source, reply := await similarReply)
+			if result is not None: result.set_result(reply)
+		# Cache for future
+		if cache is not None and queryEmbedding is not None and response is not None:
+			cache[query] = (response, queryEmbedding)
+			if cache.hasDiskTier: await runBlocking(executor, cache.storeOnDisk, query, (response, queryEmbedding))
 
 
-async def message_clear(source: Interaction | Message, *, objects: Iterable[Cache | Group | Requests | Vectorstore]) -> None:
+async def message_clear(source: Interaction | Message, *, executor: Executor | None = None, objects: Iterable[Cache | Group | Requests | Vectorstore]) -> None:
 	"""(Trusted command) Clears the specified object."""
-	for obj in objects: obj.clear()
+	# Clearing the vectorstore logs it to disk, so is done on the executor
+	for obj in objects: await runBlocking(executor, obj.clear) if isinstance(obj, Vectorstore) else obj.clear()
 	await Discord.indicateSuccess(source)
 
 
@@ -96,13 +181,61 @@ async def message_getsize(source: Interaction | Message, *, obj: Cache | Group |
 	await Discord.replyWithinCharacterLimit(source, f"{len(obj)}.")
 
 
-async def message_load(source: Interaction | Message, filepaths: Iterable[str] | None = None, *, objects: Iterable[Cache | Group | Requests | Vectorstore], trustedGroup: Group | None = None) -> None:
+async def message_ingest(
+	source: Interaction | Message,
+	channel: StageChannel | TextChannel | Thread | VoiceChannel,
+	checkpoint: str | None = None,
+	*,
+	executor: Executor | None = None,
+	metrics: Metrics | None = None,
+	permittingGroup: Group,
+	vectorstore: Vectorstore
+) -> None:
+	"""(Owner command) Adds the provided channel's messages by permitting users to the vectorstore, oldest first and in large batches, resuming after the checkpoint message if one is provided."""
+	# The checkpoint may be a message's ID or URL
+	try:
+		after = Object(int(checkpoint.strip().rstrip("/").rsplit("/", 1)[-1])) if checkpoint is not None else None
+	except ValueError: return await Discord.indicateFailure(source, MessagesTexts.INGEST__INVALID_CHECKPOINT[LANGUAGE])
+	progressMessage = (await Discord.replyWithinCharacterLimit(source, MessagesTexts.INGEST__STARTED[LANGUAGE].replace("[channel]", channel.mention)))[-1]
+	# Edit the progress message as a channel message, since interaction responses can only be edited for 15 minutes
+	progressMessage = progressMessage.channel.get_partial_message(progressMessage.id)
+	scannedCount = addedMessageCount = addedTextCount = 0
+	lastScannedMessage: Message | None = None
+	batch: list[Message] = []
+
+	def populateProgress(text: str) -> str:
+		return text.replace("[channel]", channel.mention).replace("[scanned]", f"{scannedCount}").replace("[messages]", f"{addedMessageCount}").replace("[texts]", f"{addedTextCount}").replace("[checkpoint]", f"{lastScannedMessage.id if lastScannedMessage is not None else checkpoint}")
+
+	async def addBatch() -> None:
+		nonlocal addedMessageCount, addedTextCount
+		if not batch: return
+		# Embedding a whole batch at once is far faster than embedding each message separately
+		with timeStage(metrics, "vectorstore_add"): addedTextCount += (await runBlocking(executor, vectorstore.add, [message.content for message in batch], [message.jump_url for message in batch], [message.author.id for message in batch]))[0]
+		addedMessageCount += len(batch)
+		batch.clear()
+		# Every scanned message has now been either added or skipped, so the last one is a safe checkpoint to resume after
+		await progressMessage.edit(content=populateProgress(MessagesTexts.INGEST__PROGRESS[LANGUAGE]))
+
+	try:
+		async for message in channel.history(limit=None, after=after, oldest_first=True):
+			scannedCount += 1
+			lastScannedMessage = message
+			# Only add messages whose authors permitted it, skipping any already added (e.g. by a previous, interrupted ingestion)
+			if not message.author.bot and message.author.id in permittingGroup and message.content and message.jump_url not in vectorstore: batch.append(message)
+			if len(batch) >= VECTORSTORE_INGESTION_BATCH_SIZE: await addBatch()
+		await addBatch()
+	except Forbidden: return await Discord.indicateFailure(source, populateProgress(MessagesTexts.INGEST__ERROR[LANGUAGE]))
+	await progressMessage.edit(content=populateProgress(MessagesTexts.INGEST__COMPLETE[LANGUAGE]))
+
+
+async def message_load(source: Interaction | Message, filepaths: Iterable[str] | None = None, *, metrics: Metrics | None = None, objects: Iterable[Cache | Group | Requests | Vectorstore], trustedGroup: Group | None = None) -> None:
 	"""(Trusted command) Loads the object from the provided filepath, or the last-used filepath if none is provided."""
 	for obj, filepath in (zip(objects, filepaths if filepaths is not None else repeat(None))):
 		if filepath is not None and trustedGroup is not None and not obj.verify(filepath):
 			trustedGroup.remove(source.user.id if isinstance(source, Interaction) else source.author.id)
 			return await Discord.indicateFailure(source, MessagesTexts.DANGEROUS_FILEPATH[LANGUAGE])
-		if not obj.load(filepath):
+		with timeStage(metrics, "load", object=type(obj).__name__): loaded = obj.load(filepath)
+		if not loaded:
 			return await Discord.indicateFailure(source, MessagesTexts.LOAD__ERROR[LANGUAGE])
 	await Discord.indicateSuccess(source)
 
@@ -112,13 +245,20 @@ async def message_ping(interaction: Interaction | Message, *, bot: Bot) -> None:
 	await Discord.replyWithinCharacterLimit(interaction, MessagesTexts.PING[LANGUAGE].replace("[latency]", f"{bot.latency:.2g}"))
 
 
-async def message_remove(source: Interaction | Message, *entries: str, obj: Group | Vectorstore) -> None:
+async def message_remove(source: Interaction | Message, *entries: str, executor: Executor | None = None, obj: Group | Vectorstore) -> None:
 	"""(Trusted command) Removes the specified entries from the specified object."""
 	savedCount = 0
 	if isinstance(obj, Vectorstore):
 		if isinstance(source, Message) and len([word for text in entries for word in text.split()]) == len(entries):
 			return await Discord.indicateFailure(source, MessagesTexts.REMOVE__SINGLE_WORDS_ONLY[LANGUAGE])
-		savedCount = obj.remove(entries)
+		# Message URLs remove those messages' texts, user mentions/IDs remove all of those users' texts, and anything else removes matching texts
+		# Removals are logged to disk (and may rebuild the search index), so are done on the executor
+		savedCount = sum([
+			await runBlocking(executor, obj.removeBySource, entry) if entry.startswith("https://")
+			else await runBlocking(executor, obj.removeByAuthor, int(entry.strip("<@!> "))) if entry.strip("<@!> ").isdigit()
+			else await runBlocking(executor, obj.remove, entry)
+			for entry in entries
+		])
 	elif isinstance(obj, Group):
 		savedCount = obj.remove([int(entry.strip("<@!> ")) for entry in entries])
 
@@ -127,17 +267,43 @@ async def message_remove(source: Interaction | Message, *entries: str, obj: Grou
 	await Discord.indicateSuccess(source)
 
 
-async def message_save(source: Interaction | Message, filepaths: Iterable[str] | None = None, *, objects: Iterable[Cache | Group | Requests | Vectorstore], trustedGroup: Group | None = None) -> None:
+async def message_save(source: Interaction | Message, filepaths: Iterable[str] | None = None, *, metrics: Metrics | None = None, objects: Iterable[Cache | Group | Requests | Vectorstore], trustedGroup: Group | None = None) -> None:
 	"""(Trusted command) Saves the object to the provided filepath, or the last-used filepath if none is provided."""
 	for obj, filepath in (zip(objects, filepaths if filepaths is not None else repeat(None))):
 		if filepath is not None and trustedGroup is not None and not obj.verify(filepath):
 			trustedGroup.remove(source.user.id if isinstance(source, Interaction) else source.author.id)
 			return await Discord.indicateFailure(source, MessagesTexts.DANGEROUS_FILEPATH[LANGUAGE])
-		if not obj.save(filepath):
+		with timeStage(metrics, "save", object=type(obj).__name__): saved = obj.save(filepath)
+		if not saved:
 			return await Discord.indicateFailure(source, MessagesTexts.SAVE__ERROR[LANGUAGE])
 	await Discord.indicateSuccess(source)
 
 
+async def message_stats(source: Interaction | Message, *, metrics: Metrics) -> None:
+	"""(Owner command) Shows the hit rates, error counts, and timings recorded so far."""
+	def formatRate(count: int, total: int) -> str:
+		return f"{count/total:.1%}" if total else "-"
+
+	queryCount = metrics.getCount("queries")
+	retrievalCount = metrics.getCount("retrieval_hits") + metrics.getCount("retrieval_misses")
+	timings = "\n".join(MessagesTexts.STATS__TIMING[LANGUAGE].replace(
+		"[stage]", name + "".join(f" ({value})" for value in labels.values())
+	).replace("[count]", f"{count}").replace("[mean]", f"{1000*mean:.3g}").replace("[median]", f"{1000*median:.3g}").replace("[p95]", f"{1000*p95:.3g}") for name, labels, count, mean, median, p95 in metrics.getTimings())
+	await Discord.replyWithinCharacterLimit(source, MessagesTexts.STATS[LANGUAGE].replace(
+		"[queries]", f"{queryCount}"
+	).replace("[cooldowns]", f"{metrics.getCount('cooldowns')}").replace(
+		"[exactHitRate]", formatRate(metrics.getCount("cache_exact_hits"), queryCount)
+	).replace(
+		"[semanticHitRate]", formatRate(metrics.getCount("cache_semantic_hits"), queryCount)
+	).replace(
+		"[coalescedRate]", formatRate(metrics.getCount("coalesced"), queryCount)
+	).replace(
+		"[retrievalHitRate]", formatRate(metrics.getCount("retrieval_hits"), retrievalCount)
+	).replace("[aiErrors]", f"{metrics.getCount('ai_errors')}").replace("[rateLimits]", f"{metrics.getCount('rate_limited')}").replace(
+		"[bulkDeletions]", f"{metrics.getCount('bulk_deletions')}"
+	).replace("[timings]", timings or MessagesTexts.STATS__NO_TIMINGS[LANGUAGE]))
+
+
 async def message_blocked(source: Interaction | Message) -> None:
 	"""Returns that the user cannot run the provided command."""
 	await Discord.replyWithinCharacterLimit(source, MessagesTexts.BLOCKED[LANGUAGE])
@@ -148,4 +314,8 @@ async def message_notTrusted(source: Interaction | Message, command: str) -> Non
 
 async def message_notOwner(source: Interaction | Message, command: str) -> None:
 	"""Returns that the user cannot run the provided command."""
-	await Discord.replyWithinCharacterLimit(source, MessagesTexts.NOT_OWNER[LANGUAGE].replace("[command]", f"{command}"))
\ No newline at end of file
+	await Discord.replyWithinCharacterLimit(source, MessagesTexts.NOT_OWNER[LANGUAGE].replace("[command]", f"{command}"))
+
+async def message_warmingUp(source: Interaction | Message) -> None:
+	"""Returns that the command cannot be run until the bot has finished loading."""
+	await Discord.replyWithinCharacterLimit(source, MessagesTexts.WARMING_UP[LANGUAGE])
\ No newline at end of file
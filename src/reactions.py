@@ -1,3 +1,4 @@
+from asyncio import gather
 from discord import Interaction, Member, Message, Reaction, User
 from discord.ext.commands import Bot # type: ignore
 from typing import overload
@@ -5,57 +6,64 @@ from typing import overload
 from Settings import *
 from src.components.group import Group
 from src.components.discord import Discord
+from src.components.executor import Executor
+from src.components.metrics import Metrics, timeStage
+from src.components.outbox import Outbox
 from src.components.requests import Requests
+from Translations import RequestsTexts, getLanguagePlural
 
 # TODO: Migrate to requests.py
 
 @overload
-async def reaction_newOrUpdateRequest(source: Reaction | Message, requestingMessageOrUser: Interaction | Message, *, requests: Requests) -> None:
+async def reaction_newOrUpdateRequest(source: Reaction | Message, requestingMessageOrUser: Interaction | Message, *, requests: Requests, bot: Bot) -> bool:
 	raise NotImplementedError
 
 @overload
-async def reaction_newOrUpdateRequest(source: Reaction | Message, requestingMessageOrUser: Member | User, *, requests: Requests) -> None:
+async def reaction_newOrUpdateRequest(source: Reaction | Message, requestingMessageOrUser: Member | User, *, requests: Requests, bot: Bot) -> bool:
 	raise NotImplementedError
 
-async def reaction_newOrUpdateRequest(source: Reaction | Message, requestingMessageOrUser: Interaction | Message | Member | User, *, requests: Requests) -> None:
-	"""(Trusted event) Creates a new request for a vectorstore/permitting group addition."""
+async def reaction_newOrUpdateRequest(source: Reaction | Message, requestingMessageOrUser: Interaction | Message | Member | User, *, requests: Requests, bot: Bot) -> bool:
+	"""(Trusted event) Creates a new request for a vectorstore/permitting group addition. Returns False if the requester already has too many pending requests, which they are told of."""
 	desiredMessage = source.message if isinstance(source, Reaction) else source
 	requester = requestingMessageOrUser.user if isinstance(requestingMessageOrUser, Interaction) else requestingMessageOrUser if isinstance(requestingMessageOrUser, (Member, User)) else requestingMessageOrUser.author
-	# Check each existing pending request whose recipient matches the message's author
-	for requestMessage, requestData in ((m, d) for m, d in requests.items() if desiredMessage.author.id == d["recipientID"]):
-		# Update the desired messages or requester IDs if necessary.
-		dataChanged = False
-		if desiredMessage not in requestData["desiredMessages"]:
-			requestData["desiredMessages"].append(desiredMessage)
-			dataChanged = True
-		if requester.id not in requestData["requesterIDs"]:
-			requestData["requesterIDs"].append(requester.id)
-			dataChanged = True
-		# If anything changed, edit the existing message
-		if dataChanged:
-			await Discord.editWithinCharacterLimit(requestMessage, requests.populateMessage(requestData))
-		break
+	if not requests.canRequest(requester.id, desiredMessage.author.id):
+		pendingRequests = requests.getByRequester(requester.id)
+		await Discord.replyWithinCharacterLimit(requestingMessageOrUser if isinstance(requestingMessageOrUser, (Interaction, Message)) else desiredMessage, RequestsTexts.TOO_MANY_PENDING[LANGUAGE].replace("[requesterID]", f"<@{requester.id}>").replace("[count]", f"{len(pendingRequests)}").replace("[plural]", getLanguagePlural(LANGUAGE, len(pendingRequests))).replace("[requestMessageLinks]", "\n".join(f"- {requestData['requestMessageURL']}" for _, requestData in pendingRequests)))
+		return False
+	# If a pending request already exists for the message's author, add to it, editing its message if anything changed
+	if (existingRequest := requests.getByRecipient(desiredMessage.author.id)) is not None:
+		requestData = existingRequest[1]
+		if (requestMessage := Discord.getPartialMessage(requestData["requestMessageURL"], bot=bot)) is not None and requests.add(requestMessage, requesterIDs=requester.id, desiredMessages=desiredMessage):
+			await Discord.editWithinCharacterLimit(requestMessage, requests.populateMessage(requestData)) # type: ignore
 	# Otherwise if no pending request exists for the recipient:
 	else:
 		requestMessages = await Discord.replyWithinCharacterLimit(requestingMessageOrUser if isinstance(requestingMessageOrUser, (Interaction, Message)) else desiredMessage, requests.populateMessage({
+			"requestMessageURL": "",
 			"recipientID": desiredMessage.author.id,
 			"requesterIDs": [requester.id],
-			"desiredMessages": [desiredMessage],
-			"previousRequestMessages": []
+			"desiredMessageURLs": [desiredMessage.jump_url],
+			"previousRequestMessageURLs": []
 		}))
+		# Added one after the other, since reactions are shown in the order they were added (and share a rate limit, so adding both at once would be no faster)
 		await Discord.tryAddReaction(requestMessages[-1], "✅")
 		await Discord.tryAddReaction(requestMessages[-1], "❌")
 		requests.add(requestMessages[-1], desiredMessage.author.id, [requester.id], [desiredMessage], requestMessages[:-1])
+	return True
 
-async def reaction_answerRequest(source: Message | Reaction, yes: bool, *, requests: Requests, bot: Bot) -> None:
+async def reaction_answerRequest(source: Message | Reaction, yes: bool, *, requests: Requests, bot: Bot, executor: Executor | None = None, outbox: Outbox, metrics: Metrics | None = None) -> None:
 	"""Handles a response to a request."""
 	sourceMessage = source.message if isinstance(source, Reaction) else source
 	# We should ultimately delete the request message UNLESS the request was self/permitting-added (i.e. no request message was ever sent)
-	messagesToDelete = ([sourceMessage] if isinstance(requests.associatedObject, Group) or sourceMessage in requests else []) + (record["previousRequestMessages"] if (record := requests[sourceMessage]) is not None else [])
-	if not requests.resolve(sourceMessage, yes): return await Discord.indicateFailure(sourceMessage)
+	record = requests[sourceMessage]
+	messagesToDelete = ([sourceMessage] if isinstance(requests.associatedObject, Group) or record is not None else []) + ([previousRequestMessage for url in record["previousRequestMessageURLs"] if (previousRequestMessage := Discord.getPartialMessage(url, bot=bot)) is not None] if record is not None else [])
+	with timeStage(metrics, "requests_resolve"): resolution = await requests.resolve(sourceMessage, yes, bot=bot, executor=executor)
+	if resolution is None: return await Discord.indicateFailure(sourceMessage)
+	addedCount, skippedCount = resolution
 	# Indicate success, then delete all relevant messages (or simply remove reaction if no messages should be deleted)
-	if yes: await Discord.tryAddReaction(sourceMessage, "👍")
+	# The request messages are about to be deleted, so report skipped duplicates (or that the requested messages were all deleted) in the channel rather than as a reply; that and the thumbs-up are independent, so are sent at once
+	notice = RequestsTexts.DUPLICATES_SKIPPED[LANGUAGE].replace("[count]", f"{skippedCount}").replace("[plural]", getLanguagePlural(LANGUAGE, skippedCount)) if skippedCount else RequestsTexts.NOTHING_ADDED[LANGUAGE] if yes and not addedCount else None
+	await gather(*([Discord.tryAddReaction(sourceMessage, "👍")] if yes else []), *([sourceMessage.channel.send(notice)] if notice is not None else []))
 	if messagesToDelete:
-		# Only wait on the last message and if the answer was yes (so user can see the thumbs-up)
-		for message in messagesToDelete: await message.delete(delay=0.75*yes*(message == sourceMessage))
+		# Only wait if the answer was yes (so user can see the thumbs-up), then delete them all together
+		await outbox.delete(messagesToDelete, delay=0.75*yes)
 	elif yes and bot.user is not None: await Discord.tryRemoveReaction(sourceMessage, "👍", bot.user)
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The bot's modules import each other from the repository root, as when Main.py is run
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,97 @@
+# Checks that saving and loading the cache keeps its entries, their embeddings and their remaining lifetimes, and drops the entries that have expired, and that its semantic index only ever holds stored entries.
+from struct import calcsize, pack_into
+from time import sleep
+
+from numpy import allclose, float64
+import pytest
+
+from benchmarks.ask import HashingEmbedder
+from src.components import saveableClass
+from src.components.cache import Cache
+
+_QUERIES: list[str] = ["How do I reset my password?", "Where are the server rules?", "Which roles can moderate the forum?", "When is the next community event?"]
+_EXPIRATION_TIME: float = 3600.
+
+@pytest.fixture
+def filepath(tmp_path, monkeypatch: pytest.MonkeyPatch) -> str:
+	"""A cache file beside a stand-in for Main.py, since caches are only saved and loaded under the bot's directory."""
+	monkeypatch.setattr(saveableClass, "argv", [str(tmp_path/"Main.py")])
+	return str(tmp_path/"data"/"cache.bin")
+
+def _fill(cache: Cache, embedder: HashingEmbedder) -> None:
+	for query in _QUERIES: cache[query] = (f"Answer to: {query}", embedder.embedOne(query))
+
+def _remainingLifetime(cache: Cache, query: str) -> float:
+	assert cache._cache is not None
+	return cache._cache[query][1] - cache._cache.timer()
+
+def test_saveAndLoadKeepEntries(filepath: str) -> None:
+	embedder = HashingEmbedder()
+	cache = Cache(embedder, 100, _EXPIRATION_TIME, 0.9, filepath)
+	_fill(cache, embedder)
+	# Promoted with a shorter lifetime than the rest
+	cache.promote("What is the bot?", ("A helper.", embedder.embedOne("What is the bot?"), 60.))
+	remainingLifetimes = {query: _remainingLifetime(cache, query) for query in _QUERIES + ["What is the bot?"]}
+	assert cache.save()
+	assert not cache.hasUnsavedChanges
+
+	loaded = Cache(embedder, 100, _EXPIRATION_TIME, 0.9, filepath)
+	assert len(loaded) == len(_QUERIES) + 1
+	for query in _QUERIES: assert loaded.getExactMatch(query) == f"Answer to: {query}"
+	assert loaded.getExactMatch("What is the bot?") == "A helper."
+	for query, remainingLifetime in remainingLifetimes.items(): assert remainingLifetime - 1. < _remainingLifetime(loaded, query) <= remainingLifetime
+	assert allclose(loaded._index.getEmbeddings(_QUERIES), [embedder.embedOne(query) for query in _QUERIES], atol=1e-6)
+	# The loaded embeddings still answer semantic lookups
+	assert loaded.getSemanticMatch("how do i reset my password") == "Answer to: How do I reset my password?"
+	assert not loaded.hasUnsavedChanges
+
+def test_loadDropsExpiredEntries(filepath: str) -> None:
+	embedder = HashingEmbedder()
+	cache = Cache(embedder, 100, _EXPIRATION_TIME, 0.9, filepath)
+	_fill(cache, embedder)
+	cache.promote("What is the bot?", ("A helper.", embedder.embedOne("What is the bot?"), 0.5))
+	assert cache.save()
+	# Saved entries are ordered soonest-expiring first, so the first remaining lifetime is the promoted entry's: mark it as having run out
+	with open(filepath, "r+b") as f:
+		header = bytearray(f.read(calcsize(Cache._FILE_HEADER_FORMAT) + float64().itemsize))
+		pack_into("<d", header, calcsize(Cache._FILE_HEADER_FORMAT), -1.)
+		f.seek(0)
+		f.write(header)
+
+	loaded = Cache(embedder, 100, _EXPIRATION_TIME, 0.9, filepath)
+	assert len(loaded) == len(_QUERIES)
+	assert loaded.getExactMatch("What is the bot?") is None
+	assert loaded.getSemanticMatch("What is the bot?") is None
+	for query in _QUERIES: assert loaded.getExactMatch(query) == f"Answer to: {query}"
+
+def test_loadedEntriesExpireAfterTheirRemainingLifetime(filepath: str) -> None:
+	embedder = HashingEmbedder()
+	cache = Cache(embedder, 100, _EXPIRATION_TIME, 0.9, filepath)
+	_fill(cache, embedder)
+	cache.promote("What is the bot?", ("A helper.", embedder.embedOne("What is the bot?"), 0.2))
+	assert cache.save()
+
+	loaded = Cache(embedder, 100, _EXPIRATION_TIME, 0.9, filepath)
+	assert loaded.getExactMatch("What is the bot?") == "A helper."
+	sleep(0.3)
+	assert loaded.getExactMatch("What is the bot?") is None
+	assert loaded.getSemanticMatch("What is the bot?") is None
+	assert len(loaded) == len(_QUERIES)
+
+def test_promotingAnExpiredEntryStoresNothing() -> None:
+	embedder = HashingEmbedder()
+	cache = Cache(embedder, 100, _EXPIRATION_TIME, 0.9)
+	cache.promote("What is the bot?", ("A helper.", embedder.embedOne("What is the bot?"), 0.))
+	assert len(cache) == 0
+	assert "What is the bot?" not in cache._index
+	assert not cache.hasUnsavedChanges
+
+def test_deletingAMissingKeyLeavesTheIndexUntouched() -> None:
+	embedder = HashingEmbedder()
+	cache = Cache(embedder, 100, _EXPIRATION_TIME, 0.9)
+	_fill(cache, embedder)
+	assert cache._cache is not None
+	with pytest.raises(KeyError): del cache._cache["Not a cached query"]
+	del cache._cache[_QUERIES[0]]
+	assert _QUERIES[0] not in cache._index
+	assert len(cache._index) == len(_QUERIES) - 1
@@ -0,0 +1,74 @@
+# Checks that Discord.splitIntoSentences and Discord.truncate, which find segment boundaries by searching windows of the text, split randomized texts exactly as the original implementation (kept below as the reference) did.
+from random import Random
+
+import pytest
+
+from src.components.discord import Discord
+
+_ALPHABET: str = "ab1 .!?)\n\t"
+_SEEDS: range = range(8)
+_TEXTS_PER_SEED: int = 1500
+
+def _findSentenceEnd(text: str, minimumLength: int, desiredCharacterLimit: int) -> int:
+	"""The original Discord.findSentenceEnd."""
+	if desiredCharacterLimit <= 0: raise ValueError(f"Invalid desired character limit provided: {desiredCharacterLimit}")
+	if len(text) < desiredCharacterLimit: return len(text)
+	SENTENCE_ENDING_CHARACTERS = {".", "!", "?", ")", "\n"}
+	for i in range(desiredCharacterLimit, minimumLength + 1, -1):
+		if text[i].isspace() and text[i - 1] in SENTENCE_ENDING_CHARACTERS and not text[i - 2].isspace(): return i
+	for i in range(desiredCharacterLimit, minimumLength + 1, -1):
+		if text[i].isspace() and text[i - 1] in SENTENCE_ENDING_CHARACTERS: return i
+	for i in range(desiredCharacterLimit, minimumLength, -1):
+		if text[i].isspace() and text[i - 1].isalnum(): return i
+	for i in range(desiredCharacterLimit, minimumLength, -1):
+		if text[i].isspace(): return i
+	return desiredCharacterLimit
+
+def _splitIntoSentences(text: str, desiredCharacterLimit: int, *, overlapSentences: bool = False) -> list[str]:
+	"""The original Discord.splitIntoSentences, which re-sliced the remaining text after every segment."""
+	segments: list[str] = []
+	minimumLength = int(0.2*desiredCharacterLimit)
+	while len(text) > desiredCharacterLimit:
+		i = _findSentenceEnd(text, minimumLength, desiredCharacterLimit)
+		segments.append(text[:i])
+		if overlapSentences:
+			for i in range(int(i * 0.85), 1, -1):
+				if text[i].isalnum() and text[i - 1].isspace(): break
+		text = text[i:]
+	return segments + [text]
+
+def _truncate(text: str, desiredCharacterLimit: int) -> str:
+	"""The original Discord.truncate."""
+	if not (splitText := _splitIntoSentences(text, desiredCharacterLimit - 1)): return ""
+	return splitText[0] + ("…" if len(splitText) > 1 else "")
+
+def _outcome(function, *args, **kwargs) -> tuple[str, object]:
+	"""Returns the provided function's result, or the type of exception it raised, so that both implementations' failures can be compared too."""
+	try:
+		return "result", function(*args, **kwargs)
+	except Exception as e:
+		return "error", type(e)
+
+def _randomTexts(seed: int):
+	"""Yields texts of random lengths made of the characters that decide boundaries, alongside random limits (including invalid ones)."""
+	random = Random(seed)
+	for _ in range(_TEXTS_PER_SEED):
+		yield "".join(random.choices(_ALPHABET, k=random.randrange(0, 120))), random.randrange(-1, 41)
+
+@pytest.mark.parametrize("seed", _SEEDS)
+@pytest.mark.parametrize("overlapSentences", (False, True))
+def test_splitIntoSentencesMatchesOriginal(seed: int, overlapSentences: bool) -> None:
+	for text, limit in _randomTexts(seed):
+		assert _outcome(Discord.splitIntoSentences, text, limit, overlapSentences=overlapSentences) == _outcome(_splitIntoSentences, text, limit, overlapSentences=overlapSentences), (text, limit)
+
+@pytest.mark.parametrize("seed", _SEEDS)
+def test_truncateMatchesOriginal(seed: int) -> None:
+	for text, limit in _randomTexts(seed):
+		assert _outcome(Discord.truncate, text, limit) == _outcome(_truncate, text, limit), (text, limit)
+
+def test_splitIntoSentencesMatchesOriginalOnLongText() -> None:
+	random = Random(0)
+	text = " ".join("".join(random.choices("abc", k=random.randrange(1, 12))) + random.choice(("", "", ".", "!", "?\n", ")")) for _ in range(20000))
+	for limit in (50, 512, 2000):
+		for overlapSentences in (False, True):
+			assert Discord.splitIntoSentences(text, limit, overlapSentences=overlapSentences) == _splitIntoSentences(text, limit, overlapSentences=overlapSentences)
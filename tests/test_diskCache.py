@@ -0,0 +1,34 @@
+# Checks that the disk tier keeps matching and evicting new entries after its semantic index grew past the approximate search minimum size and then shrank through expiry.
+from time import sleep
+
+from numpy import float32
+from numpy.random import default_rng
+
+from src.components.diskCache import DiskCache
+
+_DIMENSION: int = 32
+_MINIMUM_SIZE: int = 100
+_EXPIRATION_TIME: float = 1.
+
+def test_newEntriesMatchAfterExpiryShrinksTheIndex(tmp_path) -> None:
+	vectors = default_rng(0).standard_normal((121, _DIMENSION)).astype(float32)
+	diskCache = DiskCache(str(tmp_path/"cache.sqlite3"), 1000, _EXPIRATION_TIME, 0.99, _MINIMUM_SIZE)
+	try:
+		for i in range(60): diskCache[f"old {i}"] = (f"old answer {i}", vectors[i])
+		sleep(_EXPIRATION_TIME/2)
+		for i in range(60, 120): diskCache[f"recent {i}"] = (f"recent answer {i}", vectors[i])
+		assert diskCache._index._approximateIndex is not None
+		# The old entries expire, and are dropped when the next entry is written
+		sleep(_EXPIRATION_TIME/2 + .1)
+		diskCache["new"] = ("new answer", vectors[120])
+		assert len(diskCache) == 61
+		assert diskCache.getSemanticKey(vectors[120]) == "new"
+		assert (entry := diskCache.getEntry("new")) is not None and entry[0] == "new answer"
+		# Overwriting replaces the matched embedding
+		diskCache["new"] = ("newer answer", vectors[0])
+		assert diskCache.getSemanticKey(vectors[0]) == "new"
+		# Every entry, including the new one, expires without errors
+		sleep(_EXPIRATION_TIME + .1)
+		assert diskCache.getSemanticKey(vectors[0]) is None
+		assert len(diskCache) == 0
+	finally: diskCache.close()
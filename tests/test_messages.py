@@ -0,0 +1,84 @@
+# Checks that answering many /ask queries at once neither blocks the event loop nor answers them one at a time, and that changes to the vectorstore are made off the event loop, using the /ask benchmark's stub model, fake messages, and hashed embeddings.
+from asyncio import create_task, gather, run, sleep
+from threading import current_thread
+from time import perf_counter, sleep as blockingSleep
+
+from pydantic import SecretStr
+
+from benchmarks.ask import FakeMessage, HashingEmbedder, StageTimer, StubChatModel, makeCorpus
+from Settings import AI_MAX_INPUT_CHARACTERS, AI_MAX_OUTPUT_CHARACTERS, AI_SYSTEM_PROMPT, AI_TEMPERATURE, CACHE_SEMANTIC_SIMILARITY_THRESHOLD, VECTORSTORE_SEGMENT_SIZE
+from src.components.ai import AI
+from src.components.cache import Cache
+from src.components.executor import Executor
+from src.components.vectorstore import Vectorstore
+from src.messages import message_ask, message_clear, message_remove
+
+_QUERY_COUNT: int = 16
+_LLM_LATENCY: float = 0.2
+_BLOCKING_TIME: float = 0.1 # How long each embedding blocks its thread, standing in for a real model
+_HEARTBEAT_INTERVAL: float = 0.005
+
+def test_concurrentAsksDoNotBlockTheEventLoop() -> None:
+	timer = StageTimer()
+	embedder = HashingEmbedder()
+	hashedEmbedOne = embedder.embedOne
+	def slowEmbedOne(text: str):
+		blockingSleep(_BLOCKING_TIME)
+		return hashedEmbedOne(text)
+	embedder.embedOne = slowEmbedOne # type: ignore
+	texts, questions = makeCorpus(200, 0)
+	vectorstore = Vectorstore(embedder, None, 0., VECTORSTORE_SEGMENT_SIZE)
+	vectorstore.add(texts)
+	cache = Cache(embedder, 100, None, CACHE_SEMANTIC_SIMILARITY_THRESHOLD)
+	ai = AI(SecretStr("test"), AI_SYSTEM_PROMPT, AI_TEMPERATURE, AI_MAX_INPUT_CHARACTERS, AI_MAX_OUTPUT_CHARACTERS)
+	ai._ai = StubChatModel(timer, _LLM_LATENCY, 0., 200) # type: ignore
+	executor = Executor(_QUERY_COUNT, _QUERY_COUNT)
+	sources = [FakeMessage(timer, 0., 1000 + i, 100 + i, 10, question) for i, question in enumerate(questions[:_QUERY_COUNT])]
+
+	async def measure() -> tuple[float, float]:
+		"""Asks every query at once, returning how long they took and the longest the event loop went without running a heartbeat."""
+		longestGap = 0.
+		async def heartbeat() -> None:
+			nonlocal longestGap
+			while True:
+				start = perf_counter()
+				await sleep(_HEARTBEAT_INTERVAL)
+				longestGap = max(longestGap, perf_counter() - start - _HEARTBEAT_INTERVAL)
+		heartbeatTask = create_task(heartbeat())
+		await sleep(0.)
+		start = perf_counter()
+		await gather(*(message_ask(source, source.content, ai=ai, cache=cache, executor=executor, vectorstore=vectorstore) for source in sources)) # type: ignore
+		seconds = perf_counter() - start
+		heartbeatTask.cancel()
+		return seconds, longestGap
+
+	try:
+		seconds, longestGap = run(measure())
+	finally: executor.shutdown()
+	# Every query was answered by the stub model, and each answer was replied
+	assert len(timer.durations["llm"]) == _QUERY_COUNT
+	assert len(timer.durations["send"]) >= _QUERY_COUNT
+	# Answered concurrently, rather than one after another
+	assert seconds < _QUERY_COUNT*(_LLM_LATENCY + _BLOCKING_TIME)/2
+	# No embedding ever ran on the event loop
+	assert longestGap < _BLOCKING_TIME/2
+
+def test_vectorstoreChangesRunOnTheExecutor() -> None:
+	timer = StageTimer()
+	vectorstore = Vectorstore(HashingEmbedder(), None, 0., VECTORSTORE_SEGMENT_SIZE)
+	vectorstore.add(["The server rules are pinned in the rules channel.", "Events are announced a week ahead."], ["https://discord.com/channels/10/100/1000", None])
+	threadNames: list[str] = []
+	for name in ("remove", "removeBySource", "removeByAuthor", "clear"):
+		def recordThread(*args, change=getattr(vectorstore, name), **kwargs):
+			threadNames.append(current_thread().name)
+			return change(*args, **kwargs)
+		setattr(vectorstore, name, recordThread)
+	executor = Executor(1, 1)
+	source = FakeMessage(timer, 0., 1000, 100, 10)
+	async def change() -> None:
+		await message_remove(source, "https://discord.com/channels/10/100/1000", "Events are announced a week ahead.", executor=executor, obj=vectorstore) # type: ignore
+		await message_clear(source, executor=executor, objects=(vectorstore,)) # type: ignore
+	try: run(change())
+	finally: executor.shutdown()
+	assert len(threadNames) == 3
+	assert all(threadName.startswith("Executor") for threadName in threadNames)
@@ -0,0 +1,49 @@
+# Checks that the requests store's requester index stays consistent as requests are made, joined, resolved and reloaded, and limits each requester's pending requests.
+from types import SimpleNamespace
+
+import pytest
+
+from src.components import saveableClass
+from src.components.group import Group
+from src.components.requests import Requests
+
+def _message(id: int, authorID: int = 0) -> SimpleNamespace:
+	"""Stands in for a Discord message, of which requests only keep the ID, jump URL and author."""
+	return SimpleNamespace(id=id, jump_url=f"https://discord.com/channels/10/100/{id}", author=SimpleNamespace(id=authorID))
+
+@pytest.fixture
+def filepath(tmp_path, monkeypatch: pytest.MonkeyPatch) -> str:
+	"""A requests file beside a stand-in for Main.py, since requests are only saved and loaded under the bot's directory."""
+	monkeypatch.setattr(saveableClass, "argv", [str(tmp_path/"Main.py")])
+	return str(tmp_path/"data"/"requests.json")
+
+def test_requesterIndex(filepath: str) -> None:
+	requests = Requests(Group(), "[recipientID]", filepath, 2)
+	requests.add(_message(1), 501, [7], [_message(11, 501)])
+	requests.add(_message(2), 502, [8], [_message(12, 502)])
+	# Joining another requester's request
+	requests.add(_message(2), requesterIDs=7, desiredMessages=_message(13, 502))
+	assert [requestMessageID for requestMessageID, _ in requests.getByRequester(7)] == [1, 2]
+	assert [requestMessageID for requestMessageID, _ in requests.getByRequester(8)] == [2]
+
+	# At the limit, only requests already joined can be added to
+	assert not requests.canRequest(7, 503)
+	assert requests.canRequest(7, 502)
+	assert requests.canRequest(8, 503)
+
+	assert requests.save()
+	reloaded = Requests(Group(), "[recipientID]", filepath, 2)
+	assert [requestMessageID for requestMessageID, _ in reloaded.getByRequester(7)] == [1, 2]
+
+	# Resolving a request frees up its requesters
+	assert reloaded.remove(_message(1))
+	assert [requestMessageID for requestMessageID, _ in reloaded.getByRequester(7)] == [2]
+	assert reloaded.canRequest(7, 503)
+	reloaded.clear()
+	assert reloaded.getByRequester(7) == [] and reloaded.getByRequester(8) == []
+
+def test_noLimitByDefault() -> None:
+	requests = Requests(Group(), "[recipientID]")
+	for i in range(10): requests.add(_message(i), 500 + i, [7], [_message(100 + i, 500 + i)])
+	assert requests.canRequest(7, 600)
+	with pytest.raises(ValueError): Requests(Group(), "[recipientID]", None, 0)
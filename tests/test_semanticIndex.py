@@ -0,0 +1,62 @@
+# Checks that the semantic index keeps finding and removing keys after its approximate index was built and the index then shrank, as happens when cached entries expire.
+from numpy import float32
+from numpy.random import default_rng
+import pytest
+
+from benchmarks.ask import HashingEmbedder
+from src.components.cache import Cache
+from src.components.semanticIndex import SemanticIndex
+
+_DIMENSION: int = 32
+_MINIMUM_SIZE: int = 100
+
+def _vectors(count: int, seed: int = 0):
+	return default_rng(seed).standard_normal((count, _DIMENSION)).astype(float32)
+
+@pytest.fixture
+def shrunkIndex() -> SemanticIndex:
+	"""An index that grew past the approximate search minimum size, then shrank back below it."""
+	index = SemanticIndex(_MINIMUM_SIZE)
+	for i, vector in enumerate(_vectors(120)): index.add(f"k{i}", vector)
+	assert index._approximateIndex is not None
+	for i in range(60): assert index.remove(f"k{i}")
+	return index
+
+def test_addAfterShrinkingIsSearchable(shrunkIndex: SemanticIndex) -> None:
+	vector = _vectors(1, 1)[0]
+	shrunkIndex.add("new", vector)
+	assert (match := shrunkIndex.search(vector)) is not None and match[0] == "new" and match[1] == pytest.approx(1.)
+	# Overwriting replaces the embedding that is searched for
+	replacement = _vectors(1, 2)[0]
+	shrunkIndex.add("new", replacement)
+	assert (match := shrunkIndex.search(replacement)) is not None and match[0] == "new"
+	assert shrunkIndex.remove("new")
+	assert "new" not in shrunkIndex
+	assert (match := shrunkIndex.search(replacement)) is None or match[0] != "new"
+
+def test_everyRemainingKeyIsSearchable(shrunkIndex: SemanticIndex) -> None:
+	vectors = _vectors(120)
+	for i in range(60, 120): assert (match := shrunkIndex.search(vectors[i])) is not None and match[0] == f"k{i}"
+
+def test_shrinkingWellBelowTheMinimumDropsTheApproximateIndex(shrunkIndex: SemanticIndex) -> None:
+	for i in range(60, 120):
+		assert shrunkIndex.remove(f"k{i}")
+		# Every key left stays searchable, whether or not the approximate index is still in use
+		if i + 1 < 120: assert (match := shrunkIndex.search(_vectors(120)[i + 1])) is not None and match[0] == f"k{i + 1}"
+	assert shrunkIndex._approximateIndex is None
+	assert len(shrunkIndex) == 0
+
+def test_cacheOverwritesAndEvictsAfterShrinking() -> None:
+	embedder = HashingEmbedder(_DIMENSION)
+	cache = Cache(embedder, 120, None, 0.99, None, _MINIMUM_SIZE)
+	for i in range(120): cache[f"query {i}"] = (f"answer {i}", embedder.embedOne(f"query {i}"))
+	assert cache._cache is not None
+	for i in range(60): del cache._cache[f"query {i}"]
+	cache["new query"] = ("new answer", embedder.embedOne("new query"))
+	assert cache.getSemanticMatch("new query") == "new answer"
+	cache["new query"] = ("newer answer", embedder.embedOne("new query"))
+	assert cache.getSemanticMatch("new query") == "newer answer"
+	# Filling the cache evicts the least recently used entries, including the new one
+	for i in range(120, 240): cache[f"query {i}"] = (f"answer {i}", embedder.embedOne(f"query {i}"))
+	assert cache.getExactMatch("new query") is None
+	assert len(cache) == 120
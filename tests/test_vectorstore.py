@@ -0,0 +1,67 @@
+# Checks that the vectorstore's changes stay logged alongside its own file when it is saved to or loaded from another filepath, so that they survive a restart, and that it refuses changes it could not log.
+from asyncio import run
+import os
+
+import pytest
+
+from benchmarks.ask import HashingEmbedder
+from src.components import saveableClass
+from src.components.executor import Executor
+from src.components.vectorstore import Vectorstore
+from src.components.warmup import Warmup
+
+@pytest.fixture
+def filepath(tmp_path, monkeypatch: pytest.MonkeyPatch) -> str:
+	"""A vectorstore file beside a stand-in for Main.py, since vectorstores are only saved and loaded under the bot's directory."""
+	monkeypatch.setattr(saveableClass, "argv", [str(tmp_path/"Main.py")])
+	return str(tmp_path/"data"/"vectorstore.bin")
+
+def _texts(vectorstore: Vectorstore) -> set[str]:
+	return {text for text, _, _ in vectorstore._segments.values()}
+
+def test_savingElsewhereKeepsLoggingToTheOwnFile(filepath: str) -> None:
+	embedder = HashingEmbedder()
+	vectorstore = Vectorstore(embedder, filepath)
+	vectorstore.add("The server rules are pinned in the rules channel.")
+	copyFilepath = os.path.join(os.path.dirname(filepath), "copy.bin")
+	assert vectorstore.save(copyFilepath)
+	vectorstore.add("Events are announced a week ahead.")
+	assert not os.path.exists(copyFilepath + Vectorstore._LOG_EXTENSION)
+
+	# A restart loads the own file, and replays both additions from its log
+	assert _texts(Vectorstore(embedder, filepath)) == {"The server rules are pinned in the rules channel.", "Events are announced a week ahead."}
+	# The copy only holds what was stored when it was saved
+	assert _texts(Vectorstore(embedder, copyFilepath)) == {"The server rules are pinned in the rules channel."}
+
+def test_loadingFromElsewhereIsSavedToTheOwnFile(filepath: str, monkeypatch: pytest.MonkeyPatch) -> None:
+	embedder = HashingEmbedder()
+	otherFilepath = os.path.join(os.path.dirname(filepath), "other.bin")
+	other = Vectorstore(embedder, otherFilepath)
+	other.add("Moderators can be reached through the modmail bot.")
+
+	vectorstore = Vectorstore(embedder, filepath)
+	vectorstore.add("This text is replaced by loading.")
+	# Loading from another existing file is otherwise refused as a precaution
+	monkeypatch.setattr(vectorstore, "verify", lambda proposedPath: True)
+	assert vectorstore.load(otherFilepath)
+	vectorstore.add("Roles are assigned in the roles channel.")
+	assert _texts(vectorstore) == {"Moderators can be reached through the modmail bot.", "Roles are assigned in the roles channel."}
+
+	# A restart loads the own file, which now holds what was loaded and every later change
+	assert _texts(Vectorstore(embedder, filepath)) == {"Moderators can be reached through the modmail bot.", "Roles are assigned in the roles channel."}
+	# The other file is left as it was
+	assert _texts(Vectorstore(embedder, otherFilepath)) == {"Moderators can be reached through the modmail bot."}
+
+def test_failedLoadRefusesChanges(filepath: str) -> None:
+	os.makedirs(os.path.dirname(filepath))
+	with open(filepath, "wb") as f: f.write(b"not a vectorstore file"*4)
+	vectorstore = Vectorstore(HashingEmbedder(), filepath, deferLoading=True)
+	executor = Executor(1, 1)
+	warmup = Warmup((("vectorstore", vectorstore.load),), executor)
+	try: run(warmup.wait())
+	finally: executor.shutdown()
+	assert warmup.isReady
+	assert warmup.failedSteps == ("vectorstore",)
+	with pytest.raises(RuntimeError): vectorstore.add("This change could not be logged.")
+	assert len(vectorstore) == 0
+	with open(filepath, "rb") as f: assert f.read() == b"not a vectorstore file"*4